@@ -3,15 +3,19 @@ from flask_cors import CORS
 from routes.preprocess import preprocess_blueprint
 from routes.datasets import datasets_blueprint
 from routes.dashboard import dashboard_blueprint
+from routes.jobs import jobs_blueprint
+from utils import metrics
 import os
 
 app = Flask(__name__)
 #frontend_url = os.getenv("FRONTEND_URL", "*")
-CORS(app, origins=["https://data-optimizer.vercel.app"])
+CORS(app, origins=["https://data-optimizer.vercel.app"], expose_headers=["X-Dataset-Id", "X-Plan-Id", "Content-Disposition"])
 
 app.register_blueprint(preprocess_blueprint, url_prefix='/api/preprocess')
 app.register_blueprint(datasets_blueprint, url_prefix='/api/datasets')
 app.register_blueprint(dashboard_blueprint, url_prefix='/api/dashboard')
+app.register_blueprint(jobs_blueprint, url_prefix='/api/jobs')
+metrics.init_app(app)
 
 if __name__ == '__main__':
     app.run(debug=False) 
\ No newline at end of file
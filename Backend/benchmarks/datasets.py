@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# Deterministic synthetic datasets for the benchmarks. Every knob a hot path
+# is sensitive to can be varied: rows, width, share of missing values,
+# categorical cardinality, outlier rate and duplicate rate.
+
+TARGET = "target"
+
+PRESETS = {
+    "small": {"rows": 10_000},
+    "medium": {"rows": 100_000},
+    "large": {"rows": 1_000_000},
+    "wide": {"rows": 20_000, "numeric": 200, "categorical": 20},
+    "dirty": {"rows": 100_000, "null_ratio": 0.3, "outlier_rate": 0.05, "duplicate_rate": 0.2},
+    "high_cardinality": {"rows": 100_000, "cardinality": 50_000},
+}
+
+DEFAULTS = {
+    "rows": 10_000,
+    "numeric": 8,
+    "categorical": 4,
+    "null_ratio": 0.05,
+    "cardinality": 20,
+    "outlier_rate": 0.01,
+    "duplicate_rate": 0.02,
+    "seed": 0,
+}
+
+
+def options(preset="small", **overrides):
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown dataset preset: choose one of {', '.join(PRESETS)}.")
+    return {**DEFAULTS, **PRESETS[preset], **{k: v for k, v in overrides.items() if v is not None}}
+
+
+def synthetic_frame(rows=10_000, numeric=8, categorical=4, null_ratio=0.05, cardinality=20, outlier_rate=0.01,
+                    duplicate_rate=0.02, seed=0):
+    """A frame with ``numeric`` float columns (``num_0``...), ``categorical``
+    string columns (``cat_0``...) and a numeric ``target`` that depends on
+    a few of them, so feature importance has something to find."""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(numeric):
+        values = rng.normal(loc=i, scale=1 + i % 3, size=rows)
+        outliers = rng.random(rows) < outlier_rate
+        values[outliers] += rng.choice([-1, 1], outliers.sum()) * rng.uniform(10, 50, outliers.sum()) * (1 + i % 3)
+        data[f"num_{i}"] = values
+    for i in range(categorical):
+        # Zipf-like frequencies, as real categorical columns tend to have.
+        weights = 1 / np.arange(1, cardinality + 1)
+        codes = rng.choice(cardinality, size=rows, p=weights / weights.sum())
+        data[f"cat_{i}"] = pd.Categorical.from_codes(codes, [f"c{i}_{k}" for k in range(cardinality)]) \
+            .astype(str)
+    df = pd.DataFrame(data)
+
+    signal = sum(df[f"num_{i}"] * (i + 1) for i in range(min(numeric, 3)))
+    if categorical:
+        signal = signal + df["cat_0"].str.len()
+    df[TARGET] = signal + rng.normal(size=rows)
+
+    if duplicate_rate > 0 and rows > 1:
+        # Overwrite a share of rows with copies of other rows.
+        n = int(rows * duplicate_rate)
+        targets, sources = rng.choice(rows, n, replace=False), rng.choice(rows, n)
+        for col in df.columns:
+            values = df[col].to_numpy(copy=True)
+            values[targets] = values[sources]
+            df[col] = values
+
+    if null_ratio > 0:
+        # Missing values everywhere but the target.
+        for col in df.columns.drop(TARGET):
+            df.loc[rng.random(rows) < null_ratio, col] = np.nan
+    return df
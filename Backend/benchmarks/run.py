@@ -0,0 +1,340 @@
+import argparse
+import fnmatch
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmarks for the preprocessing, dashboard, ingestion and serialization
+# hot paths on synthetic data. Run from Backend/:
+#
+#   python -m benchmarks.run --preset medium --output results.json
+#   python -m benchmarks.run --preset medium --baseline results.json
+#
+# Each case is timed `--repeat` times on fresh input (preparing the input is
+# not timed), then run once more under tracemalloc for its peak allocation.
+# Peak memory covers the benchmark process only, not chart-rendering or
+# batch pool processes. With --baseline, cases slower or hungrier than the baseline by
+# more than the tolerances are listed and the exit status is 1.
+#
+# LLM calls use the local stub backend and the examples index the hashing
+# embedding, so no network access or API keys are needed. Caches go to a
+# temporary directory, so every run computes from scratch. The parallel
+# cases run in parallel on every preset (the row threshold is lifted), with
+# the workers EXECUTION_WORKERS allows, recorded in the results.
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("LLM_STUB_DELAY", "0")
+os.environ.setdefault("LLM_CACHE_DIR", "")
+os.environ.setdefault("EXAMPLES_EMBEDDING", "hashing")
+os.environ.setdefault("METRICS_ENABLED", "0")
+os.environ.setdefault("DATASET_CACHE_DIR", tempfile.mkdtemp(prefix="benchmark-cache-"))
+os.environ.setdefault("EXECUTION_MIN_ROWS", "0")
+
+from benchmarks.datasets import PRESETS, DEFAULTS, TARGET, options, synthetic_frame  # noqa: E402
+from utils import ingest, parallel  # noqa: E402
+from utils.chart_data import chart_payload  # noqa: E402
+from utils.charts import chart_specs, chart_input, correlation_matrix, render_chart  # noqa: E402
+from utils.data_cleaning import compile_plan, preprocess_pipeline  # noqa: E402
+from utils.feature_importance import feature_importances, METHODS as IMPORTANCE_METHODS  # noqa: E402
+from utils.output_formats import OUTPUT_FORMATS, STREAMING_FORMATS, serialize_frame  # noqa: E402
+from utils.streaming import fit_plan_chunked, transform_chunks  # noqa: E402
+
+TIME_TOLERANCE = 0.15
+MEMORY_TOLERANCE = 0.25
+# Differences below this are timer noise, whatever the ratio.
+MIN_SECONDS = 0.005
+CHUNK_ROWS = 50_000
+BATCH_FILES = 8
+
+FULL_CONFIG = {
+    "missing_values_num": {"strategy": "mean"},
+    "missing_values_cat": {"strategy": "mode"},
+    "remove_duplicates": True,
+    "normalize": {"method": "zscore"},
+    "remove_outliers": {"method": "iqr"},
+}
+
+# One case per option of the preprocessing config.
+PIPELINE_CONFIGS = {
+    "remove_na": {"remove_na": True},
+    "impute_mean": {"missing_values_num": {"strategy": "mean"}},
+    "impute_median": {"missing_values_num": {"strategy": "median"}},
+    "impute_mode": {"missing_values_num": {"strategy": "mode"}},
+    "impute_categorical_mode": {"missing_values_cat": {"strategy": "mode"}},
+    "remove_duplicates": {"remove_duplicates": True},
+    "normalize_minmax": {"normalize": {"method": "minmax"}},
+    "normalize_zscore": {"normalize": {"method": "zscore"}},
+    "outliers_iqr": {"remove_outliers": {"method": "iqr"}},
+    "outliers_zscore": {"remove_outliers": {"method": "zscore"}},
+    "outliers_mad": {"remove_outliers": {"method": "mad"}},
+    "outliers_isolation_forest": {"remove_outliers": {"method": "isolation_forest", "contamination": 0.05}},
+    "full": FULL_CONFIG,
+    "full_threads": {**FULL_CONFIG, "execution": {"backend": "thread"}},
+    "full_processes": {**FULL_CONFIG, "execution": {"backend": "process"}},
+}
+
+CHART_KINDS = ("heatmap", "scatter", "count", "box", "importance")
+
+
+# Each case is setup(df) -> (prepare, run): prepare() builds the input of
+# one run, run(input) is the timed part. Setups run only for selected cases.
+
+def _pipeline_case(config):
+    def setup(df):
+        # Steps may modify their input in place, so every run gets a copy.
+        return df.copy, lambda frame: preprocess_pipeline(frame, config)
+    return setup
+
+
+def _chunked_setup(df):
+    plan = compile_plan(FULL_CONFIG)
+
+    def run(frame):
+        read_chunks = lambda: (frame.iloc[start:start + CHUNK_ROWS] for start in range(0, len(frame), CHUNK_ROWS))
+        params = fit_plan_chunked(read_chunks, plan)
+        for _ in transform_chunks(read_chunks(), plan, params):
+            pass
+    return df.copy, run
+
+
+def _ingest_setup(with_schema):
+    def setup(df):
+        data = df.to_csv(index=False).encode()
+        schema = ingest.schema_of(ingest.read_csv(io.BytesIO(data))[0]) if with_schema else None
+        return lambda: io.BytesIO(data), lambda stream: ingest.read_csv(stream, schema)
+    return setup
+
+
+def _output_setup(fmt):
+    def run(frame):
+        body = serialize_frame(frame, fmt)
+        if fmt in STREAMING_FORMATS:
+            return sum(len(chunk) for chunk in body)
+        return body.getbuffer().nbytes
+    return lambda df: ((lambda: df), run)
+
+
+def _spec(df, kind):
+    spec = next((spec for spec in chart_specs(df, TARGET) if spec["kind"] == kind), None)
+    if spec is None:
+        raise ValueError(f"The dataset has no column for a {kind} chart")
+    return spec
+
+
+def _chart_setup(kind, render):
+    def setup(df):
+        spec = _spec(df, kind)
+        # Chart cases time drawing only; computing importances has its own
+        # cases, so the cheapest method is used here.
+        computed = feature_importances(df, TARGET, "correlation") if kind == "importance" else None
+        importances = lambda: computed
+        if render == "data":
+            return (lambda: df), lambda frame: chart_payload(frame, spec, importances)
+
+        def run(frame):
+            if kind == "heatmap":
+                data = correlation_matrix(frame, TARGET)
+            elif kind == "importance":
+                data = computed
+            else:
+                data = chart_input(frame, spec)
+            return render_chart(spec, data)
+        return (lambda: df), run
+    return setup
+
+
+def _importance_setup(method):
+    return lambda df: ((lambda: df), lambda frame: feature_importances(frame, TARGET, method))
+
+
+def _batch_setup(combine):
+    def setup(df):
+        from werkzeug.datastructures import FileStorage
+        from utils import batch
+        # The dataset split into BATCH_FILES uploads, e.g. monthly extracts.
+        parts = [df.iloc[start::BATCH_FILES].to_csv(index=False).encode() for start in range(BATCH_FILES)]
+        plan = compile_plan(FULL_CONFIG)
+
+        def run(uploads):
+            workdir, inputs = batch.prepare(uploads)
+            return sum(len(chunk) for chunk in batch.archive_stream(workdir, inputs, plan, "csv", combine))
+        return (lambda: [FileStorage(io.BytesIO(part), f"part_{i}.csv") for i, part in enumerate(parts)]), run
+    return setup
+
+
+def _dashboard_setup(render):
+    def setup(df):
+        from routes.dashboard import build_dashboard
+        return (lambda: df), lambda frame: build_dashboard(frame, TARGET, render=render)
+    return setup
+
+
+CASES = {
+    **{f"pipeline.{name}": _pipeline_case(config) for name, config in PIPELINE_CONFIGS.items()},
+    "pipeline.chunked_full": _chunked_setup,
+    "ingest.csv": _ingest_setup(False),
+    "ingest.csv_with_schema": _ingest_setup(True),
+    **{f"output.{fmt}": _output_setup(fmt) for fmt in OUTPUT_FORMATS},
+    **{f"chart.{kind}": _chart_setup(kind, "image") for kind in CHART_KINDS},
+    **{f"chart_data.{kind}": _chart_setup(kind, "data") for kind in CHART_KINDS},
+    **{f"importance.{method}": _importance_setup(method) for method in IMPORTANCE_METHODS},
+    "dashboard.images": _dashboard_setup("image"),
+    "dashboard.data": _dashboard_setup("data"),
+    "batch.archive": _batch_setup(False),
+    "batch.combined": _batch_setup(True),
+}
+
+
+def measure(prepare, run, repeat=3, warmup=1):
+    for _ in range(warmup):
+        run(prepare())
+    times = []
+    for _ in range(repeat):
+        arg = prepare()
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+
+    arg = prepare()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": statistics.median(times), "min_seconds": min(times), "max_seconds": max(times),
+            "repeat": repeat, "peak_bytes": peak}
+
+
+def select(patterns):
+    if not patterns:
+        return list(CASES)
+    names = [name for name in CASES if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+    if not names:
+        raise ValueError(f"No benchmark matches {', '.join(patterns)}")
+    return names
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _versions():
+    import numpy, pandas, pyarrow, sklearn
+    return {module.__name__: module.__version__ for module in (numpy, pandas, pyarrow, sklearn)}
+
+
+def run_benchmarks(names, dataset, repeat=3, warmup=1):
+    df = synthetic_frame(**dataset)
+    results = {}
+    for name in names:
+        try:
+            prepare, run = CASES[name](df)
+            result = measure(prepare, run, repeat, warmup)
+        except Exception as e:
+            print(f"{name:40} failed: {e}")
+            results[name] = {"error": str(e)}
+            continue
+        result["rows"] = len(df)
+        result["rows_per_second"] = len(df) / result["seconds"] if result["seconds"] else None
+        results[name] = result
+        print(f"{name:40} {result['seconds'] * 1000:10.1f} ms  {result['rows_per_second'] or 0:14,.0f} rows/s"
+              f"  {result['peak_bytes'] / 1024 ** 2:9.1f} MB")
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "execution_workers": parallel.EXECUTION_WORKERS,
+            "packages": _versions(),
+        },
+        "dataset": dataset,
+        "results": results,
+    }
+
+
+def compare(current, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """Returns ``(rows, regressions)``: a comparison row per case present in
+    both runs, and the names of the cases that regressed."""
+    if current["dataset"] != baseline["dataset"]:
+        print("Warning: the baseline was run on a different dataset; ratios are not comparable.")
+    rows, regressions = [], []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or "error" in base or "error" in result:
+            continue
+        time_ratio = result["seconds"] / base["seconds"] if base["seconds"] else 1.0
+        memory_ratio = result["peak_bytes"] / base["peak_bytes"] if base["peak_bytes"] else 1.0
+        slower = time_ratio > 1 + time_tolerance and result["seconds"] - base["seconds"] > MIN_SECONDS
+        if slower or memory_ratio > 1 + memory_tolerance:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif time_ratio < 1 - time_tolerance and base["seconds"] - result["seconds"] > MIN_SECONDS:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append({"name": name, "time_ratio": time_ratio, "memory_ratio": memory_ratio, "status": status})
+    return rows, regressions
+
+
+def print_comparison(rows):
+    print(f"\n{'benchmark':40} {'time':>8} {'memory':>8}")
+    for row in rows:
+        print(f"{row['name']:40} {row['time_ratio']:7.2f}x {row['memory_ratio']:7.2f}x  {row['status']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing and dashboard hot paths.")
+    parser.add_argument("--preset", default="small", choices=list(PRESETS))
+    parser.add_argument("--only", nargs="*", metavar="PATTERN", help="glob patterns of benchmark names")
+    parser.add_argument("--list", action="store_true", help="list the benchmark names and exit")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    for key, value in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), help=f"dataset option (default {value})")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(CASES))
+        return 0
+
+    dataset = options(args.preset, **{key: getattr(args, key) for key in DEFAULTS})
+    print(f"Dataset: {json.dumps(dataset)}")
+    current = run_benchmarks(select(args.only), dataset, args.repeat, args.warmup)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(current, baseline, args.time_tolerance, args.memory_tolerance)
+        print_comparison(rows)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
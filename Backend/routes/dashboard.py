@@ -1,149 +1,152 @@
 from flask import Blueprint, request, jsonify
 import pandas as pd
-import os
-import matplotlib.pyplot as plt
-import seaborn as sns
-import base64
-from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
-from groq import Groq as ChatGroq
-import io
-from sklearn.preprocessing import LabelEncoder
 from dotenv import load_dotenv
+from utils import dataset_cache, llm, profiling
+from utils.charts import cached_chart, chart_columns, chart_specs, render_charts
+from utils.chart_data import chart_payload, chart_payloads
+from utils.feature_importance import feature_importances, METHODS as IMPORTANCE_METHODS
 
 load_dotenv()
 dashboard_blueprint = Blueprint('dashboard', __name__)
-groq = ChatGroq(api_key=os.getenv('GROQ_API_KEY'))
 
 @dashboard_blueprint.route('/', methods=['POST'])
 def upload_dataset():
-    if 'file' not in request.files or 'target' not in request.form:
+    if ('file' not in request.files and not request.form.get('dataset_id')) or 'target' not in request.form:
         return jsonify({"error": "Dataset or target variable not provided"}), 400
 
-    file = request.files['file']
     target = request.form['target']
+    importance_method = request.form.get('importance', 'random_forest')
+    if importance_method not in IMPORTANCE_METHODS:
+        return jsonify({"error": f"Unsupported importance method: {importance_method}"}), 400
 
     try:        
-        df = pd.read_csv(file)
+        profile = None
+        if request.form.get('approximate') == 'true':
+            # Charts and suggestions from a sample of the rows, with a
+            # profile of the whole file, instead of loading it all.
+            stream = request.files['file'].stream if 'file' in request.files else None
+            dataset_id, df, profile = profiling.profile_input(stream, request.form.get('dataset_id'))
+        else:
+            dataset_id, df = dataset_cache.frame_from_request(request.files, request.form)
         
         if target not in df.columns:
             return jsonify({"error": "Target variable not found in dataset"}), 400
         
+        return jsonify(build_dashboard(
+            df, target, dataset_id, importance_method,
+            lazy=request.form.get('lazy') == 'true',
+            render=request.form.get('render', 'image'),
+            scatter=request.form.get('scatter', 'hist'),
+            profile=profile
+        ))
+
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@dashboard_blueprint.route('/chart/<dataset_id>/<name>', methods=['GET'])
+def get_chart(dataset_id, name):
+    target = request.args.get('target')
+    if not target:
+        return jsonify({"error": "Target variable not provided"}), 400
+    importance_method = request.args.get('importance', 'random_forest')
+    if importance_method not in IMPORTANCE_METHODS:
+        return jsonify({"error": f"Unsupported importance method: {importance_method}"}), 400
+
+    try:
+        # The chart list only needs the dtypes; the rows read are those of
+        # the columns this chart is drawn from.
+        columns = dataset_cache.empty_frame(dataset_id)
+        if target not in columns.columns:
+            return jsonify({"error": "Target variable not found in dataset"}), 400
+        spec = next((spec for spec in chart_specs(prepare_target(columns, target), target, importance_method)
+                     if spec["name"] == name), None)
+        if spec is None:
+            return jsonify({"error": f"Unknown chart: {name}"}), 404
+
+        render = request.args.get('render')
+        image = cached_chart(dataset_id, spec) if render != 'data' else None
+        if image is not None:
+            return jsonify({"name": name, "image": image})
+        df = prepare_target(dataset_cache.load(dataset_id, chart_columns(spec, target)), target)
+
+        if render == 'data':
+            data = chart_payload(df, spec, lambda: feature_importances(df, target, importance_method, dataset_id),
+                                 scatter=request.args.get('scatter', 'hist'))
+            return jsonify({"name": name, "kind": spec["kind"], "data": data})
+
+        image = render_charts(df, [spec], dataset_id,
+                              importances=lambda: feature_importances(df, target, importance_method, dataset_id))[name]
+        return jsonify({"name": name, "image": image})
+
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def build_dashboard(df, target, dataset_id=None, importance_method="random_forest", lazy=False,
+                    render="image", scatter="hist", progress=None, profile=None):
+    # progress(stage) is called as each stage starts (used by background jobs).
+    # The suggestions call is started first and answered while the charts
+    # are drawn. With a `profile` (approximate mode) df is a sample: charts
+    # are drawn from it but not cached as the dataset's, and the profile is
+    # returned alongside.
+    suggestions = llm.submit(get_preprocessing_suggestions, df, profile)
+    if progress:
+        progress("charts")
+
+    cache_id = dataset_id if profile is None else None
+    if lazy and cache_id is not None:
+        # Only the chart list; images are fetched one by one from /chart.
+        charts = [spec["name"] for spec in chart_specs(prepare_target(df, target), target, importance_method)]
+        result = {"dataset_id": dataset_id, "charts": charts}
+    elif render == 'data':
+        # Aggregated chart data for the frontend to draw instead of PNGs.
+        prepared = prepare_target(df, target)
+        charts = chart_payloads(prepared, chart_specs(prepared, target, importance_method),
+                                lambda: feature_importances(prepared, target, importance_method, cache_id),
+                                scatter=scatter)
+        result = {"dataset_id": dataset_id, "charts": charts}
+    else:
         visualization_data = []
-        visualizations = generate_visualizations(df, target)
+        visualizations = generate_visualizations(df, target, cache_id, importance_method)
 
         for viz_name, encoded_image in visualizations.items():
             visualization_data.append({"name": viz_name, "image": encoded_image})
-        
-        suggestions = get_preprocessing_suggestions(df)
+        result = {"dataset_id": dataset_id, "visualizations": visualization_data}
 
-        return jsonify({
-            "visualizations": visualization_data,
-            "suggestions": suggestions
-        })
+    if profile is not None:
+        result["profile"] = profile
+    if progress:
+        progress("suggestions")
+    result["suggestions"] = suggestions.result()
+    return result
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
 
+def prepare_target(df, target):
+    if not pd.api.types.is_numeric_dtype(df[target]):
+        raise ValueError("The target variable should be numerical and not categorical.")
 
-def generate_visualizations(df, target):
-    visualizations = {}
+    if df[target].isnull().any():
+        df = df.dropna(subset=[target])
+    return df
 
-    try:        
-        if not pd.api.types.is_numeric_dtype(df[target]):
-            return {"error": "The target variable should be numerical and not categorical."}
-
-        if df[target].isnull().any():
-            df = df.dropna(subset=[target])
-        
-        encoded_df = df.copy()
-        label_encoders = {}
-        for col in df.select_dtypes(include=['object', 'category']).columns:
-            if col != target:
-                le = LabelEncoder()
-                encoded_df[col] = le.fit_transform(df[col].astype(str))
-                label_encoders[col] = le
-
-        # Correlation heatmap
-        plt.figure(figsize=(10, 8))
-        sns.heatmap(encoded_df.corr(), annot=False, cmap='coolwarm', fmt=".2f")
-        plt.title("Correlation Heatmap")
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        visualizations["correlation_heatmap"] = base64.b64encode(buffer.read()).decode('utf-8')
-        buffer.close()
-        plt.close()
-
-        # Feature-target relationships
-        for col in df.select_dtypes(include=['float64', 'int64']).columns:
-            if col != target:
-                plt.figure(figsize=(8, 6))
-                sns.scatterplot(x=df[col], y=df[target])
-                plt.title(f"{col} vs {target}")
-                buffer = io.BytesIO()
-                plt.savefig(buffer, format='png')
-                buffer.seek(0)
-                visualizations[f"{col}_vs_{target}"] = base64.b64encode(buffer.read()).decode('utf-8')
-                buffer.close()
-                plt.close()
-
-        # For categorical columns, bar plots showing the relationship with the target
-        for col in df.select_dtypes(include=['object', 'category']).columns:
-            if col != target:
-                plt.figure(figsize=(8, 6))
-                sns.countplot(x=df[col], hue=df[target])
-                plt.title(f"Distribution of {col} by {target}")
-                plt.xticks(rotation=45)
-                buffer = io.BytesIO()
-                plt.savefig(buffer, format='png')
-                buffer.seek(0)
-                visualizations[f"{col}_distribution_by_{target}"] = base64.b64encode(buffer.read()).decode('utf-8')
-                buffer.close()
-                plt.close()
-
-        # Outlier detection for numerical columns
-        for col in df.select_dtypes(include=['float64', 'int64']).columns:
-            plt.figure(figsize=(8, 6))
-            sns.boxplot(x=df[col])
-            plt.title(f"Outliers in {col}")
-            buffer = io.BytesIO()
-            plt.savefig(buffer, format='png')
-            buffer.seek(0)
-            visualizations[f"{col}_outliers"] = base64.b64encode(buffer.read()).decode('utf-8')
-            buffer.close()
-            plt.close()
-
-        # Feature importance using RandomForest
-        X = pd.get_dummies(df.drop(columns=[target]), drop_first=True) 
-        y = df[target]
-
-        # Check if the target is continuous or categorical
-        if y.dtype == 'object' or y.dtype.name == 'category':            
-            model = RandomForestClassifier(random_state=42)
-        else:            
-            model = RandomForestRegressor(random_state=42)
-        
-        model.fit(X, y)
-        importances = pd.Series(model.feature_importances_, index=X.columns).sort_values(ascending=False)
-        
-        plt.figure(figsize=(10, 6))
-        sns.barplot(x=importances, y=importances.index)
-        plt.title("Feature Importance")
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        visualizations["feature_importance"] = base64.b64encode(buffer.read()).decode('utf-8')
-        buffer.close()
-        plt.close()
 
+def generate_visualizations(df, target, dataset_id=None, importance_method="random_forest"):
+    try:
+        df = prepare_target(df, target)
+        return render_charts(df, chart_specs(df, target, importance_method), dataset_id,
+                             importances=lambda: feature_importances(df, target, importance_method, dataset_id))
     except Exception as e:
         return {"error": str(e)}
 
-    return visualizations
 
-def get_preprocessing_suggestions(df):
+def get_preprocessing_suggestions(df, profile=None):
     try:        
-        summary = f"""
+        summary = profiling.summary(profile) if profile is not None else f"""
         Dataset contains {df.shape[0]} rows and {df.shape[1]} columns.
         Columns: {', '.join(df.columns)}
         Missing values:
@@ -167,17 +170,10 @@ def get_preprocessing_suggestions(df):
             }
         ]
         
-        response = groq.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=messages,
-            max_tokens=1000
-        )
-
-        suggestion =  response.choices[0].message.content
-
-        return suggestion
+        return llm.complete(messages, model=llm.SUGGESTIONS_MODEL, max_tokens=1000)
     
     except Exception as e:
-        # Log and return the error
-        #logging.error("Error in get_preprocessing_suggestions: %s", str(e))
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        # Runs on the LLM thread pool, outside the request context, so the
+        # error is returned as plain data rather than a response.
+        print(f"Error in get_preprocessing_suggestions: {e}")
+        return {"error": str(e)}
\ No newline at end of file
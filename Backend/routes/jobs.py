@@ -0,0 +1,210 @@
+from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context
+import json
+import os
+from utils import dataset_cache, jobs, code_plans, profiling, sandbox
+from utils.data_cleaning import compile_plan, run_plan
+from utils.parallel import execution_options, run_plan_parallel
+from utils.output_formats import OUTPUT_FORMATS, STREAMING_FORMATS, choose_format, serialize_frame
+from utils.feature_importance import METHODS as IMPORTANCE_METHODS
+from routes.preprocess import generate_preprocess_code
+from routes.dashboard import build_dashboard
+
+# Background versions of the long-running endpoints. Each POST returns a job
+# id straight away; progress is polled from /<job_id> or streamed from
+# /<job_id>/events, and the output is downloaded from /<job_id>/result.
+jobs_blueprint = Blueprint('jobs', __name__)
+
+UPLOAD_NAME = "upload.csv"
+
+
+def load_input(job_dir, params):
+    if params.get("dataset_id"):
+        return params["dataset_id"], dataset_cache.load(params["dataset_id"])
+    with open(os.path.join(job_dir, UPLOAD_NAME), 'rb') as f:
+        return dataset_cache.parse_stream(f)
+
+
+def write_frame(job_dir, df, output_format=None):
+    output_format = choose_format(output_format, len(df))
+    mimetype, download_name = OUTPUT_FORMATS[output_format]
+    path = os.path.join(job_dir, download_name)
+    body = serialize_frame(df, output_format)
+    with open(path, 'wb') as f:
+        if output_format in STREAMING_FORMATS:
+            for chunk in body:
+                f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        else:
+            f.write(body.getvalue())
+    return path, download_name, mimetype
+
+
+@jobs.register("preprocess")
+def run_preprocess(job_dir, params, progress):
+    progress("loading", 0.0)
+    _, df = load_input(job_dir, params)
+    plan = compile_plan(params["config"])
+
+    def on_step(i, step):
+        progress(step["step"], 0.1 + 0.8 * i / len(plan))
+
+    execution = execution_options(params["config"])
+    if execution["backend"] == "serial":
+        cleaned_df = run_plan(df, plan, on_step=on_step)
+    else:
+        cleaned_df = run_plan_parallel(df, plan, execution, on_step=on_step)
+    progress("writing", 0.9)
+    return write_frame(job_dir, cleaned_df, params.get("format"))
+
+
+@jobs.register("prompt")
+def run_prompt(job_dir, params, progress):
+    progress("loading", 0.0)
+    dataset_id, df = load_input(job_dir, params)
+    progress("running", 0.2)
+    _, processed_df = code_plans.get_or_generate(params["prompt"], df, generate_preprocess_code,
+                                                 execute=lambda plan, df: sandbox.run(plan, df, dataset_id))
+    progress("writing", 0.9)
+    return write_frame(job_dir, processed_df, params.get("format"))
+
+
+@jobs.register("dashboard")
+def run_dashboard(job_dir, params, progress):
+    progress("loading", 0.0)
+    profile = None
+    if params.get("approximate"):
+        if params.get("dataset_id"):
+            dataset_id, df, profile = profiling.profile_input(dataset_id=params["dataset_id"])
+        else:
+            with open(os.path.join(job_dir, UPLOAD_NAME), 'rb') as f:
+                dataset_id, df, profile = profiling.profile_input(f)
+    else:
+        dataset_id, df = load_input(job_dir, params)
+    if params["target"] not in df.columns:
+        raise ValueError("Target variable not found in dataset")
+
+    stages = {"charts": 0.1, "suggestions": 0.8}
+    result = build_dashboard(df, params["target"], dataset_id, params["importance"],
+                             render=params["render"], scatter=params["scatter"],
+                             progress=lambda stage: progress(stage, stages.get(stage)), profile=profile)
+    path = os.path.join(job_dir, "dashboard.json")
+    with open(path, 'w') as f:
+        json.dump(result, f)
+    return path, "dashboard.json", "application/json"
+
+
+def submit(kind, params):
+    # The upload is saved to the job directory rather than passed to the pool,
+    # so the request returns as soon as the file is on disk.
+    if request.form.get('dataset_id'):
+        dataset_cache.load_meta(request.form['dataset_id'])
+        params["dataset_id"] = request.form['dataset_id']
+
+    job_id = jobs.create(kind)
+    if not params.get("dataset_id"):
+        request.files['file'].save(os.path.join(jobs.job_dir(job_id), UPLOAD_NAME))
+    jobs.start(job_id, params)
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+
+@jobs_blueprint.route('/preprocess', methods=['POST'])
+def preprocess_job():
+    if 'file' not in request.files and not request.form.get('dataset_id'):
+        return jsonify({"error": "No file uploaded"}), 400
+
+    try:
+        user_config = request.form.get('config')
+        if not user_config:
+            return jsonify({"error": "No preprocessing configuration provided"}), 400
+        config = json.loads(user_config)
+        # Validated here so a bad config fails the request, not the job.
+        compile_plan(config)
+        execution_options(config)
+
+        output_format = request.form.get('format')
+        if output_format and output_format not in OUTPUT_FORMATS:
+            return jsonify({"error": f"Unsupported output format: {output_format}"}), 400
+
+        return submit("preprocess", {"config": config, "format": output_format})
+
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@jobs_blueprint.route('/process_with_prompt', methods=['POST'])
+def prompt_job():
+    if ('file' not in request.files and not request.form.get('dataset_id')) or 'prompt' not in request.form:
+        return jsonify({"error": "File or prompt not provided"}), 400
+
+    output_format = request.form.get('format')
+    if output_format and output_format not in OUTPUT_FORMATS:
+        return jsonify({"error": f"Unsupported output format: {output_format}"}), 400
+
+    try:
+        return submit("prompt", {"prompt": request.form['prompt'], "format": output_format})
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@jobs_blueprint.route('/dashboard', methods=['POST'])
+def dashboard_job():
+    if ('file' not in request.files and not request.form.get('dataset_id')) or 'target' not in request.form:
+        return jsonify({"error": "Dataset or target variable not provided"}), 400
+
+    importance_method = request.form.get('importance', 'random_forest')
+    if importance_method not in IMPORTANCE_METHODS:
+        return jsonify({"error": f"Unsupported importance method: {importance_method}"}), 400
+
+    try:
+        return submit("dashboard", {
+            "target": request.form['target'],
+            "importance": importance_method,
+            "render": request.form.get('render', 'image'),
+            "scatter": request.form.get('scatter', 'hist'),
+            "approximate": request.form.get('approximate') == 'true',
+        })
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@jobs_blueprint.route('/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(jobs.public(job))
+
+
+@jobs_blueprint.route('/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    if jobs.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def stream():
+        # The stream ends after jobs.EVENTS_MAX_SECONDS; EventSource clients
+        # reconnect after the `retry` delay and get the current state first.
+        yield "retry: 1000\n\n"
+        for state in jobs.events(job_id):
+            yield ": keepalive\n\n" if state is None else f"data: {state}\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@jobs_blueprint.route('/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "failed":
+        return jsonify({"error": job["error"]}), 500
+    if job["status"] != "done":
+        return jsonify({"error": "Job has not finished", "status": job["status"]}), 409
+    return send_file(job["result_file"], mimetype=job["mimetype"], as_attachment=True,
+                     download_name=job["download_name"])
@@ -1,29 +1,22 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context
 import pandas as pd
-import os
 import json
-import io
-import ast
 from dotenv import load_dotenv
-from utils.data_cleaning import preprocess_pipeline
-from langchain_groq import ChatGroq
-from langchain.vectorstores import FAISS
-from langchain_nvidia_ai_endpoints import NVIDIAEmbeddings
-from langchain.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser as sop
+from utils.data_cleaning import preprocess_pipeline, compile_plan
+from utils.streaming import csv_chunk_reader, fit_plan_chunked, stream_csv, DEFAULT_CHUNKSIZE
+from utils import dataset_cache
+from utils.output_formats import OUTPUT_FORMATS, STREAMING_FORMATS, choose_format, serialize_frame, encode_stream
+from utils import llm, examples_index, code_plans, sandbox, fitted_pipeline, batch
 
 load_dotenv()
 preprocess_blueprint = Blueprint('preprocess', __name__)
 
 @preprocess_blueprint.route('/', methods=['POST'])
 def preprocess():
-    if 'file' not in request.files:
+    if 'file' not in request.files and not request.form.get('dataset_id'):
         return jsonify({"error": "No file uploaded"}), 400
 
     try:
-        file = request.files['file']
         user_config = request.form.get('config')
 
         
@@ -32,161 +25,319 @@ def preprocess():
         else:
             return jsonify({"error": "No preprocessing configuration provided"}), 400
 
-        df = pd.read_csv(file)
+        output_format = request.form.get('format')
+        if output_format and output_format not in OUTPUT_FORMATS:
+            return jsonify({"error": f"Unsupported output format: {output_format}"}), 400
+
+        if request.form.get('mode') == 'stream':
+            output_format = output_format or 'csv'
+            if output_format not in STREAMING_FORMATS:
+                return jsonify({"error": "Streaming mode supports only csv and csv.gz output"}), 400
+            return stream_preprocess(request_chunk_reader(), config, output_format)
+
+        dataset_id, df = dataset_cache.frame_from_request(request.files, request.form)
 
         cleaned_df = preprocess_pipeline(df, config)
 
-        return file_download(cleaned_df)
+        return file_download(cleaned_df, output_format, dataset_id)
 
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
 
-def file_download(cleaned_df):
+@preprocess_blueprint.route('/batch', methods=['POST'])
+def preprocess_batch():
+    # One config applied to many files: several `files` fields and/or zip or
+    # tar archives of CSVs. The response is a zip streamed as files finish,
+    # with one output per file (or a single combined CSV) and a manifest.
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    if not uploads:
+        return jsonify({"error": "No file uploaded"}), 400
+
     try:
-        output_file = io.BytesIO()
-        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
-            cleaned_df.to_excel(writer, sheet_name='processed_data', index=False)
-        output_file.seek(0)  # Reset the file pointer to the beginning
+        user_config = request.form.get('config')
+        if not user_config:
+            return jsonify({"error": "No preprocessing configuration provided"}), 400
+        # Validated once for the whole batch.
+        plan = compile_plan(json.loads(user_config))
+
+        output_format = request.form.get('format') or batch.DEFAULT_FORMAT
+        if output_format not in OUTPUT_FORMATS:
+            return jsonify({"error": f"Unsupported output format: {output_format}"}), 400
+        combine = request.form.get('combine') == 'true'
+        if combine and output_format not in STREAMING_FORMATS:
+            return jsonify({"error": "Combined output supports only csv and csv.gz"}), 400
 
-        return send_file(output_file, as_attachment=True, download_name="processed_data.xlsx")
+        workdir, inputs = batch.prepare(uploads)
+        return Response(
+            stream_with_context(batch.archive_stream(workdir, inputs, plan, output_format, combine)),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=processed_batch.zip",
+                     "X-Batch-Files": str(len(inputs))}
+        )
+
+    except batch.BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def request_chunk_reader():
+    # Stream mode reads the upload (or the cached dataset) chunk by chunk.
+    chunksize = int(request.form.get('chunksize', DEFAULT_CHUNKSIZE))
+    if 'file' in request.files:
+        return csv_chunk_reader(request.files['file'].stream, chunksize)
+    dataset_cache.load_meta(request.form['dataset_id'])
+    return dataset_cache.chunk_reader(request.form['dataset_id'], chunksize)
+
+def request_reader():
+    if request.form.get('mode') == 'stream':
+        return request_chunk_reader()
+    _, df = dataset_cache.frame_from_request(request.files, request.form)
+    return fitted_pipeline.frame_reader(df)
+
+def stream_preprocess(read_chunks, config, output_format):
+    # Two-stage execution over the upload: statistics are gathered chunk by
+    # chunk, then every chunk is transformed and written straight to the
+    # response, so memory is bounded by the chunk size.
+    plan = compile_plan(config)
+    params = fit_plan_chunked(read_chunks, plan)
+
+    return stream_download(encode_stream(stream_csv(read_chunks, plan, params), output_format), output_format)
+
+def stream_download(body, output_format):
+    mimetype, download_name = OUTPUT_FORMATS[output_format]
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={download_name}"}
+    )
+
+def file_download(cleaned_df, output_format=None, dataset_id=None, plan_id=None):
+    # Small results keep the Excel default the frontend expects; large ones
+    # fall back to a streamed CSV unless a format was requested.
+    try:
+        output_format = choose_format(output_format, len(cleaned_df))
+        body = serialize_frame(cleaned_df, output_format)
+        if output_format in STREAMING_FORMATS:
+            response = stream_download(body, output_format)
+        else:
+            mimetype, download_name = OUTPUT_FORMATS[output_format]
+            response = send_file(body, mimetype=mimetype, as_attachment=True, download_name=download_name)
+
+        if dataset_id:
+            response.headers["X-Dataset-Id"] = dataset_id
+        if plan_id:
+            response.headers["X-Plan-Id"] = plan_id
+        return response
 
     except Exception as e:
         print(f"Error creating downloadable file: {e}")
         return jsonify({"error": f"Error creating file: {e}"}), 500
     
+@preprocess_blueprint.route('/fit', methods=['POST'])
+def fit_pipeline():
+    # Fits the configured steps and saves the fitted pipeline, so later
+    # batches can be transformed with the same parameters.
+    if 'file' not in request.files and not request.form.get('dataset_id'):
+        return jsonify({"error": "No file uploaded"}), 400
+
+    try:
+        user_config = request.form.get('config')
+        if not user_config:
+            return jsonify({"error": "No preprocessing configuration provided"}), 400
+        plan = compile_plan(json.loads(user_config))
+
+        pipeline = fitted_pipeline.fit(request_reader(), plan)
+        fitted_pipeline.save(pipeline)
+        return jsonify(fitted_pipeline.describe(pipeline)), 201
+
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@preprocess_blueprint.route('/pipelines/<pipeline_id>', methods=['GET'])
+def get_pipeline(pipeline_id):
+    try:
+        return jsonify(fitted_pipeline.describe(fitted_pipeline.load(pipeline_id)))
+    except fitted_pipeline.PipelineNotFound as e:
+        return jsonify({"error": str(e)}), 404
+
+@preprocess_blueprint.route('/pipelines/<pipeline_id>/transform', methods=['POST'])
+def transform_with_pipeline(pipeline_id):
+    # Transform-only: the saved parameters are applied, nothing is refitted.
+    if 'file' not in request.files and not request.form.get('dataset_id'):
+        return jsonify({"error": "No file uploaded"}), 400
+
+    output_format = request.form.get('format')
+    if output_format and output_format not in OUTPUT_FORMATS:
+        return jsonify({"error": f"Unsupported output format: {output_format}"}), 400
+
+    try:
+        pipeline = fitted_pipeline.load(pipeline_id)
+
+        if request.form.get('mode') == 'stream':
+            output_format = output_format or 'csv'
+            if output_format not in STREAMING_FORMATS:
+                return jsonify({"error": "Streaming mode supports only csv and csv.gz output"}), 400
+            read_chunks = request_chunk_reader()
+            fitted_pipeline.check_columns(pipeline, fitted_pipeline.columns_of(read_chunks))
+            body = stream_csv(read_chunks, pipeline["plan"], pipeline["params"])
+            return stream_download(encode_stream(body, output_format), output_format)
+
+        dataset_id, df = dataset_cache.frame_from_request(request.files, request.form)
+        return file_download(fitted_pipeline.transform(pipeline, df), output_format, dataset_id)
+
+    except (dataset_cache.DatasetNotFound, fitted_pipeline.PipelineNotFound) as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@preprocess_blueprint.route('/pipelines/<pipeline_id>/update', methods=['POST'])
+def update_pipeline(pipeline_id):
+    # Merges a new batch into the pipeline's statistics (partial fit).
+    if 'file' not in request.files and not request.form.get('dataset_id'):
+        return jsonify({"error": "No file uploaded"}), 400
+
+    try:
+        read_chunks = request_reader()
+        with fitted_pipeline.locked(pipeline_id):
+            pipeline = fitted_pipeline.update(fitted_pipeline.load(pipeline_id), read_chunks)
+            fitted_pipeline.save(pipeline)
+        return jsonify(fitted_pipeline.describe(pipeline))
+
+    except (dataset_cache.DatasetNotFound, fitted_pipeline.PipelineNotFound) as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @preprocess_blueprint.route('/get_columns', methods=['POST'])
 def get_columns():
-    if 'file' not in request.files:
+    if 'file' not in request.files and not request.form.get('dataset_id'):
         return jsonify({"error": "No file uploaded"}), 400
 
-    file = request.files['file']
     try:
-        df = pd.read_csv(file)
-        columns = list(df.columns)
-        return jsonify({"columns": columns})
+        # Answered from cached metadata when the dataset was parsed before,
+        # otherwise from the header row alone.
+        if 'file' in request.files:
+            file = request.files['file']
+            dataset_id = dataset_cache.hash_upload(file.stream)
+            try:
+                columns = dataset_cache.load_meta(dataset_id)["columns"]
+            except dataset_cache.DatasetNotFound:
+                columns = list(pd.read_csv(file.stream, nrows=0).columns)
+        else:
+            dataset_id = request.form['dataset_id']
+            columns = dataset_cache.load_meta(dataset_id)["columns"]
+        return jsonify({"columns": columns, "dataset_id": dataset_id})
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
-#groq = ChatGroq(api_key = os.getenv('GROQ_API_KEY'))
-current_dir = os.path.dirname(os.path.abspath(__file__))
-
-vectorstore = None
-
-def get_vector_store():
-    global vectorstore
-    if vectorstore is None:
-        file_path = os.path.join(current_dir, "preprocessing_examples.txt")
-        loader = TextLoader(file_path)
-        documents = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=70, chunk_overlap=10)
-        texts = text_splitter.split_documents(documents)
-        embeddings = NVIDIAEmbeddings(model="NV-Embed-QA", api_key=os.getenv('NVIDIA_API_KEY'))
-        vectorstore = FAISS.from_documents(texts, embeddings)
-    return vectorstore
-
 @preprocess_blueprint.route('/process_with_prompt', methods=['POST'])
 def process_with_prompt():
-    if 'file' not in request.files or 'prompt' not in request.form:
+    if ('file' not in request.files and not request.form.get('dataset_id')) or 'prompt' not in request.form:
         return jsonify({"error": "File or prompt not provided"}), 400
 
-    file = request.files['file']
     prompt = request.form['prompt']
+    output_format = request.form.get('format')
+    if output_format and output_format not in OUTPUT_FORMATS:
+        return jsonify({"error": f"Unsupported output format: {output_format}"}), 400
     
     try:
-        df = pd.read_csv(file)
-        vectorstore = get_vector_store()
-        retriever = vectorstore.as_retriever(search_type="mmr", search_kwarg = {'k' : 3, 'lambda_mult': 0.7})
-        retrieved_docs = retriever.get_relevant_documents(prompt)
-        context = "\n".join([doc.page_content for doc in retrieved_docs])
-        
-        full_prompt = f"""
-        You are a Python data preprocessing assistant. Your task is to generate a Python function named `preprocess` that applies data preprocessing steps to a provided pandas DataFrame, `df`, based on the user’s instructions.
-        The user's instructions are as follows:
-        {prompt} 
-
-        Guidelines:
-        1. Only write the Python function and the necessary libraries used in the code. Do not provide explanations or additional text.
-        2. Use appropriate pandas or scikit-learn methods for preprocessing.
-        3. Ensure that you import the necessary libraries which are used in the function.
-        4. Ensure the code is modular and clean, handling edge cases where applicable.
-        5. Always return the processed DataFrame as `processed_df`.
-        6. Always check the data type when implementing the function. For example, if the column is numerical, apply numerical preprocessing methods.
-        7. Most Important: Follow the user's instructions precisely and do exactly as asked and include multiple preprocessing steps if required.
-        8. DO NOT INCLUDE ANY PLOTS IN THE CODE NO MATTER WHAT THE USER INSTRUCTIONS ARE. ONLY DATA PREPROCESSING STEPS ARE REQUIRED.
-        9. DO NOT INCLUDE ANY PRINT STATEMENTS IN THE CODE.
-        10. If the user asks for a specific preprocessing step, ensure that you include that step in the code.
-        11. If the code uses the OneHotEncoder function, ensure that the sparse arguement is not passed in the function.
-
-        Use the following context to generate the code: {context}
-
-        Input:
-        - A pandas DataFrame `df`.
-
-        Output:
-        - A Python function `preprocess(df)` that returns a processed DataFrame `processed_df`.
-
-        Example format:
-        ```python
-        def preprocess(df):
-            # Add preprocessing steps here based on the instructions
-            processed_df = df.copy()
-            # Your code
-            return processed_df
-
-        """
-        prompt_template = PromptTemplate.from_template(full_prompt)       
-
-        chat = ChatGroq(
-            model="llama-3.3-70b-versatile",            
-            model_kwargs = {'seed' : 365},
-            temperature = 0.1,
-            api_key = os.getenv('GROQ_API_KEY')           
+        dataset_id, df = dataset_cache.frame_from_request(request.files, request.form)
+        # Code generated earlier for the same prompt and schema is reused; the
+        # code itself runs in the sandbox pool, not in this worker.
+        plan, processed_df = code_plans.get_or_generate(
+            prompt, df, generate_preprocess_code,
+            execute=lambda plan, df: sandbox.run(plan, df, dataset_id)
         )
 
-        chain = prompt_template | chat | sop()
-        input_dict = {"prompt": prompt}
-        code = chain.invoke(input_dict)        
-        code = code.replace("```python", "").replace("```", "")
-        
-        libraries = extract_imports_and_execute(code)
+        return file_download(processed_df, output_format, dataset_id, plan["plan_id"])
 
-        exec_locals = {}
-        try:
-            exec(code, libraries, exec_locals) 
-        except Exception as e:
-            return jsonify({"error": f"Error in executing generated code: {str(e)}"}), 500
+    except dataset_cache.DatasetNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        processed_df = exec_locals['preprocess'](df)
-        if processed_df is None:
-            return jsonify({"error": "The generated code did not return 'processed_df'"}), 500
-       
-        output_file = io.BytesIO()
-        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
-            processed_df.to_excel(writer, index=False)
-        output_file.seek(0)
 
-        return send_file(output_file, as_attachment=True, download_name="processed_data.xlsx")
+@preprocess_blueprint.route('/plans/<plan_id>', methods=['GET'])
+def get_plan(plan_id):
+    try:
+        return jsonify(code_plans.load(plan_id))
+    except code_plans.PlanNotFound as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@preprocess_blueprint.route('/plans/<plan_id>/apply', methods=['POST'])
+def apply_plan(plan_id):
+    # Re-runs saved generated code on a new upload without calling the LLM.
+    if 'file' not in request.files and not request.form.get('dataset_id'):
+        return jsonify({"error": "No file uploaded"}), 400
+
+    output_format = request.form.get('format')
+    if output_format and output_format not in OUTPUT_FORMATS:
+        return jsonify({"error": f"Unsupported output format: {output_format}"}), 400
 
+    try:
+        plan = code_plans.load(plan_id)
+        dataset_id, df = dataset_cache.frame_from_request(request.files, request.form)
+        processed_df = sandbox.run(plan, df, dataset_id)
+
+        return file_download(processed_df, output_format, dataset_id, plan_id)
+
+    except (dataset_cache.DatasetNotFound, code_plans.PlanNotFound) as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    
 
-def extract_imports_and_execute(code):
-    
-    tree = ast.parse(code)    
-    
-    imported_libraries = {}    
-    
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Import):
-            for alias in node.names:                
-                imported_libraries[alias.asname or alias.name] = __import__(alias.name)
-        elif isinstance(node, ast.ImportFrom):
-            module = node.module
-            if module:                
-                imported_module = __import__(module, fromlist=[alias.name for alias in node.names])
-                for alias in node.names:
-                    imported_libraries[alias.asname or alias.name] = getattr(imported_module, alias.name)    
+
+def generate_preprocess_code(prompt):
+    # Prebuilt, memory-mapped index; see utils/examples_index.py.
+    context = "\n".join(examples_index.retrieve(prompt))
     
-    return imported_libraries
+    full_prompt = f"""
+    You are a Python data preprocessing assistant. Your task is to generate a Python function named `preprocess` that applies data preprocessing steps to a provided pandas DataFrame, `df`, based on the user’s instructions.
+    The user's instructions are as follows:
+    {prompt} 
+
+    Guidelines:
+    1. Only write the Python function and the necessary libraries used in the code. Do not provide explanations or additional text.
+    2. Use appropriate pandas or scikit-learn methods for preprocessing.
+    3. Ensure that you import the necessary libraries which are used in the function.
+    4. Ensure the code is modular and clean, handling edge cases where applicable.
+    5. Always return the processed DataFrame as `processed_df`.
+    6. Always check the data type when implementing the function. For example, if the column is numerical, apply numerical preprocessing methods.
+    7. Most Important: Follow the user's instructions precisely and do exactly as asked and include multiple preprocessing steps if required.
+    8. DO NOT INCLUDE ANY PLOTS IN THE CODE NO MATTER WHAT THE USER INSTRUCTIONS ARE. ONLY DATA PREPROCESSING STEPS ARE REQUIRED.
+    9. DO NOT INCLUDE ANY PRINT STATEMENTS IN THE CODE.
+    10. If the user asks for a specific preprocessing step, ensure that you include that step in the code.
+    11. If the code uses the OneHotEncoder function, ensure that the sparse arguement is not passed in the function.
+
+    Use the following context to generate the code: {context}
+
+    Input:
+    - A pandas DataFrame `df`.
+
+    Output:
+    - A Python function `preprocess(df)` that returns a processed DataFrame `processed_df`.
+
+    Example format:
+    ```python
+    def preprocess(df):
+        # Add preprocessing steps here based on the instructions
+        processed_df = df.copy()
+        # Your code
+        return processed_df
+
+    """
+    code = llm.complete(full_prompt, model=llm.CODE_MODEL, temperature=0.1, seed=365)
+    code = code.replace("```python", "").replace("```", "")
+    return code
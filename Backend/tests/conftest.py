@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+import pytest
+
+# The app imports `routes` and `utils` as top-level packages from Backend/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Per-process metric snapshots are not wanted from test runs.
+os.environ.setdefault("METRICS_DIR", "")
+os.environ.setdefault("DATASET_CACHE_DIR", tempfile.mkdtemp(prefix="dataoptimizer_test_"))
+
+
+# Configs covering every built-in step, for comparing execution paths.
+PLAN_CONFIGS = [
+    {"missing_values_num": {"strategy": "mean"}, "missing_values_cat": {"strategy": "mode"},
+     "remove_duplicates": True, "normalize": {"method": "zscore"}, "remove_outliers": {"method": "zscore"}},
+    {"missing_values_num": {"strategy": "median"}, "remove_duplicates": True,
+     "normalize": {"method": "minmax"}, "remove_outliers": {"method": "iqr"}},
+    {"remove_na": True, "remove_duplicates": True, "remove_outliers": {"method": "mad", "threshold": 3}},
+    {"remove_columns": ["d"], "remove_duplicates": True},
+]
+
+
+@pytest.fixture(params=PLAN_CONFIGS)
+def config(request):
+    return request.param
+
+
+@pytest.fixture
+def frame():
+    # Mixed frame with missing values, exact duplicate rows and a few
+    # outliers, small enough for quantile sketches to be exact.
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = pd.DataFrame({
+        "a": rng.normal(0, 1, n),
+        "b": rng.integers(0, 20, n).astype(float),
+        "c": rng.choice(["x", "y", "z"], n),
+        "d": rng.integers(0, 1000, n),
+    })
+    df.loc[rng.choice(n, 150, replace=False), "a"] = np.nan
+    df.loc[rng.choice(n, 150, replace=False), "c"] = None
+    df.loc[rng.choice(n, 20, replace=False), "a"] = 25.0
+    duplicates = df.sample(300, random_state=1)
+    return pd.concat([df, duplicates], ignore_index=True)
@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+from utils import code_plans
+
+
+def plan(i):
+    return {"plan_id": f"{i:064x}", "code": f"def preprocess(df):\n    processed_df = df + {i}\n    return processed_df\n"}
+
+
+def test_compiled_plans_bounded():
+    code_plans._compile.cache_clear()
+    for i in range(code_plans.COMPILED_PLANS + 10):
+        code_plans.compiled(plan(i))
+    assert code_plans._compile.cache_info().currsize == code_plans.COMPILED_PLANS
+    assert code_plans.compiled(plan(1)) is code_plans.compiled(plan(1))
+
+
+def test_run_compiled_plan():
+    assert code_plans.run(plan(2), pd.DataFrame({"a": [1]}))["a"].tolist() == [3]
+
+
+def test_invalid_code_rejected():
+    with pytest.raises(code_plans.GeneratedCodeError):
+        code_plans.compiled({"plan_id": "0" * 64, "code": "def preprocess(df:\n"})
@@ -0,0 +1,36 @@
+import json
+import numpy as np
+import pytest
+from utils import dataset_cache
+from utils.chart_data import chart_payload
+from utils.charts import chart_specs
+from routes.dashboard import prepare_target
+
+DATASET_ID = "ab" * 32
+
+
+@pytest.fixture
+def client(frame):
+    from app import app
+    dataset_cache.store(DATASET_ID, frame.assign(t=np.arange(len(frame), dtype=float)))
+    return app.test_client()
+
+
+def test_lazy_chart_reads_only_its_columns(client, monkeypatch):
+    reads = []
+    load = dataset_cache.load
+    monkeypatch.setattr(dataset_cache, "load", lambda dataset_id, columns=None: reads.append(columns)
+                        or load(dataset_id, columns))
+
+    response = client.get(f"/api/dashboard/chart/{DATASET_ID}/a_vs_t?target=t&render=data")
+    assert response.status_code == 200
+    assert reads == [["a", "t"]]
+
+    full = prepare_target(load(DATASET_ID), "t")
+    spec = next(spec for spec in chart_specs(full, "t") if spec["name"] == "a_vs_t")
+    assert response.get_json()["data"] == json.loads(json.dumps(chart_payload(full, spec)))
+
+
+def test_unknown_chart(client):
+    assert client.get(f"/api/dashboard/chart/{DATASET_ID}/nope?target=t").status_code == 404
+    assert client.get(f"/api/dashboard/chart/{DATASET_ID}/nope?target=zz").status_code == 400
@@ -0,0 +1,30 @@
+import pytest
+from utils import dataset_cache
+from utils.dataset_cache import DatasetNotFound
+
+VALID_ID = "0123456789abcdef" * 4
+
+
+def test_valid_id():
+    assert dataset_cache._check_id(VALID_ID) == VALID_ID
+
+
+@pytest.mark.parametrize("dataset_id", [
+    None,
+    "",
+    VALID_ID.upper(),
+    VALID_ID[:-1],
+    VALID_ID + "0",
+    f"../{VALID_ID[3:]}",
+    f"{VALID_ID[:-1]}/",
+    f"{VALID_ID}\n",
+])
+def test_invalid_ids_rejected(dataset_id):
+    with pytest.raises(DatasetNotFound):
+        dataset_cache._check_id(dataset_id)
+
+
+@pytest.mark.parametrize("lookup", [dataset_cache.load, dataset_cache.is_cached, dataset_cache.load_meta])
+def test_no_path_outside_cache_dir(lookup):
+    with pytest.raises(DatasetNotFound):
+        lookup("../" + VALID_ID)
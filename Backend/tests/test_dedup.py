@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from utils import dedup
+from utils.dedup import SeenHashes
+
+
+def test_matches_pandas(frame):
+    assert dedup.drop_duplicates(frame).index.equals(frame.drop_duplicates().index)
+
+
+def test_large_integers_stay_distinct():
+    big = 2 ** 53
+    df = pd.DataFrame({"id": np.array([big, big + 1, big + 2, big], dtype=np.int64)})
+    assert dedup.drop_duplicates(df)["id"].tolist() == [big, big + 1, big + 2]
+
+
+def test_swapped_columns_are_distinct():
+    df = pd.DataFrame({"a": [1, 2], "b": [2, 1]})
+    assert len(dedup.drop_duplicates(df)) == 2
+
+
+def test_missing_values_are_equal():
+    df = pd.DataFrame({"a": [np.nan, np.nan, 1.0], "b": [None, None, "x"]})
+    assert dedup.drop_duplicates(df).index.tolist() == [0, 2]
+
+
+def test_chunks_with_different_dtypes():
+    # The same values parsed as int64 in one chunk and float64 (because of a
+    # missing value) or category in another are still duplicates.
+    first = pd.DataFrame({"n": [1, 2, 3], "c": ["x", "y", "z"]})
+    second = pd.DataFrame({"n": [2.0, np.nan, 3.5], "c": pd.Categorical(["y", "x", "z"])})
+    seen = SeenHashes()
+    assert seen.new_rows(first).tolist() == [True, True, True]
+    assert seen.new_rows(second).tolist() == [False, True, True]
+
+
+def test_seen_hashes_match_whole_frame(frame):
+    seen = SeenHashes()
+    keep = np.concatenate([seen.new_rows(frame.iloc[start:start + 500])
+                           for start in range(0, len(frame), 500)])
+    assert frame.index[keep].equals(frame.drop_duplicates().index)
+    assert len(seen) == len(frame.drop_duplicates())
@@ -0,0 +1,31 @@
+import io
+import json
+import pytest
+from utils import output_formats
+
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+
+def preprocess(client, frame, **form):
+    upload = (io.BytesIO(frame.to_csv(index=False).encode()), "data.csv")
+    return client.post("/api/preprocess/", data={"file": upload, "config": json.dumps({}), **form},
+                       headers={"Origin": "https://data-optimizer.vercel.app"})
+
+
+@pytest.mark.parametrize("max_rows, filename", [(100_000, "processed_data.xlsx"), (100, "processed_data.csv")])
+def test_download_named_after_format(client, frame, monkeypatch, max_rows, filename):
+    monkeypatch.setattr(output_formats, "EXCEL_MAX_ROWS", max_rows)
+    response = preprocess(client, frame)
+    assert response.status_code == 200
+    assert filename in response.headers["Content-Disposition"]
+    # The frontend reads the file name from this header.
+    assert "Content-Disposition" in response.headers["Access-Control-Expose-Headers"]
+
+
+def test_requested_format_kept(client, frame):
+    response = preprocess(client, frame, format="parquet")
+    assert "processed_data.parquet" in response.headers["Content-Disposition"]
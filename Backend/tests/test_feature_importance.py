@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.feature_importance import feature_importances
+
+
+@pytest.fixture
+def features():
+    rng = np.random.default_rng(0)
+    n = 400
+    color = rng.choice(["a", "b", "c"], n)
+    return pd.DataFrame({
+        "x": rng.normal(size=n),
+        "color": color,
+        "user_id": [f"u{i}" for i in range(n)],
+        "t": rng.normal(size=n) + (color == "b") * 2,
+    })
+
+
+@pytest.mark.parametrize("method", ["random_forest", "correlation", "mutual_info"])
+def test_only_id_columns_reported_as_zero(features, method):
+    importances = feature_importances(features, "t", method)
+    # One-hot encoded columns are reported through their dummies only.
+    assert "color" not in importances.index
+    assert {"color_b", "color_c", "x"} <= set(importances.index)
+    assert importances["user_id"] == 0.0
+    assert importances.index.is_unique
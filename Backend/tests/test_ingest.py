@@ -0,0 +1,63 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
+from utils import ingest, parallel
+from utils.data_cleaning import compile_plan, run_plan
+from utils.streaming import fit_plan_chunked, transform_chunks
+
+
+@pytest.fixture
+def narrow():
+    # Parsed as int8, but its range (200) does not fit in int8.
+    df, _ = ingest.read_csv(io.BytesIO(b"a,b\n-100,1\n100,2\n0,3\n50,4\n"))
+    assert df["a"].dtype == np.int8
+    return df
+
+
+def run_serial(df, plan):
+    return run_plan(df, plan)
+
+
+def run_parallel(df, plan):
+    return parallel.run_plan_parallel(df, plan, {"backend": "thread", "workers": 2})
+
+
+def run_streaming(df, plan):
+    def chunks():
+        return (df.iloc[start:start + 2] for start in range(0, len(df), 2))
+    return pd.concat(list(transform_chunks(chunks(), plan, fit_plan_chunked(chunks, plan))))
+
+
+@pytest.mark.parametrize("run", [run_serial, run_parallel, run_streaming])
+def test_minmax_on_narrow_integers(narrow, run, monkeypatch):
+    monkeypatch.setattr(parallel, "MIN_PARALLEL_ROWS", 0)
+    result = run(narrow, compile_plan({"normalize": {"method": "minmax"}}))
+    np.testing.assert_allclose(result["a"], [0, 1, 0.5, 0.75])
+
+
+@pytest.mark.parametrize("run", [run_serial, run_parallel, run_streaming])
+def test_zscore_on_narrow_integers(narrow, run, monkeypatch):
+    monkeypatch.setattr(parallel, "MIN_PARALLEL_ROWS", 0)
+    result = run(narrow, compile_plan({"normalize": {"method": "zscore"}}))
+    a = np.array([-100, 100, 0, 50], dtype=np.float64)
+    np.testing.assert_allclose(result["a"], (a - a.mean()) / a.std())
+
+
+def test_widen_dtypes():
+    df = ingest.optimize_dtypes(pd.DataFrame({"n": [1, 2, 3] * 10, "c": ["x", "y", "x"] * 10}))
+    widened = ingest.widen_dtypes(df)
+    assert widened["n"].dtype == np.int64
+    assert widened["c"].dtype == object
+
+
+def test_floats_keep_full_precision():
+    df, _ = ingest.read_csv(io.BytesIO(b"x,y\n1.0,a\n2.0,b\n,c\n2.0,d\n"))
+    assert df["x"].dtype == np.float64
+    imputed = run_plan(df, compile_plan({"missing_values_num": {"strategy": "mean"}}))
+    assert imputed["x"].tolist() == [1.0, 2.0, 5 / 3, 2.0]
+
+
+def test_stale_float32_schema_not_applied():
+    df, _ = ingest.read_csv(io.BytesIO(b"x\n1.5\n2.5\n"), schema={"x": "float32"})
+    assert df["x"].dtype == np.float64
@@ -0,0 +1,24 @@
+import os
+from utils import jobs
+
+
+def test_forked_process_starts_its_own_pool():
+    pool = jobs._get_executor()
+    assert pool.submit(os.getpid).result() != os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        child_pool = jobs._get_executor()
+        ok = child_pool is not pool and child_pool.submit(int, "3").result(timeout=60) == 3
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert jobs._get_executor() is pool
+
+
+def test_broken_pool_replaced_once():
+    pool = jobs._get_executor()
+    jobs._reset_executor(pool)
+    replacement = jobs._get_executor()
+    assert replacement is not pool
+    jobs._reset_executor(pool)
+    assert jobs._get_executor() is replacement
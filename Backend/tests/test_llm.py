@@ -0,0 +1,32 @@
+import pytest
+from utils import llm
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    # Records the messages each backend call receives.
+    calls = []
+    monkeypatch.setattr(llm, "LLM_BACKEND", "test")
+    monkeypatch.setattr(llm, "LLM_CACHE_DIR", "")
+    monkeypatch.setitem(llm.BACKENDS, "test", lambda messages, model, options: calls.append(messages) or "ok")
+    llm.clear_cache()
+    yield calls
+    llm.clear_cache()
+
+
+def test_prompt_sent_unchanged(sent):
+    prompt = "Steps:\n1. drop ids\n2. scale\n```python\ndef preprocess(df):\n    # Add preprocessing steps\n    return df\n```"
+    llm.complete(prompt)
+    assert sent == [[{"role": "user", "content": prompt}]]
+
+
+def test_whitespace_variants_share_cache_entry(sent):
+    assert llm.complete("a  prompt\n  with indentation") == "ok"
+    assert llm.complete("a prompt with indentation") == "ok"
+    assert len(sent) == 1
+
+
+def test_different_prompts_not_shared(sent):
+    llm.complete("first")
+    llm.complete("second")
+    assert [messages[0]["content"] for messages in sent] == ["first", "second"]
@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+from utils import parallel
+from utils.data_cleaning import compile_plan, run_plan
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_parallel_matches_serial(frame, config, backend, monkeypatch):
+    monkeypatch.setattr(parallel, "MIN_PARALLEL_ROWS", 0)
+    plan = compile_plan(config)
+    result = parallel.run_plan_parallel(frame, plan, {"backend": backend, "workers": 3})
+    pd.testing.assert_frame_equal(result, run_plan(frame, plan), check_dtype=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize("execution", [{"backend": "gpu"}, {"backend": "thread", "workers": 0}])
+def test_invalid_execution_rejected(execution):
+    with pytest.raises(ValueError):
+        parallel.execution_options({"execution": execution})
+
+
+def test_workers_capped(monkeypatch):
+    monkeypatch.setattr(parallel, "EXECUTION_WORKERS", 2)
+    options = parallel.execution_options({"execution": {"backend": "thread", "workers": 64}})
+    assert options == {"backend": "thread", "workers": 2}
+
+
+def test_process_backend_forks_one_pool_per_plan(frame, monkeypatch):
+    monkeypatch.setattr(parallel, "MIN_PARALLEL_ROWS", 0)
+    pools = []
+    make_pool = parallel._process_pool
+    monkeypatch.setattr(parallel, "_process_pool", lambda execution: pools.append(make_pool(execution)) or pools[-1])
+    plan = compile_plan({"missing_values_num": {"strategy": "median"}, "missing_values_cat": {"strategy": "mode"},
+                         "normalize": {"method": "zscore"}, "remove_outliers": {"method": "iqr"}})
+    result = parallel.run_plan_parallel(frame, plan, {"backend": "process", "workers": 3})
+    pd.testing.assert_frame_equal(result, run_plan(frame, plan), check_dtype=False, rtol=1e-9)
+    assert len(pools) == 1
+
+
+def test_columns_arrow_cannot_hold_fitted_on_threads(frame, monkeypatch):
+    monkeypatch.setattr(parallel, "MIN_PARALLEL_ROWS", 0)
+    mixed = frame.assign(m=["one" if i % 3 else 1 for i in range(len(frame))])
+    plan = compile_plan({"missing_values_cat": {"strategy": "mode"}})
+    result = parallel.run_plan_parallel(mixed, plan, {"backend": "process", "workers": 3})
+    pd.testing.assert_frame_equal(result, run_plan(mixed, plan))
@@ -0,0 +1,39 @@
+import pytest
+from utils.data_cleaning import compile_plan
+
+
+def test_steps_in_order():
+    plan = compile_plan({
+        "remove_outliers": {"method": "iqr", "threshold": "2"},
+        "normalize": {"method": "minmax"},
+        "remove_duplicates": True,
+        "missing_values_cat": {"strategy": "mode"},
+        "missing_values_num": {"strategy": "median"},
+        "remove_columns": ["id"],
+    })
+    assert plan == [
+        {"step": "remove_columns", "columns": ["id"]},
+        {"step": "impute", "columns": "numeric", "strategy": "median"},
+        {"step": "impute", "columns": "categorical", "strategy": "mode"},
+        {"step": "remove_duplicates"},
+        {"step": "normalize", "method": "minmax"},
+        {"step": "remove_outliers", "method": "iqr", "threshold": 2.0},
+    ]
+
+
+def test_remove_na_replaces_imputation():
+    plan = compile_plan({"remove_na": True, "missing_values_num": {"strategy": "mean"}})
+    assert plan == [{"step": "remove_na"}]
+
+
+def test_none_methods_add_no_steps():
+    assert compile_plan({"normalize": {"method": "none"}, "remove_outliers": {"method": "none"}}) == []
+
+
+@pytest.mark.parametrize("config", [
+    {"normalize": {"method": "robust"}},
+    {"remove_outliers": {"method": "dbscan"}},
+])
+def test_invalid_methods_rejected(config):
+    with pytest.raises(ValueError):
+        compile_plan(config)
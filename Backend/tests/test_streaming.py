@@ -0,0 +1,22 @@
+import pandas as pd
+from utils.data_cleaning import compile_plan, run_plan
+from utils.streaming import fit_plan_chunked, transform_chunks
+
+
+def test_streaming_matches_serial(frame, config):
+    plan = compile_plan(config)
+
+    def chunks():
+        return (frame.iloc[start:start + 700] for start in range(0, len(frame), 700))
+
+    params = fit_plan_chunked(chunks, plan)
+    result = pd.concat(list(transform_chunks(chunks(), plan, params)))
+    pd.testing.assert_frame_equal(result, run_plan(frame, plan), check_dtype=False, rtol=1e-9)
+
+
+def test_passes_start_with_no_rows_seen(frame):
+    plan = compile_plan({"remove_duplicates": True})
+    chunks = [frame.iloc[:1500], frame.iloc[1500:]]
+    first = pd.concat(list(transform_chunks(chunks, plan, [{}])))
+    second = pd.concat(list(transform_chunks(chunks, plan, [{}])))
+    pd.testing.assert_frame_equal(second, first)
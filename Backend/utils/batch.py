@@ -0,0 +1,296 @@
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from utils import dataset_cache, metrics
+from utils.data_cleaning import run_plan
+from utils.output_formats import STREAMING_FORMATS, csv_chunks, encode_stream, serialize_frame
+
+# Batch preprocessing: one compiled plan applied to many CSV files.
+#
+# Uploads (and the CSVs inside uploaded zip/tar archives) are saved to a
+# working directory first, so the request holds no file contents in memory.
+# Each file is then parsed, transformed and written back to disk by a pool
+# of BATCH_WORKERS processes; at most two files per worker are queued at a
+# time, so memory is bounded by the workers' current files, not the batch.
+# Results are added to a zip archive streamed to the client in input order,
+# followed by a manifest with every file's status.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", os.cpu_count() or 1))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 1000))
+# Total size of the saved (extracted) inputs of one batch.
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", 10 * 1024 ** 3))
+BATCH_DIR = os.getenv("BATCH_DIR", os.path.join(dataset_cache.CACHE_DIR, "batches"))
+
+CSV_SUFFIXES = (".csv", ".csv.gz")
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+COPY_BLOCK = 1 << 20
+COMBINED_NAME = "processed_data"
+# Batches are large by nature; Excel (the single-file default for small
+# results) is only written when the client asks for it.
+DEFAULT_FORMAT = "csv.gz"
+
+_executor = None
+# A pool inherited through fork belongs to the parent (its manager thread
+# did not survive the fork); the child starts its own.
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+class BatchError(ValueError):
+    pass
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _restart(broken):
+    # A worker killed mid-file (e.g. out of memory) breaks the whole pool;
+    # the other files it was given fail too, but must not restart it again.
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _members(upload):
+    # (name, open) for each file in an uploaded archive, or the upload itself.
+    name = upload.filename or "upload.csv"
+    lower = name.lower()
+    if lower.endswith(".zip"):
+        try:
+            archive = zipfile.ZipFile(upload.stream)
+        except zipfile.BadZipFile as e:
+            raise BatchError(f"{name} is not a valid zip archive: {e}")
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield info.filename, lambda info=info: archive.open(info)
+    elif lower.endswith(ARCHIVE_SUFFIXES):
+        try:
+            archive = tarfile.open(fileobj=upload.stream, mode="r:*")
+        except tarfile.TarError as e:
+            raise BatchError(f"{name} is not a valid tar archive: {e}")
+        for member in archive:
+            if member.isfile():
+                yield member.name, lambda member=member: archive.extractfile(member)
+    else:
+        yield name, lambda: upload.stream
+
+
+def prepare(uploads):
+    """Saves every CSV in ``uploads`` to a new working directory. Returns
+    ``(workdir, inputs)``; inputs are ``{"file", "path"}`` dicts in upload
+    order, with ``path`` None (and an ``error``) for non-CSV archive members."""
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    workdir = tempfile.mkdtemp(dir=BATCH_DIR)
+    try:
+        inputs = []
+        remaining = BATCH_MAX_BYTES
+        for upload in uploads:
+            for name, open_member in _members(upload):
+                suffix = next((s for s in CSV_SUFFIXES if name.lower().endswith(s)), None)
+                if suffix is None:
+                    inputs.append({"file": name, "path": None, "error": "Not a CSV file"})
+                    continue
+                if sum(item["path"] is not None for item in inputs) >= BATCH_MAX_FILES:
+                    raise BatchError(f"A batch can contain at most {BATCH_MAX_FILES} CSV files")
+
+                # Numbered paths: archive member names are never used on disk.
+                path = os.path.join(workdir, f"{len(inputs)}{suffix}")
+                source = open_member()
+                with open(path, "wb") as f:
+                    for block in iter(lambda: source.read(COPY_BLOCK), b""):
+                        remaining -= len(block)
+                        if remaining < 0:
+                            raise BatchError(f"The batch exceeds {BATCH_MAX_BYTES} bytes of input")
+                        f.write(block)
+                inputs.append({"file": name, "path": path})
+
+        if not any(item["path"] for item in inputs):
+            raise BatchError("No CSV files found in the upload")
+        return workdir, inputs
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+
+def process_file(path, plan, fmt, output_path, header=True):
+    # Runs in a pool process: parse, transform and write one file. With the
+    # parallelism across files, the plan itself runs serially.
+    start = time.perf_counter()
+    with metrics.stage("batch.file") as stage:
+        df, _ = dataset_cache.parse_csv(path)
+        stage.frame(df)
+        cleaned = run_plan(df, plan)
+        del df
+        with open(output_path, "wb") as f:
+            if fmt in STREAMING_FORMATS:
+                for chunk in encode_stream(csv_chunks(cleaned, header=header), fmt):
+                    f.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+            else:
+                shutil.copyfileobj(serialize_frame(cleaned, fmt), f)
+    return {"rows": len(cleaned), "columns": [str(col) for col in cleaned.columns], "format": fmt,
+            "seconds": round(time.perf_counter() - start, 4)}
+
+
+def _results(inputs, plan, fmt, header, workdir):
+    # (input, outcome) in input order; outcome has "status" and either the
+    # worker's result and "output_path", or an "error".
+    window = 2 * BATCH_WORKERS
+    pending = deque()
+    todo = iter(enumerate(inputs))
+    try:
+        while True:
+            for i, item in todo:
+                pool, future, output_path = None, None, os.path.join(workdir, f"{i}.out")
+                if item["path"]:
+                    pool = _get_executor()
+                    future = pool.submit(process_file, item["path"], plan, fmt, output_path, header)
+                pending.append((item, pool, future, output_path))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+
+            item, pool, future, output_path = pending.popleft()
+            if future is None:
+                outcome = {"status": "skipped", "error": item["error"]}
+            else:
+                try:
+                    outcome = {"status": "done", **future.result(), "output_path": output_path}
+                except BrokenProcessPool:
+                    _restart(pool)
+                    outcome = {"status": "failed", "error": "The process handling this file was killed (out of memory?)"}
+                except Exception as e:
+                    outcome = {"status": "failed", "error": str(e)}
+            yield item, outcome
+    finally:
+        # Client gone or batch finished: drop whatever has not started.
+        for _, _, future, _ in pending:
+            if future is not None:
+                future.cancel()
+
+
+def _manifest_entry(item, outcome, output=None):
+    entry = {"file": item["file"], "status": outcome["status"], "output": output}
+    if outcome["status"] == "done":
+        entry.update(rows=outcome["rows"], columns=len(outcome["columns"]), seconds=outcome["seconds"])
+    else:
+        entry["error"] = outcome["error"]
+    return entry
+
+
+def _output_name(file, fmt, used):
+    stem = os.path.basename(file)
+    for suffix in CSV_SUFFIXES[::-1]:
+        if stem.lower().endswith(suffix):
+            stem = stem[:-len(suffix)]
+            break
+    name, n = f"{stem}.{fmt}", 1
+    while name in used:
+        n += 1
+        name = f"{stem}_{n}.{fmt}"
+    used.add(name)
+    return name
+
+
+class _Sink:
+    # Write-only file for ZipFile: written bytes are collected and handed to
+    # the response as the archive is built.
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self.parts:
+            data, self.parts = b"".join(self.parts), []
+            yield data
+
+
+def _entry(name, fmt):
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    # Only plain CSV is worth compressing again.
+    info.compress_type = zipfile.ZIP_DEFLATED if fmt == "csv" else zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def _combined_chunks(results, manifest, fmt):
+    # Files are written without a header; the first successful file's
+    # columns become the combined header and the others must match them.
+    columns = None
+    for item, outcome in results:
+        if outcome["status"] == "done":
+            if columns is None:
+                columns = outcome["columns"]
+                yield pd.DataFrame(columns=columns).to_csv(index=False)
+            elif outcome["columns"] != columns:
+                outcome = {"status": "failed", "error": "Columns differ from the first file in the batch"}
+        manifest.append(_manifest_entry(item, outcome, f"{COMBINED_NAME}.{fmt}" if outcome["status"] == "done" else None))
+        if outcome["status"] == "done":
+            with open(outcome["output_path"], encoding="utf-8", newline="") as f:
+                yield from iter(lambda: f.read(COPY_BLOCK), "")
+            os.remove(outcome["output_path"])
+
+
+def archive_stream(workdir, inputs, plan, fmt=DEFAULT_FORMAT, combine=False):
+    """Generator of the zip archive for a prepared batch: one output per
+    input (or, with ``combine``, a single CSV of all rows) and
+    ``manifest.json``. Removes ``workdir`` when finished or abandoned."""
+    start = time.perf_counter()
+    sink = _Sink()
+    manifest = []
+    try:
+        with zipfile.ZipFile(sink, "w") as archive:
+            if combine:
+                results = _results(inputs, plan, "csv", False, workdir)
+                with archive.open(_entry(f"{COMBINED_NAME}.{fmt}", fmt), "w", force_zip64=True) as out:
+                    for chunk in encode_stream(_combined_chunks(results, manifest, fmt), fmt):
+                        out.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+                        yield from sink.drain()
+            else:
+                used = set()
+                for item, outcome in _results(inputs, plan, fmt, True, workdir):
+                    name = None
+                    if outcome["status"] == "done":
+                        name = _output_name(item["file"], outcome["format"], used)
+                        with open(outcome["output_path"], "rb") as f, \
+                                archive.open(_entry(name, outcome["format"]), "w", force_zip64=True) as out:
+                            for block in iter(lambda: f.read(COPY_BLOCK), b""):
+                                out.write(block)
+                                yield from sink.drain()
+                        os.remove(outcome["output_path"])
+                    manifest.append(_manifest_entry(item, outcome, name))
+
+            counts = {status: sum(entry["status"] == status for entry in manifest)
+                      for status in ("done", "failed", "skipped")}
+            archive.writestr("manifest.json", json.dumps({
+                "files": manifest,
+                "combined": combine,
+                **counts,
+                "seconds": round(time.perf_counter() - start, 4),
+            }, indent=2))
+        yield from sink.drain()
+        print(f"Batch of {len(inputs)} files: {counts} in {time.perf_counter() - start:.1f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+from utils import metrics
+from utils.charts import correlation_matrix
+
+# Compact JSON chart specs for the frontend to draw, instead of PNGs of every
+# raw point. Payload size depends on these limits, not on the row count.
+MAX_POINTS = 2000
+HIST_BINS = 50
+MAX_CATEGORIES = 50
+MAX_HUE_BINS = 10
+MAX_OUTLIERS = 100
+
+
+def _values(array):
+    # JSON has no NaN; missing values are sent as null.
+    return [None if pd.isna(v) else v for v in np.asarray(array, dtype=object).tolist()]
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling of points sorted by x."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = [0]
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        a = selected[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        selected.append(start + int(np.argmax(area)))
+    selected.append(n - 1)
+    return np.array(selected)
+
+
+def scatter_data(df, x, y, method="hist", max_points=MAX_POINTS, bins=HIST_BINS):
+    pairs = df[[x, y]].dropna()
+    xs = pairs[x].to_numpy(dtype=float)
+    ys = pairs[y].to_numpy(dtype=float)
+
+    if len(pairs) <= max_points:
+        return {"type": "points", "x": _values(xs), "y": _values(ys), "rows": len(pairs)}
+
+    if method == "hist":
+        counts, x_edges, y_edges = np.histogram2d(xs, ys, bins=bins)
+        return {
+            "type": "hist2d",
+            "x_edges": x_edges.tolist(),
+            "y_edges": y_edges.tolist(),
+            "counts": counts.astype(int).tolist(),
+            "rows": len(pairs),
+        }
+
+    if method == "lttb":
+        order = np.argsort(xs, kind="stable")
+        keep = order[lttb(xs[order], ys[order], max_points)]
+    else:
+        keep = np.random.default_rng(42).choice(len(pairs), max_points, replace=False)
+    return {"type": "points", "x": _values(xs[keep]), "y": _values(ys[keep]), "rows": len(pairs),
+            "sampled": method}
+
+
+def box_data(series):
+    values = series.dropna().to_numpy(dtype=float)
+    if len(values) == 0:
+        return {"type": "box", "count": 0}
+
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    # Whiskers reach the most extreme values within 1.5 IQR, as seaborn draws them.
+    is_outlier = (values < q1 - 1.5 * iqr) | (values > q3 + 1.5 * iqr)
+    inside = values[~is_outlier]
+    outliers = values[is_outlier]
+    if len(outliers) > MAX_OUTLIERS:
+        outliers = np.random.default_rng(42).choice(outliers, MAX_OUTLIERS, replace=False)
+    return {
+        "type": "box",
+        "count": len(values),
+        "min": float(values.min()),
+        "q1": float(q1),
+        "median": float(median),
+        "q3": float(q3),
+        "max": float(values.max()),
+        "whisker_low": float(inside.min()),
+        "whisker_high": float(inside.max()),
+        "outlier_count": int(is_outlier.sum()),
+        "outliers": outliers.tolist(),
+    }
+
+
+def count_data(df, x, hue):
+    # Keep the most frequent categories; a continuous hue (the numeric target)
+    # is grouped into quantile bins instead of one bar per distinct value.
+    categories = df[x].astype(str).where(df[x].notna())
+    top = categories.value_counts().index[:MAX_CATEGORIES]
+    # Missing values stay missing (crosstab leaves them out, as countplot
+    # does) rather than being counted as "Other".
+    categories = categories.where(categories.isin(top) | categories.isna(), "Other")
+
+    hue_values = df[hue]
+    if pd.api.types.is_numeric_dtype(hue_values) and hue_values.nunique() > MAX_HUE_BINS:
+        hue_values = pd.qcut(hue_values, MAX_HUE_BINS, duplicates="drop")
+    table = pd.crosstab(categories, hue_values)
+
+    return {
+        "type": "counts",
+        "categories": [str(c) for c in table.index],
+        "hue": [str(h) for h in table.columns],
+        "counts": table.to_numpy().tolist(),
+        "truncated": bool(df[x].nunique() > MAX_CATEGORIES),
+    }
+
+
+def chart_payload(df, spec, importances=None, scatter="hist"):
+    if spec["kind"] == "heatmap":
+        corr = correlation_matrix(df, spec["target"])
+        return {"type": "matrix", "columns": [str(c) for c in corr.columns],
+                "matrix": [_values(row) for row in corr.to_numpy()]}
+    if spec["kind"] == "scatter":
+        return scatter_data(df, spec["x"], spec["y"], method=scatter)
+    if spec["kind"] == "count":
+        return count_data(df, spec["x"], spec["hue"])
+    if spec["kind"] == "box":
+        return box_data(df[spec["x"]])
+    if spec["kind"] == "importance":
+        series = importances()
+        return {"type": "bars", "labels": [str(i) for i in series.index], "values": _values(series.to_numpy())}
+    raise ValueError(f"Unknown chart kind: {spec['kind']}")
+
+
+def chart_payloads(df, specs, importances=None, scatter="hist"):
+    with metrics.stage("charts.data") as stage:
+        stage.frame(df)
+        return [{"name": spec["name"], "kind": spec["kind"],
+                 "data": chart_payload(df, spec, importances, scatter)} for spec in specs]
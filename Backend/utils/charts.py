@@ -0,0 +1,175 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from utils import dataset_cache, metrics
+
+# 0 or 1 renders in the request process; otherwise charts are rendered by a
+# pool of this many processes.
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", os.cpu_count() or 1))
+
+_executor = None
+# A pool inherited through fork belongs to the parent (its manager thread
+# did not survive the fork); the child starts its own.
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=DASHBOARD_WORKERS)
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def chart_specs(df, target, importance_method="random_forest"):
+    # Same charts, names and order as the dashboard has always returned.
+    numeric = [c for c in df.select_dtypes(include='number').columns]
+    categorical = [c for c in df.select_dtypes(include=['object', 'category']).columns if c != target]
+
+    specs = [{"name": "correlation_heatmap", "kind": "heatmap", "target": target}]
+    specs += [{"name": f"{col}_vs_{target}", "kind": "scatter", "x": col, "y": target}
+              for col in numeric if col != target]
+    specs += [{"name": f"{col}_distribution_by_{target}", "kind": "count", "x": col, "hue": target}
+              for col in categorical]
+    specs += [{"name": f"{col}_outliers", "kind": "box", "x": col} for col in numeric]
+    specs.append({"name": "feature_importance", "kind": "importance", "target": target, "method": importance_method})
+    return specs
+
+
+def correlation_matrix(df, target):
+    from sklearn.preprocessing import LabelEncoder
+
+    encoded_df = df.copy()
+    for col in df.select_dtypes(include=['object', 'category']).columns:
+        if col != target:
+            encoded_df[col] = LabelEncoder().fit_transform(df[col].astype(str))
+    return encoded_df.corr(numeric_only=True)
+
+
+def chart_columns(spec, target):
+    # The columns a chart is drawn from (None: all of them). The target is
+    # always included, since rows without it are dropped first.
+    if spec["kind"] in ("heatmap", "importance"):
+        return None
+    return list(dict.fromkeys([spec[key] for key in ("x", "y", "hue") if key in spec] + [target]))
+
+
+def chart_input(df, spec):
+    # Only the columns a chart needs are sent to the rendering process.
+    if spec["kind"] == "scatter":
+        return df[[spec["x"], spec["y"]]]
+    if spec["kind"] == "count":
+        return df[[spec["x"], spec["hue"]]]
+    if spec["kind"] == "box":
+        return df[[spec["x"]]]
+    raise ValueError(f"{spec['kind']} charts need precomputed input")
+
+
+def render_chart(spec, data):
+    # Uses the object-oriented Figure API: no pyplot global state, so charts
+    # can be drawn concurrently. matplotlib and seaborn are imported on first
+    # use; workers that never draw a chart do not pay for them.
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    if spec["kind"] == "heatmap":
+        fig = Figure(figsize=(10, 8))
+        ax = fig.subplots()
+        sns.heatmap(data, annot=False, cmap='coolwarm', fmt=".2f", ax=ax)
+        ax.set_title("Correlation Heatmap")
+    elif spec["kind"] == "scatter":
+        fig = Figure(figsize=(8, 6))
+        ax = fig.subplots()
+        sns.scatterplot(x=data[spec["x"]], y=data[spec["y"]], ax=ax)
+        ax.set_title(f"{spec['x']} vs {spec['y']}")
+    elif spec["kind"] == "count":
+        fig = Figure(figsize=(8, 6))
+        ax = fig.subplots()
+        sns.countplot(x=data[spec["x"]], hue=data[spec["hue"]], ax=ax)
+        ax.set_title(f"Distribution of {spec['x']} by {spec['hue']}")
+        ax.tick_params(axis='x', labelrotation=45)
+    elif spec["kind"] == "box":
+        fig = Figure(figsize=(8, 6))
+        ax = fig.subplots()
+        sns.boxplot(x=data[spec["x"]], ax=ax)
+        ax.set_title(f"Outliers in {spec['x']}")
+    elif spec["kind"] == "importance":
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        sns.barplot(x=data, y=data.index, ax=ax)
+        ax.set_title("Feature Importance")
+    else:
+        raise ValueError(f"Unknown chart kind: {spec['kind']}")
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def _cache_path(dataset_id, spec):
+    key = hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return os.path.join(dataset_cache.artifact_dir(dataset_id, "charts"), f"{key}.b64")
+
+
+def cached_chart(dataset_id, spec):
+    if dataset_id is None:
+        return None
+    try:
+        with open(_cache_path(dataset_id, spec)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def cache_chart(dataset_id, spec, image):
+    if dataset_id is None:
+        return
+    path = _cache_path(dataset_id, spec)
+    with open(f"{path}.tmp{os.getpid()}", "w") as f:
+        f.write(image)
+    os.replace(f"{path}.tmp{os.getpid()}", path)
+
+
+def render_charts(df, specs, dataset_id=None, importances=None):
+    """Renders ``specs`` for ``df`` and returns ``{name: base64 png}`` in spec
+    order. Cached charts are reused; the rest are drawn in the process pool.
+    ``importances`` is a callable computing the feature importance series,
+    called only if that chart is not cached, while the pool is busy."""
+    images = {}
+    pending = []
+    for spec in specs:
+        image = cached_chart(dataset_id, spec)
+        if image is not None:
+            images[spec["name"]] = image
+        else:
+            pending.append(spec)
+
+    def chart_data(spec):
+        if spec["kind"] == "heatmap":
+            return correlation_matrix(df, spec["target"])
+        if spec["kind"] == "importance":
+            return importances()
+        return chart_input(df, spec)
+
+    # Charts whose input is ready are submitted first, so the pool renders
+    # them while feature importance is computed here.
+    pending.sort(key=lambda spec: spec["kind"] == "importance")
+    with metrics.stage("charts.render") as stage:
+        stage.frame(df)
+        if DASHBOARD_WORKERS > 1 and len(pending) > 1:
+            executor = _get_executor()
+            futures = [(spec, executor.submit(render_chart, spec, chart_data(spec))) for spec in pending]
+            rendered = [(spec, future.result()) for spec, future in futures]
+        else:
+            rendered = [(spec, render_chart(spec, chart_data(spec))) for spec in pending]
+
+    for spec, image in rendered:
+        cache_chart(dataset_id, spec, image)
+        images[spec["name"]] = image
+    return {spec["name"]: images[spec["name"]] for spec in specs}
@@ -0,0 +1,148 @@
+import ast
+import hashlib
+import json
+import os
+import re
+import time
+from functools import lru_cache
+from utils import dataset_cache, ingest
+
+# Generated preprocess functions are saved as plans keyed on the normalized
+# prompt and the dataset schema, so the same instructions applied to the
+# next file with the same columns skip the LLM call. A plan can also be
+# re-applied explicitly by its id. Plans are small JSON files; the parsed
+# imports and compiled code objects of the COMPILED_PLANS most recently used
+# are kept in memory per process.
+PLANS_DIR = os.getenv("PLANS_DIR", os.path.join(dataset_cache.CACHE_DIR, "plans"))
+COMPILED_PLANS = int(os.getenv("COMPILED_PLANS", 256))
+
+_PLAN_ID = re.compile(r"[0-9a-f]{64}")
+
+
+class GeneratedCodeError(Exception):
+    pass
+
+
+class PlanNotFound(LookupError):
+    pass
+
+
+def normalize_prompt(prompt):
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def _kind(dtype):
+    # Dtype families rather than exact dtypes: uploads are narrowed to the
+    # smallest dtype that fits, which can differ from one file to the next.
+    if dtype.kind == "b":
+        return "bool"
+    if dtype.kind in "iuf":
+        return "number"
+    if dtype.kind == "M":
+        return "datetime"
+    return "text"
+
+
+def schema_of(df):
+    return [[str(col), _kind(dtype)] for col, dtype in df.dtypes.items()]
+
+
+def plan_id_for(prompt, schema):
+    key = json.dumps({"prompt": normalize_prompt(prompt), "schema": schema})
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _path(plan_id):
+    if not _PLAN_ID.fullmatch(plan_id or ""):
+        raise PlanNotFound(f"Invalid plan id: {plan_id}")
+    return os.path.join(PLANS_DIR, f"{plan_id}.json")
+
+
+def load(plan_id):
+    try:
+        with open(_path(plan_id), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise PlanNotFound(f"Plan not found: {plan_id}")
+
+
+def save(plan):
+    os.makedirs(PLANS_DIR, exist_ok=True)
+    path = _path(plan["plan_id"])
+    with open(f"{path}.tmp{os.getpid()}", "w", encoding="utf-8") as f:
+        json.dump(plan, f)
+    os.replace(f"{path}.tmp{os.getpid()}", path)
+
+
+def extract_imports_and_execute(code):
+
+    tree = ast.parse(code)
+
+    imported_libraries = {}
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imported_libraries[alias.asname or alias.name] = __import__(alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module
+            if module:
+                imported_module = __import__(module, fromlist=[alias.name for alias in node.names])
+                for alias in node.names:
+                    imported_libraries[alias.asname or alias.name] = getattr(imported_module, alias.name)
+
+    return imported_libraries
+
+
+@lru_cache(maxsize=COMPILED_PLANS)
+def _compile(code, plan_id):
+    try:
+        libraries = extract_imports_and_execute(code)
+        code_object = compile(code, f"<plan {plan_id[:12]}>", "exec")
+    except Exception as e:
+        raise GeneratedCodeError(f"Error in executing generated code: {str(e)}")
+    return code_object, libraries
+
+
+def compiled(plan):
+    """``(code_object, libraries)`` for a plan, parsed and compiled once per
+    process while it is among the COMPILED_PLANS most recently used."""
+    return _compile(plan["code"], plan["plan_id"])
+
+
+def run(plan, df):
+    code_object, libraries = compiled(plan)
+    # A fresh namespace per run, so state left by one run never leaks into
+    # the next.
+    namespace = dict(libraries)
+    try:
+        exec(code_object, namespace)
+    except Exception as e:
+        raise GeneratedCodeError(f"Error in executing generated code: {str(e)}")
+    if "preprocess" not in namespace:
+        raise GeneratedCodeError("The generated code does not define 'preprocess'")
+
+    processed_df = namespace["preprocess"](ingest.widen_dtypes(df))
+    if processed_df is None:
+        raise GeneratedCodeError("The generated code did not return 'processed_df'")
+    return processed_df
+
+
+def get_or_generate(prompt, df, generate, execute=run):
+    """Returns ``(plan, processed_df)``. A plan saved for the same prompt and
+    schema is reused; otherwise ``generate(prompt)`` is asked for code, which
+    is saved as a plan only once it has run successfully. ``execute(plan, df)``
+    runs the plan (in this process by default)."""
+    schema = schema_of(df)
+    plan_id = plan_id_for(prompt, schema)
+    try:
+        plan = load(plan_id)
+        return plan, execute(plan, df)
+    except PlanNotFound:
+        pass
+
+    plan = {"plan_id": plan_id, "prompt": prompt, "schema": schema, "code": generate(prompt),
+            "created": time.time()}
+    processed_df = execute(plan, df)
+    save(plan)
+    return plan, processed_df
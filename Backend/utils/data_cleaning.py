@@ -1,86 +1,175 @@
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler, StandardScaler
-from sklearn.ensemble import IsolationForest
+from utils import dedup, metrics, outliers
+from utils.ingest import NUMERIC_DTYPES, CATEGORICAL_DTYPES
+
+
+def numeric_columns(df):
+    return df.select_dtypes(include=NUMERIC_DTYPES).columns
+
+
+def categorical_columns(df):
+    return df.select_dtypes(include=CATEGORICAL_DTYPES).columns
+
+
+def compile_plan(config):
+    # Turn the user config into an ordered list of steps. Invalid options are
+    # rejected here, before any data is touched.
+    plan = []
 
-def preprocess_pipeline(df, config):
-    # Handle missing values
     if config.get("remove_columns"):
-        df = df.drop(columns=config["remove_columns"], errors="ignore")
+        plan.append({"step": "remove_columns", "columns": list(config["remove_columns"])})
 
     if config.get("remove_na") == True:
-        df = df.dropna()
+        plan.append({"step": "remove_na"})
     else:
-        if config.get("missing_values_num") and config["missing_values_num"]["strategy"] != "none":
-            strategy = config["missing_values_num"]["strategy"]
-            numerical_cols = df.select_dtypes(include=['float64', 'int64']).columns        
-
-            if strategy == "mean":
-                for col in numerical_cols:
-                    df[col] = df[col].fillna(df[col].mean())            
-            elif strategy == "median":
-                for col in numerical_cols:
-                    df[col] = df[col].fillna(df[col].median())
-            elif strategy == "mode":
-                for col in numerical_cols:
-                    df[col] = df[col].fillna(df[col].mode()[0])
-
-        if config.get("missing_values_cat") and config["missing_values_cat"]["strategy"] != "none":
-            strategy = config["missing_values_cat"]["strategy"]        
-            categorical_cols = df.select_dtypes(include=['object']).columns
-            
-            if strategy == "mode":
-                for col in categorical_cols:
-                    df[col] = df[col].fillna(df[col].mode()[0])            
-
-    # Remove duplicates
+        num_strategy = (config.get("missing_values_num") or {}).get("strategy", "none")
+        if num_strategy in ("mean", "median", "mode"):
+            plan.append({"step": "impute", "columns": "numeric", "strategy": num_strategy})
+
+        cat_strategy = (config.get("missing_values_cat") or {}).get("strategy", "none")
+        if cat_strategy == "mode":
+            plan.append({"step": "impute", "columns": "categorical", "strategy": cat_strategy})
+
     if config.get("remove_duplicates", False):
-        df.drop_duplicates(inplace=True)
-
-    # Normalize or standardize numerical columns
-    if config.get("normalize"):
-        if config["normalize"]["method"] != "none":
-            method = config["normalize"]["method"]
-            # col = len(config["normalize"]["columns"])        
-            # # Check if columns list is empty
-            # if col != 0:
-            #     columns = config["normalize"].get("columns", df.select_dtypes(include=['float64', 'int64']).columns)            
-            # else:
-            columns = df.select_dtypes(include=['float64', 'int64']).columns
-
-            if method == "minmax":
-                scaler = MinMaxScaler()
-            elif method == "zscore":
-                scaler = StandardScaler()
-            else:
-                raise ValueError("Invalid normalization method: choose 'minmax' or 'zscore'.")
-            df[columns] = scaler.fit_transform(df[columns])
-
-    # Remove outliers
-    if config.get("remove_outliers"):
-        if config["remove_outliers"]["method"] != "none":
-            method = config["remove_outliers"]["method"]
+        plan.append({"step": "remove_duplicates"})
+
+    if config.get("normalize") and config["normalize"]["method"] != "none":
+        method = config["normalize"]["method"]
+        if method not in ("minmax", "zscore"):
+            raise ValueError("Invalid normalization method: choose 'minmax' or 'zscore'.")
+        plan.append({"step": "normalize", "method": method})
+
+    if config.get("remove_outliers") and config["remove_outliers"]["method"] != "none":
+        method = config["remove_outliers"]["method"]
+        if method in outliers.BOUND_METHODS:
+            step = {"step": "remove_outliers", "method": method}
+            if config["remove_outliers"].get("threshold") is not None:
+                step["threshold"] = float(config["remove_outliers"]["threshold"])
+            plan.append(step)
+        elif method == "isolation_forest":
             contamination = config["remove_outliers"].get("contamination", 0.1)
-            # col = len(config["remove_outliers"]["columns"])        
-            
-            # if col != 0:
-            #     columns = config["remove_outliers"].get("columns", df.select_dtypes(include=['float64', 'int64']).columns)
-                
-            # else:
-            columns = df.select_dtypes(include=['float64', 'int64']).columns
-
-            if method == "iqr":
-                for col in columns:
-                    Q1 = df[col].quantile(0.25)
-                    Q3 = df[col].quantile(0.75)
-                    IQR = Q3 - Q1
-                    lower_bound = Q1 - 1.5 * IQR
-                    upper_bound = Q3 + 1.5 * IQR
-                    df = df[(df[col] >= lower_bound) & (df[col] <= upper_bound)]
-            elif method == "isolation_forest":
-                clf = IsolationForest(contamination=contamination, random_state=42)
-                preds = clf.fit_predict(df[columns])
-                df = df[preds == 1]
-            else:
-                raise ValueError("Invalid outlier removal method: choose 'iqr' or 'isolation_forest'.")
+            plan.append({"step": "remove_outliers", "method": method, "contamination": contamination})
+        else:
+            raise ValueError("Invalid outlier removal method: choose 'iqr', 'zscore', 'mad' or 'isolation_forest'.")
+
+    return plan
 
+
+def _select(df, which):
+    return numeric_columns(df) if which == "numeric" else categorical_columns(df)
+
+
+# Each step is a (fit, apply) pair. fit computes every statistic the step
+# needs for all columns at once; apply only uses those statistics.
+
+def _fit_noop(df, step):
+    return {}
+
+
+def _apply_remove_columns(df, step, params):
+    return df.drop(columns=step["columns"], errors="ignore")
+
+
+def _apply_remove_na(df, step, params):
+    return df.dropna()
+
+
+def _fit_impute(df, step):
+    columns = _select(df, step["columns"])
+    if len(columns) == 0:
+        return {"values": {}}
+
+    subset = df[columns]
+    if step["strategy"] == "mean":
+        values = subset.mean()
+    elif step["strategy"] == "median":
+        values = subset.median()
+    else:
+        modes = subset.mode()
+        values = modes.iloc[0] if len(modes) else pd.Series(dtype=object)
+    return {"values": values.dropna().to_dict()}
+
+
+def _apply_impute(df, step, params):
+    if params["values"]:
+        df = df.fillna(params["values"])
+    return df
+
+
+def _apply_remove_duplicates(df, step, params):
+    return dedup.drop_duplicates(df)
+
+
+def _fit_normalize(df, step):
+    columns = numeric_columns(df)
+    subset = df[columns]
+    if step["method"] == "minmax":
+        # In float64: the range of a narrow integer column (int8, ...) can
+        # overflow its own dtype.
+        offset = subset.min().astype(np.float64)
+        scale = subset.max().astype(np.float64) - offset
+    else:
+        offset = subset.mean()
+        scale = subset.std(ddof=0)
+    # Constant columns are left unscaled, as sklearn's scalers do.
+    scale = scale.where(scale != 0, 1.0)
+    return {"columns": list(columns), "offset": offset.to_dict(), "scale": scale.to_dict()}
+
+
+def _apply_normalize(df, step, params):
+    columns = params["columns"]
+    if columns:
+        offset = pd.Series(params["offset"])[columns]
+        scale = pd.Series(params["scale"])[columns]
+        normalized = (df[columns] - offset) / scale
+        # Assigned on a shallow copy: the input may be a slice of another
+        # frame (after a row filter, or a block in parallel execution).
+        df = df.copy(deep=False)
+        df[columns] = normalized
     return df
+
+
+def _fit_remove_outliers(df, step):
+    if step["method"] == "isolation_forest":
+        columns = numeric_columns(df)
+        return {"columns": list(columns), "model": outliers.fit_isolation_forest(df[columns], step["contamination"])}
+    return outliers.fit_bounds(df, step)
+
+
+def _apply_remove_outliers(df, step, params):
+    if step["method"] == "isolation_forest":
+        return df.loc[outliers.isolation_forest_inliers(params["model"], df[params["columns"]])]
+    return df.loc[outliers.within_bounds(df, params)]
+
+
+STEPS = {
+    "remove_columns": (_fit_noop, _apply_remove_columns),
+    "remove_na": (_fit_noop, _apply_remove_na),
+    "impute": (_fit_impute, _apply_impute),
+    "remove_duplicates": (_fit_noop, _apply_remove_duplicates),
+    "normalize": (_fit_normalize, _apply_normalize),
+    "remove_outliers": (_fit_remove_outliers, _apply_remove_outliers),
+}
+
+
+def run_plan(df, plan, on_step=None):
+    # on_step(index, step) is called before each step (used for progress).
+    for i, step in enumerate(plan):
+        if on_step:
+            on_step(i, step)
+        fit, apply = STEPS[step["step"]]
+        with metrics.stage(f"preprocess.{step['step']}") as stage:
+            df = stage.frame(apply(df, step, fit(df, step)))
+    return df
+
+
+def preprocess_pipeline(df, config):
+    # Imported here: utils.parallel is built on the steps defined above.
+    from utils.parallel import execution_options, run_plan_parallel
+
+    plan = compile_plan(config)
+    execution = execution_options(config)
+    if execution["backend"] == "serial":
+        return run_plan(df, plan)
+    return run_plan_parallel(df, plan, execution)
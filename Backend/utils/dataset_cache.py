@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from utils import ingest, metrics
+
+# Parsed uploads are stored once, keyed by the SHA-256 of the raw file, as
+# uncompressed Arrow/Feather files so they can be memory-mapped on reuse.
+CACHE_DIR = os.getenv("DATASET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dataoptimizer_cache"))
+CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+_DATASET_ID = re.compile(r"[0-9a-f]{64}")
+
+
+class DatasetNotFound(LookupError):
+    pass
+
+
+def _check_id(dataset_id):
+    if not _DATASET_ID.fullmatch(dataset_id or ""):
+        raise DatasetNotFound(f"Invalid dataset id: {dataset_id}")
+    return dataset_id
+
+
+def _path(dataset_id, suffix):
+    return os.path.join(CACHE_DIR, f"{_check_id(dataset_id)}{suffix}")
+
+
+def hash_upload(stream):
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(1 << 20), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, write):
+    # Several gunicorn workers can store the same upload at once; write to a
+    # temporary file and rename so readers never see a partial file.
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _schema_path(columns):
+    # Schemas are shared by uploads with the same header, e.g. daily extracts.
+    signature = hashlib.sha256("\x1f".join(map(str, columns)).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, "schemas", f"{signature}.json")
+
+
+def load_schema(columns):
+    try:
+        with open(_schema_path(columns)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_schema(columns, schema):
+    os.makedirs(os.path.join(CACHE_DIR, "schemas"), exist_ok=True)
+    _write_atomic(_schema_path(columns), lambda p: _dump_json(schema, p))
+
+
+def store(dataset_id, df, report=None):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    data_path = _path(dataset_id, ".feather")
+    _write_atomic(data_path, lambda p: feather.write_feather(df.reset_index(drop=True), p, compression="uncompressed"))
+
+    meta = {
+        "columns": list(df.columns),
+        "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
+        "rows": len(df),
+        "ingest": report,
+    }
+    _write_atomic(_path(dataset_id, ".json"), lambda p: _dump_json(meta, p))
+    evict()
+    return meta
+
+
+def _dump_json(obj, path):
+    with open(path, "w") as f:
+        json.dump(obj, f)
+
+
+def load_meta(dataset_id):
+    try:
+        with open(_path(dataset_id, ".json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise DatasetNotFound(f"Dataset {dataset_id} is not cached; upload the file again")
+
+
+def _open_table(dataset_id):
+    path = _path(dataset_id, ".feather")
+    try:
+        table = feather.read_table(path, memory_map=True)
+    except FileNotFoundError:
+        raise DatasetNotFound(f"Dataset {dataset_id} is not cached; upload the file again")
+    # Eviction is least-recently-used by modification time.
+    os.utime(path)
+    return table
+
+
+def load(dataset_id, columns=None):
+    # With `columns`, only those columns of the mapped file are read.
+    with metrics.stage("load_cached") as stage:
+        table = _open_table(dataset_id)
+        if columns is not None:
+            table = table.select(columns)
+        return stage.frame(table.to_pandas())
+
+
+def empty_frame(dataset_id):
+    # The dataset's columns and dtypes, without reading any rows.
+    return _open_table(dataset_id).slice(0, 0).to_pandas()
+
+
+def sample(dataset_id, n, seed=42):
+    """Returns ``(rows, total)``: ``n`` rows drawn uniformly without
+    replacement (kept in file order) and the dataset's row count. Only the
+    pages holding sampled rows are read from the mapped file."""
+    with metrics.stage("sample_cached") as stage:
+        table = _open_table(dataset_id)
+        total = table.num_rows
+        if total > n:
+            table = table.take(np.sort(np.random.default_rng(seed).choice(total, n, replace=False)))
+        return stage.frame(table.to_pandas()), total
+
+
+def data_file(dataset_id):
+    # The cached Feather file itself, for processes that map it directly.
+    path = _path(dataset_id, ".feather")
+    if not os.path.exists(path):
+        raise DatasetNotFound(f"Dataset {dataset_id} is not cached; upload the file again")
+    os.utime(path)
+    return path
+
+
+def chunk_reader(dataset_id, chunksize):
+    # Slices of a memory-mapped table are zero-copy; only the chunk being
+    # converted to pandas is materialised.
+    def read_chunks():
+        table = _open_table(dataset_id)
+        for start in range(0, table.num_rows, chunksize):
+            yield table.slice(start, chunksize).to_pandas()
+    return read_chunks
+
+
+def artifact_dir(dataset_id, kind):
+    # Derived results (rendered charts, ...) live next to the dataset and are
+    # evicted with it.
+    path = os.path.join(CACHE_DIR, "artifacts", _check_id(dataset_id), kind)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def evict(max_bytes=CACHE_MAX_BYTES):
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".feather"):
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name[:-len(".feather")]))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, dataset_id in sorted(entries):
+        if total <= max_bytes:
+            break
+        for suffix in (".feather", ".json"):
+            try:
+                os.remove(_path(dataset_id, suffix))
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(os.path.join(CACHE_DIR, "artifacts", dataset_id), ignore_errors=True)
+        total -= size
+
+
+def is_cached(dataset_id):
+    return os.path.exists(_path(dataset_id, ".feather"))
+
+
+def get_or_parse(file):
+    return parse_stream(file.stream)
+
+
+def parse_stream(stream):
+    # Same as get_or_parse for a seekable binary stream, e.g. a saved upload.
+    dataset_id = hash_upload(stream)
+    if is_cached(dataset_id):
+        try:
+            return dataset_id, load(dataset_id)
+        except DatasetNotFound:
+            # Evicted by another worker in the meantime.
+            pass
+
+    df, report = parse_csv(stream)
+    print(f"Parsed dataset {dataset_id}: {report}")
+    try:
+        store(dataset_id, df, report)
+    except (pa.ArrowException, OSError) as e:
+        # Frames Arrow cannot represent are simply not cached.
+        print(f"Could not cache dataset {dataset_id}: {e}")
+    return dataset_id, df
+
+
+def parse_csv(source):
+    # Parses a stream or path with the schema saved for its header, saving
+    # one when the header is new. Returns ``(df, report)``; nothing is cached.
+    if hasattr(source, "seek"):
+        source.seek(0)
+    columns = list(pd.read_csv(source, nrows=0).columns)
+    schema = load_schema(columns)
+    with metrics.stage("parse_csv") as stage:
+        df, report = ingest.read_csv(source, schema)
+        stage.frame(df)
+    if schema is None:
+        try:
+            save_schema(columns, ingest.schema_of(df))
+        except OSError as e:
+            print(f"Could not save schema: {e}")
+    return df, report
+
+
+def frame_from_request(files, form):
+    """Returns ``(dataset_id, df)`` for an uploaded ``file`` or a previously
+    returned ``dataset_id``, or ``(None, None)`` when neither was sent."""
+    if 'file' in files:
+        return get_or_parse(files['file'])
+    if form.get('dataset_id'):
+        return form['dataset_id'], load(form['dataset_id'])
+    return None, None
@@ -1,7 +1,6 @@
-from langchain_groq import ChatGroq
+from utils import llm
 # from langchain.prompts import PromptTemplate
 # from langchain_core.output_parsers import StrOutputParser as sop
-import os
 from flask import jsonify
 
 def search_datasets(query):
@@ -41,15 +40,7 @@ def search_datasets(query):
         """
         #prompt_template = PromptTemplate.from_template(full_prompt)       
 
-        chat = ChatGroq(
-            model="llama-3.3-70b-versatile",            
-            model_kwargs = {'seed' : 365},
-            temperature = 0.1,
-            api_key = os.getenv('GROQ_API_KEY')           
-        )        
-        response = chat.invoke(full_prompt)
-
-        return response.content
+        return llm.complete(full_prompt, model=llm.CODE_MODEL, temperature=0.1, seed=365)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
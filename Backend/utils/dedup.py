@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+# Duplicate rows are found by a vectorized 64-bit hash of each row instead of
+# comparing whole rows, so memory is 8 bytes per distinct row rather than a
+# copy of the data. The same hashes work across chunks of a stream.
+
+
+# Multiplier/offset for combining column hashes (as in boost::hash_combine).
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _numeric_keys(values):
+    # Chunks can disagree on int64 vs float64 (or narrowed int8, float32, ...)
+    # for the same column, so whole numbers hash by their integer value
+    # whatever the dtype (this also folds -0.0 into 0), and other floats by
+    # their float64 bits. Integers are never cast to float, so large ones
+    # stay distinct.
+    if values.dtype.kind in "iu":
+        return values.astype(np.int64, copy=False).view(np.uint64)
+    values = values.astype(np.float64, copy=False)
+    with np.errstate(invalid="ignore"):
+        whole = np.isfinite(values) & (values == np.trunc(values)) & (np.abs(values) < 2.0 ** 63)
+    keys = values.view(np.uint64).copy()
+    keys[whole] = values[whole].astype(np.int64).view(np.uint64)
+    return keys
+
+
+def _column_hash(series):
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "iuf":
+        return pd.util.hash_array(_numeric_keys(series.to_numpy()))
+    if dtype.kind in "iuf" and not isinstance(dtype, np.dtype):
+        # Nullable (extension) numbers: missing values hash as NaN.
+        return pd.util.hash_array(_numeric_keys(series.to_numpy(dtype=np.float64, na_value=np.nan)))
+    # Categoricals hash by value, so differing categories per chunk are fine.
+    return pd.util.hash_pandas_object(series, index=False).to_numpy()
+
+
+def row_hashes(df):
+    """One 64-bit hash per row, combined column by column so memory stays
+    proportional to the hash vector rather than to a copy of the frame."""
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for i in range(df.shape[1]):
+        column = _column_hash(df.iloc[:, i])
+        hashes ^= column + _MIX + (hashes << np.uint64(6)) + (hashes >> np.uint64(2))
+    return hashes
+
+
+def first_occurrences(hashes):
+    """Boolean mask keeping the first row of every distinct hash."""
+    return ~pd.Series(hashes).duplicated().to_numpy()
+
+
+def drop_duplicates(df):
+    return df.loc[first_occurrences(row_hashes(df))]
+
+
+class SeenHashes:
+    """Set of row hashes seen so far in a stream.
+
+    Hashes are kept in sorted runs that are merged like a binary counter
+    (a run is merged into the previous one while it is at least as large),
+    so adding n hashes costs O(n log n) overall and a lookup is a binary
+    search per run.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[positions] == hashes
+        return found
+
+    def add(self, hashes):
+        run = np.unique(hashes)
+        if not len(run):
+            return
+        while self.runs and len(self.runs[-1]) <= len(run):
+            run = np.union1d(self.runs.pop(), run)
+        self.runs.append(run)
+
+    def new_rows(self, chunk):
+        """Mask of the chunk's rows not seen before (in earlier chunks or
+        earlier in this one); those rows are then marked as seen."""
+        hashes = row_hashes(chunk)
+        keep = first_occurrences(hashes)
+        if self.runs:
+            keep &= ~self.contains(hashes)
+        self.add(hashes[keep])
+        return keep
@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+import numpy as np
+
+# Retrieval index over routes/preprocessing_examples.txt for the code
+# generation prompt. It is built offline:
+#
+#     python -m utils.examples_index build [--embedding hashing]
+#
+# and saved as vectors.npy (unit-normalised float32) + chunks.json +
+# meta.json. Workers memory-map the vectors, so the pages are shared between
+# processes. The index is tagged with the source file's sha256 and the
+# embedding used. Under gunicorn the master loads it during warm-up (see
+# utils/warmup.py), so workers inherit it; a missing or stale index is
+# rebuilt there once, or on first use when there is no warm-up.
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_PATH = os.path.join(BACKEND_DIR, "routes", "preprocessing_examples.txt")
+INDEX_DIR = os.getenv("EXAMPLES_INDEX_DIR", os.path.join(BACKEND_DIR, "examples_index"))
+
+# "nvidia" embeds through the NVIDIA API (as the index always has);
+# "hashing" is a local character n-gram embedding that needs no network.
+EMBEDDING = os.getenv("EXAMPLES_EMBEDDING", "nvidia")
+NVIDIA_MODEL = "NV-Embed-QA"
+HASHING_FEATURES = 4096
+
+CHUNK_SIZE = 70
+CHUNK_OVERLAP = 10
+SEPARATORS = ["\n\n", "\n", " ", ""]
+
+# Maximal marginal relevance: TOP_K results picked from the FETCH_K nearest.
+TOP_K = 3
+FETCH_K = 20
+LAMBDA_MULT = 0.7
+
+_index = None
+
+
+def split_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, separators=SEPARATORS):
+    # Recursive character splitting: split on the coarsest separator present,
+    # recurse into pieces that are still too long, then merge neighbouring
+    # pieces up to chunk_size, carrying up to `overlap` characters over.
+    separator = next(s for s in separators if s == "" or s in text)
+    finer = separators[separators.index(separator) + 1:]
+    pieces = [p for p in (text.split(separator) if separator else list(text)) if p.strip()]
+
+    chunks, current = [], []
+
+    def joined(parts):
+        return separator.join(parts).strip()
+
+    for piece in pieces:
+        if len(piece) > chunk_size:
+            if current:
+                chunks.append(joined(current))
+                current = []
+            chunks.extend(split_text(piece, chunk_size, overlap, finer) if finer else [piece])
+            continue
+        if current and len(joined(current + [piece])) > chunk_size:
+            chunks.append(joined(current))
+            while current and (len(joined(current)) > overlap or len(joined(current + [piece])) > chunk_size):
+                current.pop(0)
+        current.append(piece)
+    if current:
+        chunks.append(joined(current))
+    return [c for c in chunks if c]
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _hashing_embed(texts):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    vectorizer = HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5), n_features=HASHING_FEATURES,
+                                   alternate_sign=False, norm=None)
+    return vectorizer.transform([t.lower() for t in texts]).toarray()
+
+
+def _nvidia_embed(texts, query=False):
+    from langchain_nvidia_ai_endpoints import NVIDIAEmbeddings
+    embeddings = NVIDIAEmbeddings(model=NVIDIA_MODEL, api_key=os.getenv('NVIDIA_API_KEY'))
+    return embeddings.embed_query(texts[0]) if query else embeddings.embed_documents(texts)
+
+
+def embed(texts, embedding=EMBEDDING, query=False):
+    if embedding == "hashing":
+        vectors = _hashing_embed(texts)
+    elif embedding == "nvidia":
+        vectors = _nvidia_embed(texts, query)
+    else:
+        raise ValueError(f"Unknown embedding backend: {embedding}")
+    return _normalize(vectors)
+
+
+def source_hash(path=SOURCE_PATH):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _write_atomic(path, write):
+    tmp = f"{path}.tmp{os.getpid()}"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def build(embedding=EMBEDDING, index_dir=INDEX_DIR, source=SOURCE_PATH):
+    with open(source, encoding="utf-8") as f:
+        chunks = split_text(f.read())
+    vectors = embed(chunks, embedding)
+
+    os.makedirs(index_dir, exist_ok=True)
+    meta = {
+        "source_sha256": source_hash(source),
+        "embedding": embedding,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunks": len(chunks),
+        "dim": int(vectors.shape[1]),
+    }
+
+    def save_vectors(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, vectors)
+
+    def save_json(data):
+        def write(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        return write
+
+    # meta.json is written last: it is what marks the index as complete.
+    _write_atomic(os.path.join(index_dir, "vectors.npy"), save_vectors)
+    _write_atomic(os.path.join(index_dir, "chunks.json"), save_json(chunks))
+    _write_atomic(os.path.join(index_dir, "meta.json"), save_json(meta))
+    return meta
+
+
+def _load(embedding, index_dir, source):
+    try:
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["source_sha256"] != source_hash(source) or meta["embedding"] != embedding:
+            return None
+        with open(os.path.join(index_dir, "chunks.json"), encoding="utf-8") as f:
+            chunks = json.load(f)
+        vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+    if len(chunks) != meta["chunks"] or vectors.shape[0] != len(chunks):
+        return None
+    return {"meta": meta, "chunks": chunks, "vectors": vectors}
+
+
+def get_index(embedding=EMBEDDING, index_dir=INDEX_DIR, source=SOURCE_PATH):
+    global _index
+    if _index is None:
+        index = _load(embedding, index_dir, source)
+        if index is None:
+            print(f"Examples index in {index_dir} is missing or stale; rebuilding with {embedding} embeddings")
+            build(embedding, index_dir, source)
+            index = _load(embedding, index_dir, source)
+        _index = index
+    return _index
+
+
+def mmr(query, vectors, k=TOP_K, fetch_k=FETCH_K, lambda_mult=LAMBDA_MULT):
+    scores = vectors @ query
+    candidates = list(np.argsort(-scores)[:fetch_k])
+    selected = []
+    while candidates and len(selected) < k:
+        if selected:
+            redundancy = (vectors[candidates] @ vectors[selected].T).max(axis=1)
+        else:
+            redundancy = np.zeros(len(candidates))
+        values = lambda_mult * scores[candidates] - (1 - lambda_mult) * redundancy
+        selected.append(candidates.pop(int(np.argmax(values))))
+    return selected
+
+
+@lru_cache(maxsize=256)
+def _retrieve(prompt):
+    index = get_index()
+    query = embed([prompt], index["meta"]["embedding"], query=True).reshape(-1)
+    return tuple(index["chunks"][i] for i in mmr(query, index["vectors"]))
+
+
+def retrieve(prompt):
+    """The example chunks most relevant to ``prompt``; cached per prompt."""
+    return list(_retrieve(re.sub(r"\s+", " ", prompt).strip()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the preprocessing examples retrieval index.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--embedding", default=EMBEDDING, choices=["nvidia", "hashing"])
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    args = parser.parse_args()
+    print(json.dumps(build(args.embedding, args.index_dir), indent=2))
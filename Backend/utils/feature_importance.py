@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from utils import dataset_cache, metrics
+
+# Budget for a single feature-importance computation. Rows beyond MAX_ROWS
+# are subsampled (stratified on the target); trees are added until either
+# MAX_TREES or MAX_SECONDS is reached.
+MAX_ROWS = int(os.getenv("IMPORTANCE_MAX_ROWS", 50_000))
+MAX_SECONDS = float(os.getenv("IMPORTANCE_MAX_SECONDS", 10))
+MAX_TREES = 100
+MAX_DEPTH = 12
+TREES_PER_ROUND = 10
+
+# Categorical columns up to this cardinality are one-hot encoded; above it
+# they are target- or hash-encoded into a fixed number of features.
+ONE_HOT_MAX_CARDINALITY = 20
+HASH_FEATURES = 16
+TARGET_SMOOTHING = 10
+# Target encoding is out-of-fold: each row is encoded with statistics from
+# the other folds, so a category's own target value never leaks into it.
+TARGET_FOLDS = 5
+# Categorical columns with nearly one value per row (ids, free text) carry
+# no generalisable signal and are left out of scoring.
+ID_MIN_UNIQUE_RATIO = 0.95
+
+METHODS = ("random_forest", "mutual_info", "correlation")
+
+
+def is_classification(y):
+    return y.dtype == 'object' or y.dtype.name == 'category'
+
+
+def stratified_sample(df, target, max_rows=MAX_ROWS, seed=42):
+    if len(df) <= max_rows:
+        return df
+    y = df[target]
+    if is_classification(y):
+        strata = y.astype(str)
+    else:
+        strata = pd.qcut(y.rank(method="first"), 10, labels=False)
+    frac = max_rows / len(df)
+    return df.groupby(strata, group_keys=False, observed=True).sample(frac=frac, random_state=seed)
+
+
+def id_like_columns(X):
+    numeric = X.select_dtypes(include=['number', 'bool']).columns
+    return [c for c in X.columns if c not in numeric and len(X) > 1
+            and X[c].nunique() >= ID_MIN_UNIQUE_RATIO * len(X)]
+
+
+def _target_encode(values, y_num, seed=42):
+    # Smoothed mean of the target per category, computed out of fold.
+    folds = np.random.default_rng(seed).permutation(len(values)) % TARGET_FOLDS
+    encoded = np.empty(len(values))
+    for fold in range(TARGET_FOLDS):
+        held_out = folds == fold
+        train_y = y_num[~held_out]
+        prior = train_y.mean()
+        stats = train_y.groupby(values[~held_out]).agg(["mean", "count"])
+        smoothed = (stats["mean"] * stats["count"] + prior * TARGET_SMOOTHING) / (stats["count"] + TARGET_SMOOTHING)
+        encoded[held_out] = values[held_out].map(smoothed).astype(float).fillna(prior).to_numpy()
+    return encoded
+
+
+def encode_features(X, y, high_cardinality="target"):
+    """Returns ``(encoded, groups)`` where ``groups`` maps each encoded column
+    back to the feature it is reported under. ID-like columns (see
+    ``id_like_columns``) are not encoded."""
+    numeric = X.select_dtypes(include=['number', 'bool'])
+    parts = [numeric.astype(float)]
+    groups = {col: col for col in numeric.columns}
+
+    ids = id_like_columns(X)
+    categorical = [c for c in X.columns if c not in numeric.columns and c not in ids]
+    low = [c for c in categorical if X[c].nunique() <= ONE_HOT_MAX_CARDINALITY]
+    high = [c for c in categorical if c not in low]
+
+    if low:
+        dummies = pd.get_dummies(X[low], drop_first=True, dtype=float)
+        parts.append(dummies)
+        groups.update({col: col for col in dummies.columns})
+
+    if high and high_cardinality == "hash":
+        from sklearn.feature_extraction import FeatureHasher
+        for col in high:
+            hasher = FeatureHasher(n_features=HASH_FEATURES, input_type="string")
+            hashed = hasher.transform(X[col].astype(str).to_numpy()[:, None]).toarray()
+            names = [f"{col}__hash{i}" for i in range(HASH_FEATURES)]
+            parts.append(pd.DataFrame(hashed, columns=names, index=X.index))
+            groups.update({name: col for name in names})
+    elif high:
+        # Target codes for classification.
+        y_num = pd.Series(pd.factorize(y)[0], index=y.index) if is_classification(y) else y.astype(float)
+        for col in high:
+            encoded = _target_encode(X[col].astype(str), y_num)
+            parts.append(pd.DataFrame({col: encoded}, index=X.index))
+            groups[col] = col
+
+    return pd.concat(parts, axis=1), groups
+
+
+def _grouped(importances, groups):
+    return importances.groupby(lambda col: groups[col], sort=False).sum()
+
+
+def random_forest_importances(X, y, max_seconds=MAX_SECONDS):
+    from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
+
+    model_class = RandomForestClassifier if is_classification(y) else RandomForestRegressor
+    model = model_class(n_estimators=TREES_PER_ROUND, max_depth=MAX_DEPTH, n_jobs=-1, warm_start=True,
+                        random_state=42)
+
+    # Grow the forest in rounds until the tree or time budget is used up.
+    start = time.perf_counter()
+    model.fit(X, y)
+    while model.n_estimators < MAX_TREES:
+        elapsed = time.perf_counter() - start
+        per_round = elapsed / (model.n_estimators / TREES_PER_ROUND)
+        if elapsed + per_round > max_seconds:
+            break
+        model.n_estimators += TREES_PER_ROUND
+        model.fit(X, y)
+    return pd.Series(model.feature_importances_, index=X.columns)
+
+
+def mutual_info_importances(X, y):
+    from sklearn.feature_selection import mutual_info_regression, mutual_info_classif
+
+    filled = X.fillna(X.median()).fillna(0)
+    if is_classification(y):
+        scores = mutual_info_classif(filled, y.astype(str), random_state=42)
+    else:
+        scores = mutual_info_regression(filled, y, random_state=42)
+    return pd.Series(scores, index=X.columns)
+
+
+def correlation_importances(X, y):
+    y_num = pd.Series(pd.factorize(y)[0], index=y.index) if is_classification(y) else y
+    return X.corrwith(y_num.astype(float)).abs().fillna(0)
+
+
+def _cache_path(dataset_id, key):
+    digest = hashlib.sha256(json.dumps(key, default=str).encode("utf-8")).hexdigest()
+    return os.path.join(dataset_cache.artifact_dir(dataset_id, "importance"), f"{digest}.json")
+
+
+def feature_importances(df, target, method="random_forest", dataset_id=None, high_cardinality="target"):
+    """Feature importances for ``target`` as a Series sorted descending,
+    computed within the row/time budget and cached per dataset and target."""
+    if method not in METHODS:
+        raise ValueError(f"Invalid importance method: choose one of {', '.join(METHODS)}.")
+
+    path = None
+    if dataset_id is not None:
+        path = _cache_path(dataset_id, (target, method, high_cardinality, MAX_ROWS, TARGET_FOLDS))
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            return pd.Series(cached["values"], index=cached["index"])
+        except FileNotFoundError:
+            pass
+
+    with metrics.stage(f"importance.{method}") as stage:
+        sample = stratified_sample(df, target)
+        X, groups = encode_features(sample.drop(columns=[target]), sample[target], high_cardinality)
+        y = sample[target]
+        stage.size(*X.shape)
+
+        if method == "random_forest":
+            importances = random_forest_importances(X, y)
+        elif method == "mutual_info":
+            importances = mutual_info_importances(X, y)
+        else:
+            importances = correlation_importances(X, y)
+    # ID-like columns are reported, with no importance.
+    importances = _grouped(importances, groups)
+    ids = [col for col in id_like_columns(sample.drop(columns=[target])) if col not in importances.index]
+    importances = pd.concat([importances, pd.Series(0.0, index=ids)]).sort_values(ascending=False)
+
+    if path is not None:
+        with open(f"{path}.tmp{os.getpid()}", "w") as f:
+            json.dump({"index": [str(i) for i in importances.index], "values": importances.tolist()}, f)
+        os.replace(f"{path}.tmp{os.getpid()}", path)
+    return importances
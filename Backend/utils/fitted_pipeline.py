@@ -0,0 +1,136 @@
+import fcntl
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from utils import dataset_cache
+from utils.data_cleaning import STEPS
+from utils.streaming import start_accumulators, fit_plan_chunked
+
+# A fitted pipeline is a compiled plan plus the params its steps were fitted
+# to and the streaming accumulators behind them (running sums and moments,
+# quantile sketches, value counts, a row reservoir). New batches are applied
+# with transform() alone, or merged into the accumulators with update(),
+# which refreshes the params without revisiting earlier data.
+#
+# Pipelines are saved with joblib (params can hold an IsolationForest)
+# under PIPELINES_DIR.
+PIPELINES_DIR = os.getenv("PIPELINES_DIR", os.path.join(dataset_cache.CACHE_DIR, "pipelines"))
+
+_PIPELINE_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class PipelineNotFound(LookupError):
+    pass
+
+
+def frame_reader(df):
+    # The chunk-reader interface over a single in-memory frame.
+    return lambda: iter([df])
+
+
+def columns_of(read_chunks):
+    return [str(col) for col in next(iter(read_chunks())).columns]
+
+
+def fit(read_chunks, plan):
+    accumulators = start_accumulators(plan)
+    now = time.time()
+    return {
+        "pipeline_id": uuid.uuid4().hex,
+        "plan": plan,
+        "params": fit_plan_chunked(read_chunks, plan, accumulators),
+        "accumulators": accumulators,
+        "columns": columns_of(read_chunks),
+        "batches": 1,
+        "created": now,
+        "updated": now,
+    }
+
+
+def update(pipeline, read_chunks):
+    """partial_fit: merges new data into the pipeline's accumulators and
+    refreshes its params. IsolationForest has no partial_fit, so it is
+    refitted on the merged row reservoir."""
+    check_columns(pipeline, columns_of(read_chunks))
+    pipeline["params"] = fit_plan_chunked(read_chunks, pipeline["plan"], pipeline["accumulators"],
+                                          previous=pipeline["params"])
+    pipeline["batches"] += 1
+    pipeline["updated"] = time.time()
+    return pipeline
+
+
+def check_columns(pipeline, columns):
+    missing = [col for col in pipeline["columns"] if col not in set(map(str, columns))]
+    if missing:
+        raise ValueError(f"Columns missing from the data: {', '.join(missing)}")
+
+
+def transform(pipeline, df):
+    check_columns(pipeline, df.columns)
+    for step, params in zip(pipeline["plan"], pipeline["params"]):
+        df = STEPS[step["step"]][1](df, step, params)
+    return df
+
+
+def _path(pipeline_id, suffix=".joblib"):
+    if not _PIPELINE_ID.fullmatch(pipeline_id or ""):
+        raise PipelineNotFound(f"Invalid pipeline id: {pipeline_id}")
+    return os.path.join(PIPELINES_DIR, f"{pipeline_id}{suffix}")
+
+
+def save(pipeline):
+    os.makedirs(PIPELINES_DIR, exist_ok=True)
+    path = _path(pipeline["pipeline_id"])
+    import joblib
+    joblib.dump(pipeline, f"{path}.tmp{os.getpid()}")
+    os.replace(f"{path}.tmp{os.getpid()}", path)
+
+
+def load(pipeline_id):
+    import joblib
+    try:
+        return joblib.load(_path(pipeline_id))
+    except FileNotFoundError:
+        raise PipelineNotFound(f"Pipeline not found: {pipeline_id}")
+
+
+@contextmanager
+def locked(pipeline_id):
+    # Updates are read-modify-write; concurrent ones for the same pipeline
+    # (from any worker) are serialised so no batch is lost.
+    os.makedirs(PIPELINES_DIR, exist_ok=True)
+    with open(_path(pipeline_id, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _plain(value):
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return type(value).__name__
+
+
+def describe(pipeline):
+    # JSON view of a pipeline; fitted models are shown by their type.
+    return {
+        "pipeline_id": pipeline["pipeline_id"],
+        "steps": [{**step, "params": _plain(params)} for step, params in zip(pipeline["plan"], pipeline["params"])],
+        "columns": pipeline["columns"],
+        "batches": pipeline["batches"],
+        "created": pipeline["created"],
+        "updated": pipeline["updated"],
+    }
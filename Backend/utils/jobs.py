@@ -0,0 +1,234 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from utils import dataset_cache
+
+# Long-running requests run as background jobs in a local process pool.
+# State lives in SQLite so every gunicorn worker (and every job process) sees
+# the same jobs; inputs and results are files under JOBS_DIR.
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(dataset_cache.CACHE_DIR, "jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", 24 * 3600))
+# An event stream ends after this long (the client reconnects), so it never
+# holds a sync gunicorn worker past its timeout (30s by default).
+EVENTS_MAX_SECONDS = float(os.getenv("JOB_EVENTS_MAX_SECONDS", 25))
+KEEPALIVE_SECONDS = 10
+
+FINISHED = ("done", "failed")
+
+_handlers = {}
+_executor = None
+# A pool inherited through fork belongs to the parent (its manager thread
+# did not survive the fork); the child starts its own.
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def register(kind):
+    """Decorator registering ``handler(job_dir, params, progress)`` for a job
+    kind. The handler returns ``(result_file, download_name, mimetype)``."""
+    def decorator(handler):
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+
+@contextmanager
+def _db():
+    conn = _connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _connect():
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(JOBS_DIR, "jobs.sqlite3"), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            stage TEXT,
+            progress REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            result_file TEXT,
+            download_name TEXT,
+            mimetype TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+    """)
+    # pid of the process responsible for the job: the web worker that
+    # queued it, then the job process running it.
+    if "pid" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+        conn.execute("ALTER TABLE jobs ADD COLUMN pid INTEGER")
+    return conn
+
+
+def _update(job_id, **fields):
+    fields["updated"] = time.time()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with _db() as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def job_dir(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def get(job_id):
+    with _db() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    if _orphaned(job):
+        _fail_orphan(job_id)
+        return get(job_id)
+    return job
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _orphaned(job):
+    # Queued or running, but the process responsible for it is gone (a
+    # restarted web worker, a job process killed for memory).
+    return job["status"] not in FINISHED and job["pid"] is not None and not _alive(job["pid"])
+
+
+def _fail_orphan(job_id, error="The process running this job stopped unexpectedly"):
+    with _db() as conn:
+        conn.execute("UPDATE jobs SET status = 'failed', stage = 'failed', error = ?, updated = ? "
+                     "WHERE id = ? AND status NOT IN ('done', 'failed')", (error, time.time(), job_id))
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS)
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _reset_executor(broken):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def create(kind):
+    """Creates a queued job and its directory; the caller saves the inputs
+    there before calling ``start``."""
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    cleanup()
+    job_id = uuid.uuid4().hex
+    os.makedirs(job_dir(job_id))
+    now = time.time()
+    with _db() as conn:
+        conn.execute("INSERT INTO jobs (id, kind, status, stage, created, updated, pid) "
+                     "VALUES (?, ?, 'queued', 'queued', ?, ?, ?)", (job_id, kind, now, now, os.getpid()))
+    return job_id
+
+
+def start(job_id, params):
+    job = get(job_id)
+    try:
+        executor = _get_executor()
+        future = executor.submit(_run, job_id, job["kind"], params)
+    except BrokenProcessPool:
+        # Broken by an earlier job (e.g. a job process killed for memory).
+        _reset_executor(executor)
+        executor = _get_executor()
+        future = executor.submit(_run, job_id, job["kind"], params)
+    future.add_done_callback(lambda future: _finished(job_id, executor, future))
+
+
+def _finished(job_id, executor, future):
+    # _run records its own outcome; this catches jobs whose process died.
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _reset_executor(executor)
+        _fail_orphan(job_id, "The process running this job was killed (out of memory?)")
+
+
+def _run(job_id, kind, params):
+    # Runs in a pool process.
+    def progress(stage, fraction=None):
+        fields = {"stage": stage}
+        if fraction is not None:
+            fields["progress"] = round(fraction, 4)
+        _update(job_id, **fields)
+
+    _update(job_id, status="running", stage="starting", pid=os.getpid())
+    try:
+        result_file, download_name, mimetype = _handlers[kind](job_dir(job_id), params, progress)
+        _update(job_id, status="done", stage="done", progress=1.0, result_file=result_file,
+                download_name=download_name, mimetype=mimetype)
+    except Exception as e:
+        traceback.print_exc()
+        _update(job_id, status="failed", stage="failed", error=str(e))
+
+
+def cleanup(max_age=JOB_TTL_SECONDS):
+    cutoff = time.time() - max_age
+    with _db() as conn:
+        unfinished = [dict(row) for row in conn.execute("SELECT id, status, pid FROM jobs WHERE status NOT IN ('done', 'failed')")]
+    for job in unfinished:
+        if _orphaned(job):
+            _fail_orphan(job["id"])
+    with _db() as conn:
+        expired = [row["id"] for row in conn.execute("SELECT id FROM jobs WHERE updated < ?", (cutoff,))]
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+    for job_id in expired:
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+
+def events(job_id, interval=0.5, max_seconds=EVENTS_MAX_SECONDS):
+    """Yields the job's state as JSON each time it changes, until it ends or
+    ``max_seconds`` have passed, and None every KEEPALIVE_SECONDS without a
+    change."""
+    last = None
+    start = sent = time.monotonic()
+    while True:
+        job = get(job_id)
+        if job is None:
+            return
+        state = json.dumps(public(job))
+        now = time.monotonic()
+        if state != last:
+            yield state
+            last, sent = state, now
+        elif now - sent >= KEEPALIVE_SECONDS:
+            yield None
+            sent = now
+        if job["status"] in FINISHED or now - start >= max_seconds:
+            return
+        time.sleep(interval)
+
+
+def public(job):
+    return {key: job[key] for key in ("id", "kind", "status", "stage", "progress", "error", "created", "updated")}
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextvars import copy_context
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from utils import dataset_cache, metrics
+
+# Every LLM call goes through complete(): one client per process (so HTTP
+# connections are reused), a response cache keyed on the prompt with its
+# whitespace normalized (the prompt itself is sent as written), and
+# coalescing of identical prompts that are already in flight.
+#
+# LLM_BACKEND=stub answers locally without an API key, for tests and offline
+# development; LLM_STUB_DELAY adds latency to it.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+LLM_STUB_DELAY = float(os.getenv("LLM_STUB_DELAY", 0))
+LLM_THREADS = int(os.getenv("LLM_THREADS", 4))
+
+# Cached responses expire after LLM_CACHE_TTL seconds; at most
+# LLM_CACHE_MAX_ENTRIES are kept in memory and on disk. An empty
+# LLM_CACHE_DIR keeps the cache in memory only.
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1024))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(dataset_cache.CACHE_DIR, "llm"))
+
+CODE_MODEL = "llama-3.3-70b-versatile"
+SUGGESTIONS_MODEL = "llama3-70b-8192"
+
+_client = None
+_client_pid = None
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+_memory = OrderedDict()
+_in_flight = {}
+
+
+def _get_client():
+    # The client holds the HTTP connection pool; it is not shared across
+    # forked processes.
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        from groq import Groq
+        _client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+        _client_pid = os.getpid()
+    return _client
+
+
+def _groq_complete(messages, model, options):
+    response = _get_client().chat.completions.create(model=model, messages=messages, **options)
+    return response.choices[0].message.content
+
+
+def _stub_complete(messages, model, options):
+    # Deterministic answers shaped like the real ones: code generation gets
+    # a preprocess function that returns the frame unchanged.
+    if LLM_STUB_DELAY:
+        time.sleep(LLM_STUB_DELAY)
+    prompt = messages[-1]["content"]
+    if "def preprocess" in prompt:
+        return "```python\ndef preprocess(df):\n    processed_df = df.copy()\n    return processed_df\n```"
+    return f"[stub {model}] " + " ".join(prompt.split())[:200]
+
+
+BACKENDS = {
+    "groq": _groq_complete,
+    "stub": _stub_complete,
+}
+
+
+def as_messages(messages):
+    if isinstance(messages, str):
+        return [{"role": "user", "content": messages}]
+    return messages
+
+
+def cache_key(messages, model, options):
+    # Prompts are built from indented triple-quoted strings; whitespace
+    # differences must not produce different keys. Only the key is
+    # normalized: newlines matter in the prompt (code blocks, comments).
+    normalized = [{"role": m["role"], "content": re.sub(r"\s+", " ", m["content"]).strip()} for m in messages]
+    payload = json.dumps({"backend": LLM_BACKEND, "model": model, "options": options, "messages": normalized},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(LLM_CACHE_DIR, f"{key}.json")
+
+
+def _cache_get(key):
+    now = time.time()
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            if now - entry["created"] < LLM_CACHE_TTL:
+                _memory.move_to_end(key)
+                return entry["response"]
+            del _memory[key]
+
+    if not LLM_CACHE_DIR:
+        return None
+    try:
+        with open(_cache_path(key)) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if now - entry["created"] >= LLM_CACHE_TTL:
+        return None
+    _remember(key, entry)
+    return entry["response"]
+
+
+def _remember(key, entry):
+    with _lock:
+        _memory[key] = entry
+        _memory.move_to_end(key)
+        while len(_memory) > LLM_CACHE_MAX_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def _cache_put(key, response):
+    entry = {"created": time.time(), "response": response}
+    _remember(key, entry)
+    if not LLM_CACHE_DIR:
+        return
+    os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+    path = _cache_path(key)
+    with open(f"{path}.tmp{os.getpid()}", "w") as f:
+        json.dump(entry, f)
+    os.replace(f"{path}.tmp{os.getpid()}", path)
+    _evict_disk()
+
+
+def _evict_disk():
+    entries = []
+    for name in os.listdir(LLM_CACHE_DIR):
+        if name.endswith(".json"):
+            path = os.path.join(LLM_CACHE_DIR, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+    expired = time.time() - LLM_CACHE_TTL
+    entries.sort()
+    excess = len(entries) - LLM_CACHE_MAX_ENTRIES
+    for i, (mtime, path) in enumerate(entries):
+        if i < excess or mtime < expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def clear_cache():
+    with _lock:
+        _memory.clear()
+    if LLM_CACHE_DIR and os.path.isdir(LLM_CACHE_DIR):
+        for name in os.listdir(LLM_CACHE_DIR):
+            if name.endswith(".json"):
+                os.remove(os.path.join(LLM_CACHE_DIR, name))
+
+
+def complete(messages, model=CODE_MODEL, cache=True, **options):
+    """Returns the model's reply to ``messages`` (a prompt string or a list
+    of chat messages). ``options`` are passed to the chat completion call,
+    e.g. temperature, max_tokens, seed."""
+    messages = as_messages(messages)
+    backend = BACKENDS[LLM_BACKEND]
+    if not cache:
+        with metrics.stage("llm"):
+            return backend(messages, model, options)
+
+    key = cache_key(messages, model, options)
+    response = _cache_get(key)
+    if response is not None:
+        return response
+
+    # Identical prompts already being answered wait for that answer instead
+    # of making another call.
+    with _lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        with metrics.stage("llm"):
+            response = backend(messages, model, options)
+        _cache_put(key, response)
+        future.set_result(response)
+        return response
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            del _in_flight[key]
+
+
+def submit(fn, *args, **kwargs):
+    """Runs ``fn`` (typically something calling ``complete``) on the shared
+    LLM thread pool, so the call overlaps with other work in the request."""
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=LLM_THREADS, thread_name_prefix="llm")
+            _executor_pid = os.getpid()
+    # Run in a copy of the caller's context so the call's stages are counted
+    # towards the request that made it.
+    return _executor.submit(copy_context().run, fn, *args, **kwargs)
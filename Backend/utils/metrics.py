@@ -0,0 +1,383 @@
+import cProfile
+import fcntl
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import Response, g, request
+
+# Per-stage timings for the hot paths (CSV parsing, each preprocessing step,
+# chart rendering, feature importance, LLM calls, output serialization),
+# served in the Prometheus text format at /metrics.
+#
+# Every process (web workers, job and pool processes) keeps its own
+# counters and writes a snapshot to METRICS_DIR at most once a second;
+# /metrics adds up all snapshots. Snapshots of processes that have exited
+# are folded into one file at the next scrape, so the directory holds one
+# file per live process and totals never go down. Short-lived processes
+# (see skip_snapshots) write none. METRICS_DIR="" serves only the
+# answering process.
+#
+# METRICS_MEMORY=1 also records each stage's peak Python/numpy allocation
+# with tracemalloc. It slows allocation-heavy code down noticeably, and the
+# peaks are process-wide, so concurrent requests inflate each other's.
+# SERVER_TIMING=1 adds a Server-Timing header listing the request's stages,
+# and PROFILE_SAMPLE_RATE (0-1) writes a cProfile dump plus a JSON stage
+# trace for that share of requests to PROFILE_DIR.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_MEMORY = os.getenv("METRICS_MEMORY", "0") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "dataoptimizer_metrics"))
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "dataoptimizer_profiles"))
+
+PREFIX = "dataoptimizer"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+FLUSH_SECONDS = 1.0
+RETIRED_SNAPSHOT = "retired.json"
+
+_lock = threading.Lock()
+_stats = {}
+_last_flush = 0.0
+_snapshots = True
+_memory = threading.local()
+# Stages of the request being handled, for Server-Timing and traces.
+_request_stages = ContextVar("request_stages", default=None)
+
+
+def _reset_after_fork():
+    # A forked child starts counting from zero; its parent reports its own.
+    global _lock, _stats, _last_flush
+    _lock = threading.Lock()
+    _stats = {}
+    _last_flush = 0.0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Stage:
+    __slots__ = ("name", "seconds", "rows", "columns", "peak_bytes")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = self.columns = self.peak_bytes = None
+
+    def size(self, rows, columns):
+        self.rows, self.columns = rows, columns
+
+    def frame(self, df):
+        # Records the size of the frame the stage produced (or consumed) and
+        # returns it, so it can wrap an expression.
+        self.size(len(df), df.shape[1] if df.ndim > 1 else 1)
+        return df
+
+
+class _NullStage:
+    def size(self, rows, columns):
+        pass
+
+    def frame(self, df):
+        return df
+
+
+_NULL_STAGE = _NullStage()
+
+
+@contextmanager
+def stage(name):
+    """Times the enclosed block as stage ``name``::
+
+        with metrics.stage("parse_csv") as s:
+            df = s.frame(read_csv(...))
+    """
+    if not METRICS_ENABLED:
+        yield _NULL_STAGE
+        return
+    record = Stage(name)
+    start_bytes = _memory_start() if METRICS_MEMORY else None
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start
+        if start_bytes is not None:
+            record.peak_bytes = _memory_stop(start_bytes)
+        _record("stage", record)
+
+
+def _memory_start():
+    # tracemalloc has a single peak counter, so nested stages keep the peak
+    # seen before an inner stage reset it (per thread) and report the larger.
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    stack = _memory.__dict__.setdefault("peaks", [])
+    current, peak = tracemalloc.get_traced_memory()
+    if stack:
+        stack[-1] = max(stack[-1], peak)
+    stack.append(0)
+    tracemalloc.reset_peak()
+    return current
+
+
+def _memory_stop(start_bytes):
+    stack = _memory.peaks
+    peak = max(tracemalloc.get_traced_memory()[1], stack.pop())
+    if stack:
+        stack[-1] = max(stack[-1], peak)
+    return max(peak - start_bytes, 0)
+
+
+def _empty():
+    return {"count": 0, "seconds": 0.0, "buckets": [0] * (len(BUCKETS) + 1), "rows": 0, "columns": 0,
+            "peak_bytes": None}
+
+
+def _record(family, record):
+    with _lock:
+        entry = _stats.setdefault(family, {}).get(record.name)
+        if entry is None:
+            entry = _stats[family][record.name] = _empty()
+        entry["count"] += 1
+        entry["seconds"] += record.seconds
+        entry["buckets"][bisect_left(BUCKETS, record.seconds)] += 1
+        if record.rows is not None:
+            entry["rows"] += record.rows
+            entry["columns"] += record.columns
+        if record.peak_bytes is not None:
+            entry["peak_bytes"] = max(entry["peak_bytes"] or 0, record.peak_bytes)
+
+    stages = _request_stages.get()
+    if stages is not None and family == "stage":
+        stages.append(record)
+    _maybe_flush()
+
+
+def _snapshot_path():
+    return os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+
+
+def skip_snapshots():
+    # For processes that live for one task (e.g. the forked fitting workers
+    # of utils/parallel.py): their stages are timed by the parent anyway,
+    # and a file per short-lived pid is not worth writing.
+    global _snapshots
+    _snapshots = False
+
+
+def flush():
+    if not METRICS_DIR or not _snapshots:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path()
+    with _lock:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(_stats, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def _maybe_flush():
+    global _last_flush
+    now = time.monotonic()
+    if not METRICS_DIR or now - _last_flush < FLUSH_SECONDS:
+        return
+    _last_flush = now
+    try:
+        flush()
+    except OSError as e:
+        print(f"Could not write metrics snapshot: {e}")
+
+
+def _merge(into, stats):
+    for family, entries in stats.items():
+        for name, entry in entries.items():
+            total = into.setdefault(family, {}).setdefault(name, _empty())
+            for key in ("count", "seconds", "rows", "columns"):
+                total[key] += entry[key]
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], entry["buckets"])]
+            if entry["peak_bytes"] is not None:
+                total["peak_bytes"] = max(total["peak_bytes"] or 0, entry["peak_bytes"])
+
+
+def _snapshot_pid(filename):
+    pid = filename.split(".", 1)[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Being replaced, or left half-written by a killed process.
+        return {}
+
+
+def _retire_dead():
+    # Adds the snapshots of exited processes to RETIRED_SNAPSHOT and removes
+    # them. The lock keeps concurrent scrapes from counting one twice.
+    with open(os.path.join(METRICS_DIR, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = [name for name in os.listdir(METRICS_DIR)
+                if _snapshot_pid(name) is not None and not _alive(_snapshot_pid(name))]
+        if not dead:
+            return
+        retired_path = os.path.join(METRICS_DIR, RETIRED_SNAPSHOT)
+        retired = _load_snapshot(retired_path)
+        for name in dead:
+            if name.endswith(".json"):
+                _merge(retired, _load_snapshot(os.path.join(METRICS_DIR, name)))
+        with open(f"{retired_path}.tmp", "w") as f:
+            json.dump(retired, f)
+        os.replace(f"{retired_path}.tmp", retired_path)
+        for name in dead:
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except FileNotFoundError:
+                pass
+
+
+def collect():
+    """Stats of all processes, ``{family: {name: entry}}``."""
+    merged = {}
+    if not METRICS_DIR or not _snapshots:
+        with _lock:
+            _merge(merged, _stats)
+        return merged
+
+    flush()
+    _retire_dead()
+    for filename in os.listdir(METRICS_DIR):
+        if filename.endswith(".json"):
+            _merge(merged, _load_snapshot(os.path.join(METRICS_DIR, filename)))
+    return merged
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+FAMILIES = (("request", "endpoint", "HTTP requests"), ("stage", "stage", "Processing stages"))
+
+
+def export():
+    """Prometheus text exposition of ``collect()``."""
+    stats = collect()
+    lines = []
+    for family, label, description in FAMILIES:
+        entries = sorted(stats.get(family, {}).items())
+        name = f"{PREFIX}_{family}"
+        lines += [f"# HELP {name}_seconds {description}, wall time.", f"# TYPE {name}_seconds histogram"]
+        for key, entry in entries:
+            labels = f'{label}="{_label(key)}"'
+            cumulative = 0
+            for le, n in zip(BUCKETS + ("+Inf",), entry["buckets"]):
+                cumulative += n
+                lines.append(f'{name}_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{name}_seconds_sum{{{labels}}} {entry['seconds']}")
+            lines.append(f"{name}_seconds_count{{{labels}}} {entry['count']}")
+        if family != "stage":
+            continue
+        lines += [f"# HELP {name}_rows_total Rows processed by each stage.", f"# TYPE {name}_rows_total counter"]
+        lines += [f'{name}_rows_total{{{label}="{_label(key)}"}} {entry["rows"]}' for key, entry in entries]
+        lines += [f"# HELP {name}_columns_total Columns processed by each stage.",
+                  f"# TYPE {name}_columns_total counter"]
+        lines += [f'{name}_columns_total{{{label}="{_label(key)}"}} {entry["columns"]}' for key, entry in entries]
+        lines += [f"# HELP {name}_peak_memory_bytes Largest allocation peak of each stage (METRICS_MEMORY=1).",
+                  f"# TYPE {name}_peak_memory_bytes gauge"]
+        lines += [f'{name}_peak_memory_bytes{{{label}="{_label(key)}"}} {entry["peak_bytes"]}'
+                  for key, entry in entries if entry["peak_bytes"] is not None]
+    return "\n".join(lines) + "\n"
+
+
+_TOKEN = re.compile(r"[^\w.!#$%&'*+^`|~-]")
+
+
+def server_timing(stages, total):
+    parts = [f"{_TOKEN.sub('_', record.name)};dur={record.seconds * 1000:.1f}" for record in stages]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# Flask integration.
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_stages = []
+    _request_stages.set(g.metrics_stages)
+    g.metrics_profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and request.endpoint != "metrics" and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.metrics_profiler = profiler
+        except ValueError:
+            # Another request in this process is being profiled.
+            pass
+
+
+def _after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    stages = g.pop("metrics_stages")
+    _request_stages.set(None)
+    endpoint = request.endpoint or "unmatched"
+
+    profiler = g.pop("metrics_profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _dump_profile(profiler, endpoint, stages, total, response.status_code)
+
+    if endpoint == "metrics":
+        return response
+    if METRICS_ENABLED:
+        record = Stage(endpoint)
+        record.seconds = total
+        _record("request", record)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(stages, total)
+    return response
+
+
+def _dump_profile(profiler, endpoint, stages, total, status):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint}-{os.getpid()}")
+        profiler.dump_stats(f"{base}.prof")
+        with open(f"{base}.json", "w") as f:
+            json.dump({"endpoint": endpoint, "path": request.path, "status": status, "seconds": total,
+                       "stages": [{"name": r.name, "seconds": r.seconds, "rows": r.rows, "columns": r.columns,
+                                   "peak_bytes": r.peak_bytes} for r in stages]}, f, indent=2)
+        print(f"Wrote profile {base}.prof")
+    except OSError as e:
+        print(f"Could not write profile: {e}")
+
+
+def metrics_endpoint():
+    return Response(export(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule("/metrics", "metrics", metrics_endpoint)
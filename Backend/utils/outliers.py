@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pandas as pd
+from utils.ingest import NUMERIC_DTYPES
+
+# Outlier detection that stays bounded on very large frames.
+#
+# iqr, zscore and mad reduce to per-column [lower, upper] bounds, applied as
+# one vectorized comparison. isolation_forest is fitted on a sample of at
+# most OUTLIER_SAMPLE_ROWS rows (trees only look at 256 rows each anyway)
+# and scores the full frame in batches of OUTLIER_BATCH_ROWS.
+OUTLIER_SAMPLE_ROWS = int(os.getenv("OUTLIER_SAMPLE_ROWS", 100_000))
+OUTLIER_BATCH_ROWS = int(os.getenv("OUTLIER_BATCH_ROWS", 100_000))
+OUTLIER_JOBS = int(os.getenv("OUTLIER_JOBS", -1))
+
+METHODS = ("iqr", "zscore", "mad", "isolation_forest")
+BOUND_METHODS = ("iqr", "zscore", "mad")
+
+# Default multipliers: 1.5 IQR (Tukey), 3 standard deviations, and a robust
+# z-score of 3.5 (Iglewicz and Hoaglin).
+DEFAULT_THRESHOLDS = {"iqr": 1.5, "zscore": 3.0, "mad": 3.5}
+MAD_SCALE = 0.6745
+
+
+def threshold_for(step):
+    return step.get("threshold", DEFAULT_THRESHOLDS[step["method"]])
+
+
+def bounds(columns, center, spread, k):
+    """Per-column bounds ``center -/+ k * spread`` as plan params. A zero
+    spread would flag every value but the center, so such columns are left
+    unbounded."""
+    spread = spread.where(spread > 0, np.inf)
+    return {
+        "columns": list(columns),
+        "lower": (center - k * spread).to_dict(),
+        "upper": (center + k * spread).to_dict(),
+    }
+
+
+def iqr_bounds(columns, q1, q3, k):
+    iqr = q3 - q1
+    return {"columns": list(columns), "lower": (q1 - k * iqr).to_dict(), "upper": (q3 + k * iqr).to_dict()}
+
+
+def fit_bounds(df, step):
+    columns = df.select_dtypes(include=NUMERIC_DTYPES).columns
+    subset = df[columns]
+    k = threshold_for(step)
+    if step["method"] == "iqr":
+        quartiles = subset.quantile([0.25, 0.75])
+        return iqr_bounds(columns, quartiles.loc[0.25], quartiles.loc[0.75], k)
+    if step["method"] == "zscore":
+        return bounds(columns, subset.mean(), subset.std(ddof=0), k)
+    median = subset.median()
+    mad = (subset - median).abs().median()
+    return bounds(columns, median, mad / MAD_SCALE, k)
+
+
+def within_bounds(df, params):
+    """Mask of rows inside the bounds in every column."""
+    columns = params["columns"]
+    if not columns:
+        return np.ones(len(df), dtype=bool)
+    subset = df[columns]
+    lower = pd.Series(params["lower"])[columns]
+    upper = pd.Series(params["upper"])[columns]
+    return ((subset >= lower) & (subset <= upper)).all(axis=1).to_numpy()
+
+
+def fit_isolation_forest(df, contamination, max_rows=OUTLIER_SAMPLE_ROWS, seed=42):
+    from sklearn.ensemble import IsolationForest
+
+    sample = df.sample(max_rows, random_state=seed) if len(df) > max_rows else df
+    clf = IsolationForest(contamination=contamination, n_jobs=OUTLIER_JOBS, random_state=seed)
+    clf.fit(sample)
+    return clf
+
+
+def isolation_forest_inliers(clf, df, batch_rows=OUTLIER_BATCH_ROWS):
+    """Mask of rows the forest scores as inliers, scored in batches so the
+    per-tree scratch memory stays bounded."""
+    if len(df) == 0:
+        return np.ones(0, dtype=bool)
+    return np.concatenate([clf.predict(df.iloc[start:start + batch_rows]) == 1
+                           for start in range(0, len(df), batch_rows)])
@@ -0,0 +1,71 @@
+import io
+import os
+import zlib
+import pandas as pd
+from utils import metrics
+
+# Results larger than this are not written as Excel unless explicitly asked
+# for; xlsxwriter is slow, memory-hungry and Excel caps out at ~1M rows.
+EXCEL_MAX_ROWS = int(os.getenv("EXCEL_MAX_ROWS", 100_000))
+CSV_CHUNK_ROWS = 50_000
+
+OUTPUT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "processed_data.xlsx"),
+    "csv": ("text/csv", "processed_data.csv"),
+    "csv.gz": ("application/gzip", "processed_data.csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", "processed_data.parquet"),
+    "feather": ("application/vnd.apache.arrow.file", "processed_data.feather"),
+}
+STREAMING_FORMATS = ("csv", "csv.gz")
+
+
+def choose_format(requested, n_rows=None):
+    if requested:
+        if requested not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format: choose one of {', '.join(OUTPUT_FORMATS)}.")
+        return requested
+    if n_rows is not None and n_rows <= EXCEL_MAX_ROWS:
+        return "xlsx"
+    return "csv"
+
+
+def csv_chunks(df, chunk_rows=CSV_CHUNK_ROWS, header=True):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=header and start == 0)
+
+
+def gzip_stream(chunks):
+    # wbits=31 writes a gzip header/trailer around the deflate stream.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode_stream(chunks, fmt):
+    # Wraps a generator of CSV text chunks for one of the streaming formats.
+    if fmt == "csv.gz":
+        return gzip_stream(chunks)
+    return chunks
+
+
+def serialize_frame(df, fmt):
+    """Returns the body for ``df`` in ``fmt``: a generator for streaming
+    formats, otherwise a file object positioned at the start."""
+    if fmt in STREAMING_FORMATS:
+        return encode_stream(csv_chunks(df), fmt)
+
+    output_file = io.BytesIO()
+    with metrics.stage(f"serialize.{fmt}") as stage:
+        stage.frame(df)
+        if fmt == "xlsx":
+            with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+                df.to_excel(writer, sheet_name='processed_data', index=False)
+        elif fmt == "parquet":
+            df.to_parquet(output_file, index=False)
+        elif fmt == "feather":
+            df.reset_index(drop=True).to_feather(output_file)
+    output_file.seek(0)
+    return output_file
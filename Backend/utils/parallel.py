@@ -0,0 +1,284 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from utils import dedup, metrics, outliers
+from utils.data_cleaning import STEPS, numeric_columns, _fit_impute, _apply_impute, _apply_normalize, \
+    _fit_remove_outliers
+from utils.streaming import merge_moments
+
+# Column-parallel execution of a compiled plan, selected per request with
+# config["execution"] = {"backend": "thread" | "process", "workers": n}.
+#
+# Statistics are fitted on blocks of columns (and, for min/max and moments,
+# blocks of rows too, merged afterwards). With the process backend one pool
+# is forked per plan; each fitting step writes the columns it fits to an
+# uncompressed Arrow file in EXECUTION_HANDOFF_DIR, which the workers map
+# (as sandbox workers map their input), reading only their block, and only
+# the statistics are sent back. Transforms always run on threads: numpy
+# releases the GIL for column arithmetic, and each block's result is
+# concatenated into the output without another copy.
+EXECUTION_BACKEND = os.getenv("EXECUTION_BACKEND", "serial")
+EXECUTION_WORKERS = int(os.getenv("EXECUTION_WORKERS", os.cpu_count() or 1))
+BACKENDS = ("serial", "thread", "process")
+
+# Below this many rows the pool overhead outweighs the work.
+MIN_PARALLEL_ROWS = int(os.getenv("EXECUTION_MIN_ROWS", 50_000))
+EXECUTION_HANDOFF_DIR = os.getenv("EXECUTION_HANDOFF_DIR", tempfile.gettempdir())
+
+_threads = None
+_threads_pid = None
+_lock = threading.Lock()
+
+
+def execution_options(config):
+    execution = config.get("execution") or {}
+    backend = execution.get("backend", EXECUTION_BACKEND)
+    if backend not in BACKENDS:
+        raise ValueError(f"Invalid execution backend: choose one of {', '.join(BACKENDS)}.")
+    workers = int(execution.get("workers", EXECUTION_WORKERS))
+    if workers < 1:
+        raise ValueError("Execution workers must be at least 1.")
+    # Requests can ask for fewer workers than the server allows, not more.
+    return {"backend": backend, "workers": min(workers, max(EXECUTION_WORKERS, 1))}
+
+
+def _thread_pool():
+    # One pool of EXECUTION_WORKERS threads shared by every request; a forked
+    # job process starts its own, since the parent's threads do not exist
+    # there.
+    global _threads, _threads_pid
+    with _lock:
+        if _threads is None or _threads_pid != os.getpid():
+            _threads = ThreadPoolExecutor(max_workers=max(EXECUTION_WORKERS, 1), thread_name_prefix="plan")
+            _threads_pid = os.getpid()
+        return _threads
+
+
+def _map(fn, df, tasks, execution):
+    # fn(df, task) for every task, on threads.
+    return list(_thread_pool().map(lambda task: fn(df, task), tasks))
+
+
+def _subset(df, task):
+    columns, rows = task
+    subset = df[columns]
+    return subset if rows is None else subset.iloc[rows[0]:rows[1]]
+
+
+def _read_mapped(path, task):
+    # A task's block of the handed-off columns; only its pages are read.
+    columns, rows = task
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    if rows is not None:
+        table = table.slice(rows[0], rows[1] - rows[0])
+    return table.to_pandas()
+
+
+def _call_mapped(fn, path, task):
+    return fn(_read_mapped(path, task))
+
+
+def _fit_map(fn, df, tasks, execution):
+    # fn(subset) for every (columns, rows) task, rows being None or a
+    # (start, stop) range. The results are statistics, small enough to come
+    # back from the process backend's workers.
+    pool = execution.get("pool")
+    if pool is not None:
+        columns = list(dict.fromkeys(col for task_columns, _ in tasks for col in task_columns))
+        fd, path = tempfile.mkstemp(dir=EXECUTION_HANDOFF_DIR, suffix=".arrow")
+        os.close(fd)
+        try:
+            try:
+                feather.write_feather(pa.Table.from_pandas(df[columns], preserve_index=False), path,
+                                      compression="uncompressed")
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                # Columns Arrow cannot represent (e.g. mixed-type objects)
+                # are fitted on threads.
+                pool = None
+            if pool is not None:
+                return list(pool.map(partial(_call_mapped, fn, path), tasks))
+        finally:
+            os.remove(path)
+    return list(_thread_pool().map(lambda task: fn(_subset(df, task)), tasks))
+
+
+def _process_pool(execution):
+    # One pool of forked workers for the fitting steps of a whole plan.
+    return ProcessPoolExecutor(max_workers=execution["workers"], mp_context=multiprocessing.get_context("fork"),
+                               initializer=metrics.skip_snapshots)
+
+
+def _blocks(items, n):
+    # Contiguous blocks, so concatenating results keeps the original order.
+    return [list(block) for block in np.array_split(np.asarray(items, dtype=object), min(n, len(items)))
+            if len(block)]
+
+
+def _row_ranges(n_rows, n):
+    edges = np.linspace(0, n_rows, n + 1).astype(int)
+    return [(start, stop) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+
+def _concat_columns(parts):
+    return pd.concat(parts, axis=1, copy=False)
+
+
+def _merge_params(results):
+    merged = {}
+    for params in results:
+        for key, value in params.items():
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            elif isinstance(value, dict):
+                merged.setdefault(key, {}).update(value)
+            else:
+                merged[key] = value
+    return merged
+
+
+# Fits. Each task is a block of columns (or a block of columns x rows).
+
+def _fit_columns(df, step, fit, execution):
+    tasks = [(block, None) for block in _blocks(list(df.columns), execution["workers"])]
+    results = _fit_map(partial(fit, step=step), df, tasks, execution)
+    return _merge_params(results)
+
+
+def _normalize_stats(method, subset):
+    if method == "minmax":
+        return subset.min(), subset.max()
+    mean = subset.mean()
+    return subset.count(), mean.fillna(0), ((subset - mean) ** 2).sum()
+
+
+def _fit_normalize(df, step, execution):
+    columns = list(numeric_columns(df))
+    if not columns:
+        return {"columns": [], "offset": {}, "scale": {}}
+    # Few wide columns: split rows as well so every worker has work.
+    column_blocks = _blocks(columns, execution["workers"])
+    row_blocks = _row_ranges(len(df), max(1, execution["workers"] // len(column_blocks)))
+    tasks = [(block, rows) for block in column_blocks for rows in row_blocks]
+    results = _fit_map(partial(_normalize_stats, step["method"]), df, tasks, execution)
+
+    if step["method"] == "minmax":
+        offset = pd.concat([lo for lo, _ in results], axis=1).min(axis=1).reindex(columns).astype(np.float64)
+        scale = pd.concat([hi for _, hi in results], axis=1).max(axis=1).reindex(columns).astype(np.float64) - offset
+    else:
+        moments = None
+        for result in results:
+            moments = merge_moments(moments, result)
+        count, mean, m2 = (s.reindex(columns) for s in moments)
+        offset = mean.where(count > 0)
+        scale = np.sqrt(m2 / count)
+    scale = scale.where(scale != 0, 1.0)
+    return {"columns": columns, "offset": offset.to_dict(), "scale": scale.to_dict()}
+
+
+# Transforms, on threads.
+
+def _transform_columns(df, step, params, apply, execution):
+    blocks = _blocks(list(df.columns), execution["workers"])
+    parts = _map(lambda frame, columns: apply(frame[columns], step, _restrict(params, columns)), df, blocks,
+                 execution)
+    return _concat_columns(parts)
+
+
+def _restrict(params, columns):
+    # The params of a column-wise step, limited to one block of columns.
+    keep = set(columns)
+    restricted = {}
+    for key, value in params.items():
+        if isinstance(value, dict):
+            restricted[key] = {col: v for col, v in value.items() if col in keep}
+        elif isinstance(value, list):
+            restricted[key] = [col for col in value if col in keep]
+        else:
+            restricted[key] = value
+    return restricted
+
+
+def _filter_rows(df, masks):
+    return df.loc[np.logical_and.reduce(masks)]
+
+
+def _run_remove_na(df, step, execution):
+    masks = _map(lambda frame, columns: frame[columns].notna().all(axis=1).to_numpy(), df,
+                 _blocks(list(df.columns), execution["workers"]), execution)
+    return _filter_rows(df, masks)
+
+
+def _run_remove_duplicates(df, step, execution):
+    # Rows are hashed in blocks; a row is dropped if its hash was seen
+    # before, as drop_duplicates would.
+    hashes = _map(lambda frame, rows: dedup.row_hashes(frame.iloc[rows[0]:rows[1]]), df,
+                  _row_ranges(len(df), execution["workers"]), execution)
+    return df.loc[dedup.first_occurrences(np.concatenate(hashes))]
+
+
+def _run_impute(df, step, execution):
+    params = _fit_columns(df, step, _fit_impute, execution)
+    params.setdefault("values", {})
+    return _transform_columns(df, step, params, _apply_impute, execution)
+
+
+def _run_normalize(df, step, execution):
+    params = _fit_normalize(df, step, execution)
+    return _transform_columns(df, step, params, _apply_normalize, execution)
+
+
+def _outlier_mask(params, frame, columns):
+    return outliers.within_bounds(frame, _restrict(params, columns))
+
+
+def _run_remove_outliers(df, step, execution):
+    # The bound methods fit each column on its own; the forest looks at all
+    # columns together and runs serially (it parallelises its own trees).
+    if step["method"] not in outliers.BOUND_METHODS:
+        fit, apply = STEPS["remove_outliers"]
+        return apply(df, step, fit(df, step))
+    params = _fit_columns(df, step, _fit_remove_outliers, execution)
+    params.setdefault("columns", [])
+    masks = _map(partial(_outlier_mask, params), df, _blocks(list(df.columns), execution["workers"]),
+                 execution)
+    return _filter_rows(df, masks)
+
+
+PARALLEL_STEPS = {
+    "remove_na": _run_remove_na,
+    "impute": _run_impute,
+    "remove_duplicates": _run_remove_duplicates,
+    "normalize": _run_normalize,
+    "remove_outliers": _run_remove_outliers,
+}
+
+
+def run_plan_parallel(df, plan, execution, on_step=None):
+    pool = None
+    if execution["backend"] == "process" and execution["workers"] > 1 and len(df) >= MIN_PARALLEL_ROWS:
+        # Workers fork on the first fit that uses them.
+        pool = _process_pool(execution)
+        execution = {**execution, "pool": pool}
+    try:
+        for i, step in enumerate(plan):
+            if on_step:
+                on_step(i, step)
+            runner = PARALLEL_STEPS.get(step["step"])
+            with metrics.stage(f"preprocess.{step['step']}") as stage:
+                if runner is None or execution["workers"] < 2 or len(df) < MIN_PARALLEL_ROWS:
+                    fit, apply = STEPS[step["step"]]
+                    df = apply(df, step, fit(df, step))
+                else:
+                    df = runner(df, step, execution)
+                stage.frame(df)
+        return df
+    finally:
+        if pool is not None:
+            pool.shutdown()
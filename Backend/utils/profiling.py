@@ -0,0 +1,232 @@
+import math
+import os
+import numpy as np
+import pandas as pd
+from utils import dataset_cache
+from utils.data_cleaning import NUMERIC_DTYPES
+from utils.streaming import ColumnKinds, Reservoir, csv_chunk_reader, merge_moments
+
+# Approximate profiling for exploring files too large to summarise exactly.
+#
+# A cached dataset is profiled from a uniform sample of APPROX_SAMPLE_ROWS
+# rows taken from its memory-mapped file, so the cost does not depend on
+# the file size. A new upload is read once, chunk by chunk: row and null
+# counts, min/max, mean and standard deviation are exact; distinct counts
+# come from a HyperLogLog sketch per column; quantiles and correlations come
+# from a reservoir sample. Every estimate is reported with a 95% error bound.
+APPROX_SAMPLE_ROWS = int(os.getenv("APPROX_SAMPLE_ROWS", 100_000))
+HLL_PRECISION = int(os.getenv("APPROX_HLL_PRECISION", 12))
+Z95 = 1.96
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+class HyperLogLog:
+    """Distinct-count sketch over 64-bit hashes: 2**p one-byte registers,
+    relative standard error 1.04 / sqrt(2**p). Sketches merge by taking
+    the register-wise maximum."""
+
+    def __init__(self, p=HLL_PRECISION):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def update(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return
+        width = 64 - self.p
+        index = (hashes >> np.uint64(width)).astype(np.intp)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # Rank = position of the first 1 bit in the remaining bits.
+        rank = (width + 1 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(int)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small cardinalities: linear counting is more accurate.
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+
+def _bit_length(values):
+    length = np.zeros(len(values), dtype=np.int64)
+    values = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= np.uint64(1 << shift)
+        length[high] += shift
+        values[high] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+def value_hashes(series):
+    # Numbers are hashed as float64 so 1 and 1.0 (int and float chunks of the
+    # same column) count once; nulls are not values.
+    values = series.dropna()
+    if pd.api.types.is_numeric_dtype(values):
+        values = values.astype("float64") + 0.0
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+class Profiler:
+    """Single pass over a stream of chunks (see profile_chunks)."""
+
+    def __init__(self, sample_rows=APPROX_SAMPLE_ROWS):
+        self.rows = 0
+        self.columns = []
+        self.kinds = ColumnKinds()
+        self.nulls = {}
+        self.sketches = {}
+        self.moments = None
+        self.min = self.max = None
+        self.reservoir = Reservoir(sample_rows)
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        self.columns += [col for col in chunk.columns if col not in self.nulls]
+        self.kinds.update(chunk)
+        for col, count in chunk.isna().sum().items():
+            self.nulls[col] = self.nulls.get(col, 0) + int(count)
+            self.sketches.setdefault(col, HyperLogLog()).update(value_hashes(chunk[col]))
+
+        numeric = chunk.select_dtypes(include=NUMERIC_DTYPES)
+        mean = numeric.mean()
+        self.moments = merge_moments(self.moments, (numeric.count(), mean.fillna(0), ((numeric - mean) ** 2).sum()))
+        low, high = numeric.min(), numeric.max()
+        self.min = low if self.min is None else pd.concat([self.min, low], axis=1).min(axis=1)
+        self.max = high if self.max is None else pd.concat([self.max, high], axis=1).max(axis=1)
+        self.reservoir.update(chunk)
+
+    def result(self):
+        sample = self.reservoir.sample
+        if sample is None:
+            sample = pd.DataFrame(columns=self.columns)
+        numeric = self.kinds.select("numeric")
+        exact = {}
+        if self.moments is not None:
+            count, mean, m2 = (s.reindex(numeric, fill_value=0) for s in self.moments)
+            exact = {col: {"min": self.min.get(col), "max": self.max.get(col),
+                           "mean": mean[col] if count[col] else None,
+                           "std": math.sqrt(m2[col] / count[col]) if count[col] else None}
+                     for col in numeric}
+        return sample, build_profile(sample, self.rows, self.columns, numeric, nulls=self.nulls,
+                                     sketches=self.sketches, exact=exact)
+
+
+def _number(value):
+    if value is None or pd.isna(value):
+        return None
+    return float(value)
+
+
+def build_profile(sample, rows, columns, numeric, nulls=None, sketches=None, exact=None):
+    """Column statistics from ``sample`` (a uniform sample of ``rows`` rows)
+    plus whatever a full pass counted exactly: null counts, HyperLogLog
+    sketches and per-column numeric moments."""
+    n = len(sample)
+    complete = n == rows
+    # Dvoretzky-Kiefer-Wolfowitz: quantiles of the sample are within this
+    # rank distance of the true ones with 95% confidence.
+    rank_error = 0.0 if complete or not n else math.sqrt(math.log(2 / 0.05) / (2 * n))
+    profile = {"rows": rows, "sampled_rows": n, "approximate": not complete, "columns": {}}
+
+    for col in columns:
+        values = sample[col] if col in sample.columns else pd.Series(dtype=float)
+        kind = "numeric" if col in numeric else \
+            "categorical" if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype) else "other"
+        entry = {"dtype": str(values.dtype), "kind": kind}
+
+        if nulls is not None:
+            entry.update(null_count=nulls[col], null_rate=nulls[col] / rows if rows else 0.0, null_rate_error=0.0)
+        else:
+            rate = float(values.isna().mean()) if n else 0.0
+            entry.update(null_count=round(rate * rows), null_rate=rate,
+                         null_rate_error=0.0 if complete or not n else Z95 * math.sqrt(rate * (1 - rate) / n))
+
+        if sketches is not None:
+            estimate = sketches[col].estimate()
+            entry.update(distinct=round(estimate), distinct_error=round(Z95 * sketches[col].relative_error * estimate),
+                         distinct_is_lower_bound=False)
+        else:
+            # Distinct values cannot be scaled up from a sample without bias;
+            # the sample's count is reported as a lower bound.
+            entry.update(distinct=int(values.nunique()), distinct_error=0, distinct_is_lower_bound=not complete)
+
+        if col in numeric:
+            present = pd.to_numeric(values, errors="coerce").dropna()
+            if exact is not None:
+                entry.update({key: _number(value) for key, value in exact[col].items()})
+                entry["mean_error"] = 0.0
+            else:
+                std = present.std(ddof=0) if len(present) else None
+                entry.update(min=_number(present.min()), max=_number(present.max()), mean=_number(present.mean()),
+                             std=_number(std), min_max_of_sample=not complete,
+                             mean_error=0.0 if complete or not len(present) else Z95 * std / math.sqrt(len(present)))
+            entry["quantiles"] = {str(q): _number(present.quantile(q)) if len(present) else None for q in QUANTILES}
+            entry["quantile_rank_error"] = rank_error
+        profile["columns"][col] = entry
+
+    correlated = [col for col in numeric if col in sample.columns]
+    correlation = sample[correlated].apply(pd.to_numeric, errors="coerce").corr() if correlated else pd.DataFrame()
+    profile["correlation"] = {
+        "columns": correlated,
+        "matrix": [[_number(v) for v in row] for row in correlation.to_numpy()],
+        # Widest 95% interval half-width (at r = 0), from the Fisher transform.
+        "error": 0.0 if complete else (math.tanh(Z95 / math.sqrt(n - 3)) if n > 3 else 1.0),
+    }
+    return profile
+
+
+def profile_chunks(read_chunks, sample_rows=APPROX_SAMPLE_ROWS):
+    """``(sample, profile)`` from one pass over ``read_chunks()``."""
+    profiler = Profiler(sample_rows)
+    for chunk in read_chunks():
+        profiler.update(chunk)
+    return profiler.result()
+
+
+def profile_cached(dataset_id, sample_rows=APPROX_SAMPLE_ROWS, seed=42):
+    """``(sample, profile)`` from a random sample of a cached dataset's rows."""
+    sample, rows = dataset_cache.sample(dataset_id, sample_rows, seed)
+    numeric = list(sample.select_dtypes(include=NUMERIC_DTYPES).columns)
+    return sample, build_profile(sample, rows, list(sample.columns), numeric)
+
+
+def profile_input(stream=None, dataset_id=None, sample_rows=APPROX_SAMPLE_ROWS):
+    """``(dataset_id, sample, profile)`` for an upload ``stream`` or a cached
+    ``dataset_id``. Uploads already in the cache are sampled from there;
+    others are streamed once and not cached (``dataset_id`` is then None)."""
+    if stream is not None:
+        upload_id = dataset_cache.hash_upload(stream)
+        if not dataset_cache.is_cached(upload_id):
+            return (None, *profile_chunks(csv_chunk_reader(stream), sample_rows))
+        dataset_id = upload_id
+    return (dataset_id, *profile_cached(dataset_id, sample_rows))
+
+
+def summary(profile):
+    """The dataset summary the suggestions prompt is built from, in the same
+    layout as the exact one."""
+    columns = profile["columns"]
+    note = ""
+    if profile["approximate"]:
+        note = f" Statistics are estimated from a sample of {profile['sampled_rows']} rows."
+    return f"""
+        Dataset contains {profile['rows']} rows and {len(columns)} columns.{note}
+        Columns: {', '.join(map(str, columns))}
+        Missing values:
+        {pd.Series({col: entry['null_count'] for col, entry in columns.items()}, dtype=object).to_string()}
+        Data types:
+        {pd.Series({col: entry['dtype'] for col, entry in columns.items()}, dtype=object).to_string()}
+        Distinct values:
+        {pd.Series({col: entry['distinct'] for col, entry in columns.items()}, dtype=object).to_string()}
+        """
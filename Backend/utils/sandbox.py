@@ -0,0 +1,199 @@
+import os
+import resource
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from utils import code_plans, dataset_cache, metrics
+
+# Generated code runs in a pool of executor processes instead of the web
+# worker, each with CPU-time, address-space and wall-clock limits. Frames
+# travel as uncompressed Arrow files in shared memory (/dev/shm), which the
+# other side memory-maps, instead of being pickled through the pool's pipe.
+# Cached datasets are read straight from their Feather file.
+#
+# SANDBOX_WORKERS=0 runs generated code in the calling process, as before.
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", 2))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", 60))
+SANDBOX_WALL_SECONDS = float(os.getenv("SANDBOX_WALL_SECONDS", 120))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", 4096))
+SANDBOX_TMP_DIR = os.getenv("SANDBOX_TMP_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+
+# Extra time the caller waits past the wall-clock limit before it gives up
+# on a worker that did not stop by itself (e.g. stuck in native code).
+KILL_GRACE_SECONDS = 5
+
+_executor = None
+_executor_pid = None
+# Calls wait for a free worker before submitting, so the caller's timeout
+# only counts time spent running, not time queued behind other plans.
+_slots = threading.BoundedSemaphore(max(SANDBOX_WORKERS, 1))
+
+
+class SandboxError(code_plans.GeneratedCodeError):
+    pass
+
+
+def _limit_exceeded(signum, frame):
+    if signum == signal.SIGXCPU:
+        raise SandboxError(f"The generated code exceeded the CPU time limit ({SANDBOX_CPU_SECONDS}s)")
+    raise SandboxError(f"The generated code exceeded the time limit ({SANDBOX_WALL_SECONDS:g}s)")
+
+
+def _init_worker():
+    # Import what generated code usually needs once, not per run.
+    import numpy  # noqa: F401
+    import sklearn.impute  # noqa: F401
+    import sklearn.preprocessing  # noqa: F401
+
+    signal.signal(signal.SIGXCPU, _limit_exceeded)
+    signal.signal(signal.SIGALRM, _limit_exceeded)
+    threading.Thread(target=_exit_with_parent, args=(os.getppid(),), daemon=True).start()
+
+
+def _exit_with_parent(parent):
+    # A pool owned by a job process is not shut down when that process exits
+    # with os._exit; its workers would otherwise outlive it.
+    while os.getppid() == parent:
+        time.sleep(1)
+    os._exit(1)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=SANDBOX_WORKERS, initializer=_init_worker)
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _restart():
+    # A worker that overran its limits (or died) is killed with the pool; the
+    # next call starts a fresh one. Only a pool this process started is
+    # killed: a forked job process must not take down its parent's workers.
+    global _executor
+    if _executor is None:
+        return
+    if _executor_pid == os.getpid():
+        for process in list(getattr(_executor, "_processes", {}).values()):
+            process.kill()
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+
+def _reset_after_fork():
+    # Forked children (background jobs) start their own pool when they need
+    # one, and no slot held by a parent thread is carried over.
+    global _executor, _slots
+    _executor = None
+    _slots = threading.BoundedSemaphore(max(SANDBOX_WORKERS, 1))
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def write_frame(df, path):
+    """Writes ``df`` as an uncompressed Arrow file, or pickles it when its
+    columns cannot be represented in Arrow (e.g. mixed-type objects)."""
+    try:
+        feather.write_feather(df, path, compression="uncompressed")
+        return "arrow"
+    except (pa.ArrowException, TypeError, ValueError):
+        df.to_pickle(path)
+        return "pickle"
+
+
+def read_frame(path, fmt="arrow"):
+    if fmt == "pickle":
+        return pd.read_pickle(path)
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+
+def _memory_limit(input_path, input_format):
+    # The cached input is memory-mapped, and mappings count towards
+    # RLIMIT_AS: the limit applies to what the code allocates on top of it.
+    limit = SANDBOX_MEMORY_MB * 1024 ** 2
+    if input_format == "arrow":
+        limit += os.path.getsize(input_path)
+    return limit
+
+
+def _execute(plan, input_path, input_format, output_path):
+    # Runs in a pool process. RLIMIT_CPU counts the whole process lifetime,
+    # so the limit is set relative to what this worker has used so far.
+    if SANDBOX_MEMORY_MB > 0:
+        _, hard_as = resource.getrlimit(resource.RLIMIT_AS)
+        limit = _memory_limit(input_path, input_format)
+        if hard_as != resource.RLIM_INFINITY:
+            limit = min(limit, hard_as)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard_as))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = usage.ru_utime + usage.ru_stime
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(used) + SANDBOX_CPU_SECONDS
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    signal.setitimer(signal.ITIMER_REAL, SANDBOX_WALL_SECONDS)
+    try:
+        processed_df = code_plans.run(plan, read_frame(input_path, input_format))
+        if not isinstance(processed_df, pd.DataFrame):
+            processed_df = pd.DataFrame(processed_df)
+        return write_frame(processed_df, output_path)
+    except MemoryError:
+        raise SandboxError(f"The generated code exceeded the memory limit ({SANDBOX_MEMORY_MB} MB)")
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, hard))
+        if SANDBOX_MEMORY_MB > 0:
+            resource.setrlimit(resource.RLIMIT_AS, (hard_as, hard_as))
+
+
+def run(plan, df, dataset_id=None):
+    """Runs a generated-code plan on ``df`` in the sandbox pool and returns
+    the processed frame. Pass ``dataset_id`` when ``df`` is a cached dataset
+    so the worker maps the cached file instead of a copy."""
+    with metrics.stage("generated_code") as stage:
+        return stage.frame(_run(plan, df, dataset_id))
+
+
+def _run(plan, df, dataset_id):
+    if SANDBOX_WORKERS <= 0:
+        return code_plans.run(plan, df)
+
+    with tempfile.TemporaryDirectory(dir=SANDBOX_TMP_DIR, prefix="sandbox-") as tmp:
+        input_path, input_format = None, "arrow"
+        if dataset_id is not None:
+            try:
+                input_path = dataset_cache.data_file(dataset_id)
+            except dataset_cache.DatasetNotFound:
+                pass
+        if input_path is None:
+            input_path = os.path.join(tmp, "input")
+            input_format = write_frame(df, input_path)
+        output_path = os.path.join(tmp, "output")
+
+        with _slots:
+            try:
+                try:
+                    future = _get_executor().submit(_execute, plan, input_path, input_format, output_path)
+                except BrokenProcessPool:
+                    # Broken by an earlier call (e.g. a worker killed while
+                    # idle): start a fresh pool and submit again.
+                    _restart()
+                    future = _get_executor().submit(_execute, plan, input_path, input_format, output_path)
+                fmt = future.result(timeout=SANDBOX_WALL_SECONDS + KILL_GRACE_SECONDS)
+            except FutureTimeout:
+                _restart()
+                raise SandboxError(f"The generated code exceeded the time limit ({SANDBOX_WALL_SECONDS:g}s)")
+            except BrokenProcessPool:
+                _restart()
+                raise SandboxError("The process running the generated code was killed (out of memory?)")
+
+        # Mapped pages stay valid after the directory is removed.
+        return read_frame(output_path, fmt)
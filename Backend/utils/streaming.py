@@ -0,0 +1,369 @@
+import numpy as np
+import pandas as pd
+from utils import metrics, outliers
+from utils.data_cleaning import STEPS, NUMERIC_DTYPES, CATEGORICAL_DTYPES
+from utils.dedup import SeenHashes
+
+DEFAULT_CHUNKSIZE = 100_000
+SAMPLE_SIZE = 100_000
+
+
+class QuantileSketch:
+    """Mergeable approximate quantile sketch (KLL-style compactor levels).
+
+    Items on level i stand for 2**i original values. Memory is bounded by
+    roughly k * log2(n / k) floats; below k values the answer is exact.
+    """
+
+    def __init__(self, k=4096, seed=0):
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        self.count += other.count
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                even = len(items) - len(items) % 2
+                promoted = items[self._rng.integers(2):even:2]
+                self.levels[level] = items[even:]
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** i) for i, level in enumerate(self.levels)])
+        return items, weights
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        if len(self.levels) == 1:
+            return float(np.quantile(self.levels[0], q))
+        return weighted_quantile(*self.weighted_items(), q)
+
+    def mad(self):
+        # Median absolute deviation, read off the same weighted items.
+        if self.count == 0:
+            return np.nan
+        median = self.quantile(0.5)
+        if len(self.levels) == 1:
+            return float(np.median(np.abs(self.levels[0] - median)))
+        items, weights = self.weighted_items()
+        return weighted_quantile(np.abs(items - median), weights, 0.5)
+
+
+def weighted_quantile(items, weights, q):
+    order = np.argsort(items)
+    cumulative = np.cumsum(weights[order])
+    rank = q * cumulative[-1]
+    return float(items[order][min(np.searchsorted(cumulative, rank), len(items) - 1)])
+
+
+class Reservoir:
+    """Uniform row sample of bounded size over a stream of chunks.
+
+    Every row gets a random key and the rows with the smallest keys are
+    kept, so samples from different chunks or streams can be merged.
+    """
+
+    def __init__(self, size=SAMPLE_SIZE, seed=42):
+        self.size = size
+        self.sample = None
+        self._keys = np.empty(0)
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, chunk):
+        keys = self._rng.random(len(chunk))
+        if self.sample is None:
+            sample, all_keys = chunk, keys
+        else:
+            sample = pd.concat([self.sample, chunk], ignore_index=True)
+            all_keys = np.concatenate([self._keys, keys])
+        if len(all_keys) > self.size:
+            keep = np.argpartition(all_keys, self.size)[:self.size]
+            sample, all_keys = sample.iloc[keep], all_keys[keep]
+        self.sample = sample.reset_index(drop=True)
+        self._keys = all_keys
+
+
+class ColumnKinds:
+    # Chunks are parsed independently, so a column can come back with a
+    # different dtype per chunk (e.g. float64 in a chunk that is all NaN).
+    # All-null chunks are ignored when deciding what a column is.
+
+    def __init__(self):
+        self.numeric = {}
+        self.categorical = {}
+
+    def update(self, chunk):
+        numeric = set(chunk.select_dtypes(include=NUMERIC_DTYPES).columns)
+        categorical = set(chunk.select_dtypes(include=CATEGORICAL_DTYPES).columns)
+        for col in chunk.columns:
+            if chunk[col].isna().all():
+                continue
+            self.numeric[col] = self.numeric.get(col, True) and col in numeric
+            self.categorical[col] = self.categorical.get(col, True) and col in categorical
+
+    def select(self, which):
+        kinds = self.numeric if which == "numeric" else self.categorical
+        return [col for col, ok in kinds.items() if ok]
+
+
+def _mode(counts):
+    top = counts[counts == counts.max()]
+    return top.index.sort_values()[0]
+
+
+# Streaming fits: (start, update, finalize) per step. Statistics are gathered
+# into bounded-size accumulators and turned into the same params the
+# in-memory fit produces, so the apply functions are shared.
+
+def _start_impute(step):
+    return {"kinds": ColumnKinds(), "count": 0, "sum": 0, "sketches": {}, "counts": {}}
+
+
+def _update_impute(acc, chunk, step):
+    acc["kinds"].update(chunk)
+    subset = chunk.select_dtypes(include=NUMERIC_DTYPES if step["columns"] == "numeric" else CATEGORICAL_DTYPES)
+    columns = subset.columns
+    if not len(columns):
+        return
+    if step["strategy"] == "mean":
+        acc["count"] = subset.count().add(acc["count"], fill_value=0)
+        acc["sum"] = subset.sum().add(acc["sum"], fill_value=0)
+    elif step["strategy"] == "median":
+        for col in columns:
+            acc["sketches"].setdefault(col, QuantileSketch()).update(subset[col].to_numpy())
+    else:
+        for col in columns:
+            counts = subset[col].value_counts()
+            acc["counts"][col] = counts.add(acc["counts"].get(col, 0), fill_value=0)
+
+
+def _finalize_impute(acc, step):
+    columns = acc["kinds"].select(step["columns"])
+    if step["strategy"] == "mean":
+        if not isinstance(acc["sum"], pd.Series):
+            return {"values": {}}
+        values = (acc["sum"] / acc["count"]).reindex(columns)
+    elif step["strategy"] == "median":
+        values = pd.Series({c: acc["sketches"][c].quantile(0.5) for c in columns if c in acc["sketches"]})
+    else:
+        values = pd.Series({c: _mode(acc["counts"][c]) for c in columns if len(acc["counts"].get(c, ()))},
+                           dtype=object)
+    return {"values": values.dropna().to_dict()}
+
+
+def _moments(subset):
+    mean = subset.mean()
+    return subset.count(), mean.fillna(0), ((subset - mean) ** 2).sum()
+
+
+def merge_moments(a, b):
+    # Chan et al. parallel update of (count, mean, sum of squared deviations).
+    if a is None:
+        return b
+    index = a[0].index.union(b[0].index)
+    n_a, mean_a, m2_a = (s.reindex(index, fill_value=0) for s in a)
+    n_b, mean_b, m2_b = (s.reindex(index, fill_value=0) for s in b)
+    n = n_a + n_b
+    safe_n = n.where(n > 0, 1)
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / safe_n, m2_a + m2_b + delta ** 2 * n_a * n_b / safe_n
+
+
+def _start_normalize(step):
+    return {"kinds": ColumnKinds(), "min": None, "max": None, "moments": None}
+
+
+def _update_normalize(acc, chunk, step):
+    acc["kinds"].update(chunk)
+    subset = chunk.select_dtypes(include=NUMERIC_DTYPES)
+    if step["method"] == "minmax":
+        lo, hi = subset.min(), subset.max()
+        acc["min"] = lo if acc["min"] is None else pd.concat([acc["min"], lo], axis=1).min(axis=1)
+        acc["max"] = hi if acc["max"] is None else pd.concat([acc["max"], hi], axis=1).max(axis=1)
+    else:
+        acc["moments"] = merge_moments(acc["moments"], _moments(subset))
+
+
+def _finalize_normalize(acc, step):
+    columns = acc["kinds"].select("numeric")
+    if step["method"] == "minmax":
+        if acc["min"] is None:
+            return {"columns": [], "offset": {}, "scale": {}}
+        offset = acc["min"].reindex(columns).astype(np.float64)
+        scale = acc["max"].reindex(columns).astype(np.float64) - offset
+    else:
+        if acc["moments"] is None:
+            return {"columns": [], "offset": {}, "scale": {}}
+        count, mean, m2 = (s.reindex(columns) for s in acc["moments"])
+        offset = mean
+        scale = np.sqrt(m2 / count)
+    scale = scale.where(scale != 0, 1.0)
+    return {"columns": columns, "offset": offset.to_dict(), "scale": scale.to_dict()}
+
+
+def _start_remove_outliers(step):
+    if step["method"] in ("iqr", "mad"):
+        return {"kinds": ColumnKinds(), "sketches": {}}
+    if step["method"] == "zscore":
+        return {"kinds": ColumnKinds(), "moments": None}
+    return {"kinds": ColumnKinds(), "reservoir": Reservoir(outliers.OUTLIER_SAMPLE_ROWS)}
+
+
+def _update_remove_outliers(acc, chunk, step):
+    acc["kinds"].update(chunk)
+    subset = chunk.select_dtypes(include=NUMERIC_DTYPES)
+    if "sketches" in acc:
+        for col in subset.columns:
+            acc["sketches"].setdefault(col, QuantileSketch()).update(subset[col].to_numpy())
+    elif "moments" in acc:
+        mean = subset.mean()
+        acc["moments"] = merge_moments(acc["moments"],
+                                       (subset.count(), mean.fillna(0), ((subset - mean) ** 2).sum()))
+    else:
+        acc["reservoir"].update(subset)
+
+
+def _sketch_stat(acc, columns, stat):
+    return pd.Series({c: stat(acc["sketches"][c]) if c in acc["sketches"] else np.nan for c in columns},
+                     dtype=float)
+
+
+def _finalize_remove_outliers(acc, step):
+    columns = acc["kinds"].select("numeric")
+    method = step["method"]
+    if method == "isolation_forest":
+        return {"columns": columns,
+                "model": outliers.fit_isolation_forest(acc["reservoir"].sample[columns], step["contamination"])}
+
+    k = outliers.threshold_for(step)
+    if method == "iqr":
+        return outliers.iqr_bounds(columns, _sketch_stat(acc, columns, lambda s: s.quantile(0.25)),
+                                   _sketch_stat(acc, columns, lambda s: s.quantile(0.75)), k)
+    if method == "mad":
+        return outliers.bounds(columns, _sketch_stat(acc, columns, lambda s: s.quantile(0.5)),
+                               _sketch_stat(acc, columns, QuantileSketch.mad) / outliers.MAD_SCALE, k)
+    if acc["moments"] is None:
+        return outliers.bounds(columns, pd.Series(np.nan, index=columns), pd.Series(np.nan, index=columns), k)
+    count, mean, m2 = (s.reindex(columns) for s in acc["moments"])
+    return outliers.bounds(columns, mean.where(count > 0), np.sqrt(m2 / count), k)
+
+
+STREAMING_FITS = {
+    "impute": (_start_impute, _update_impute, _finalize_impute),
+    "normalize": (_start_normalize, _update_normalize, _finalize_normalize),
+    "remove_outliers": (_start_remove_outliers, _update_remove_outliers, _finalize_remove_outliers),
+}
+
+
+def _apply_remove_duplicates_chunk(chunk, state):
+    return chunk.loc[state.setdefault("seen", SeenHashes()).new_rows(chunk)]
+
+
+def transform_chunks(chunks, plan, params):
+    # Each call gets its own duplicate-tracking state, so a fresh pass over
+    # the data starts with no rows seen.
+    states = [{} for _ in plan]
+    for chunk in chunks:
+        for step, step_params, state in zip(plan, params, states):
+            if step["step"] == "remove_duplicates":
+                chunk = _apply_remove_duplicates_chunk(chunk, state)
+            else:
+                chunk = STEPS[step["step"]][1](chunk, step, step_params)
+        yield chunk
+
+
+def rescale_accumulator(acc, step, before, after):
+    # Statistics gathered after a normalize step are in its output units. When
+    # a partial fit changes the normalization, values from earlier batches are
+    # mapped to the new units; normalization is linear, so this is exact.
+    if acc is None or step["step"] != "remove_outliers":
+        return
+    for col in after["columns"]:
+        if col not in before["columns"]:
+            continue
+        ratio = before["scale"][col] / after["scale"][col]
+        shift = (before["offset"][col] - after["offset"][col]) / after["scale"][col]
+        if col in acc.get("sketches", {}):
+            sketch = acc["sketches"][col]
+            sketch.levels = [level * ratio + shift for level in sketch.levels]
+        elif acc.get("moments") is not None and col in acc["moments"][0]:
+            count, mean, m2 = acc["moments"]
+            mean[col] = mean[col] * ratio + shift
+            m2[col] = m2[col] * ratio ** 2
+        elif "reservoir" in acc and acc["reservoir"].sample is not None and col in acc["reservoir"].sample:
+            acc["reservoir"].sample[col] = acc["reservoir"].sample[col] * ratio + shift
+
+
+def start_accumulators(plan):
+    return [STREAMING_FITS[step["step"]][0](step) if step["step"] in STREAMING_FITS else None
+            for step in plan]
+
+
+def fit_plan_chunked(read_chunks, plan, accumulators=None, previous=None):
+    # One pass over the data per step that needs statistics; each pass sees
+    # the chunks transformed by the steps fitted before it, so memory stays
+    # bounded by the chunk size plus the accumulators. Accumulators from an
+    # earlier fit are updated in place, so new data is merged into the
+    # statistics gathered so far (a partial fit); `previous` are the params
+    # that fit produced.
+    if accumulators is None:
+        accumulators = start_accumulators(plan)
+    params = []
+    for i, step in enumerate(plan):
+        if accumulators[i] is None:
+            params.append({})
+            continue
+        _, update, finalize = STREAMING_FITS[step["step"]]
+        with metrics.stage(f"fit_chunked.{step['step']}") as stage:
+            rows = columns = 0
+            for chunk in transform_chunks(read_chunks(), plan[:i], params):
+                update(accumulators[i], chunk, step)
+                rows, columns = rows + len(chunk), len(chunk.columns)
+            params.append(finalize(accumulators[i], step))
+            stage.size(rows, columns)
+        if previous is not None and step["step"] == "normalize":
+            for later, acc in zip(plan[i + 1:], accumulators[i + 1:]):
+                rescale_accumulator(acc, later, previous[i], params[i])
+    return params
+
+
+def csv_chunk_reader(source, chunksize=DEFAULT_CHUNKSIZE):
+    # Returns a factory so the same upload can be read once per pass.
+    def read_chunks():
+        if hasattr(source, "seek"):
+            source.seek(0)
+        with pd.read_csv(source, chunksize=chunksize) as reader:
+            yield from reader
+    return read_chunks
+
+
+def stream_csv(read_chunks, plan, params):
+    header = True
+    for chunk in transform_chunks(read_chunks(), plan, params):
+        if len(chunk) or header:
+            yield chunk.to_csv(index=False, header=header)
+            header = False
@@ -0,0 +1,49 @@
+import importlib
+import time
+import pandas as pd
+
+# Heavy modules the routes import on first use. gunicorn.conf.py imports
+# them in the master after the app is preloaded, so forked workers share
+# their pages copy-on-write and the first request in each worker does not
+# pay for the imports.
+HEAVY_MODULES = (
+    "sklearn.ensemble",
+    "sklearn.feature_extraction",
+    "sklearn.feature_selection",
+    "sklearn.impute",
+    "sklearn.preprocessing",
+    "scipy.stats",
+    "matplotlib.figure",
+    "matplotlib.backends.backend_agg",
+    "seaborn",
+    "joblib",
+    "groq",
+)
+
+
+def preload(modules=HEAVY_MODULES):
+    # Must not start threads or process pools: the caller forks afterwards.
+    start = time.perf_counter()
+    loaded = 0
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            loaded += 1
+        except ImportError as e:
+            print(f"Warm-up could not import {name}: {e}")
+
+    # Drawing one chart loads matplotlib's font cache and seaborn's defaults.
+    from utils.charts import render_chart
+    try:
+        render_chart({"kind": "box", "x": "x"}, pd.DataFrame({"x": [0.0, 1.0]}))
+    except Exception as e:
+        print(f"Warm-up could not draw a chart: {e}")
+    # The examples index is loaded (or built, if missing or stale) here
+    # rather than by the first code generation request in every worker.
+    from utils import examples_index
+    try:
+        meta = examples_index.get_index()["meta"]
+        print(f"Warm-up loaded the examples index: {meta['chunks']} chunks, {meta['embedding']} embeddings")
+    except Exception as e:
+        print(f"Warm-up could not load the examples index: {e}")
+    print(f"Warm-up imported {loaded} modules in {time.perf_counter() - start:.1f}s")
@@ -39,6 +39,7 @@ import {
 
 const FileUpload = () => {
   const [downloadUrl, setDownloadUrl] = useState(null);
+  const [downloadName, setDownloadName] = useState("processed_data.xlsx");
   const [file, setFile] = useState(null);
   const [removeNA, setRemoveNA] = useState(true);
   const [columns, setColumns] = useState([]);
@@ -136,7 +137,8 @@ const FileUpload = () => {
     setLoading(true);
     try {
       const response = await uploadFile(file, config);      
-      const url = window.URL.createObjectURL(new Blob([response]));
+      const url = window.URL.createObjectURL(new Blob([response.data]));
+      setDownloadName(response.filename);
       setDownloadUrl(url);
       setLoading(false);
     } catch (error) {
@@ -181,7 +183,8 @@ const FileUpload = () => {
 
     try {
       const response = await uploadFilePrompt(formData);     
-      const url = window.URL.createObjectURL(new Blob([response]));      
+      const url = window.URL.createObjectURL(new Blob([response.data]));      
+      setDownloadName(response.filename);
       setDownloadUrl(url);
       setLoading(false);
     } catch (error) {
@@ -194,7 +197,7 @@ const FileUpload = () => {
     if (downloadUrl) {
       const link = document.createElement("a");
       link.href = downloadUrl;
-      link.setAttribute("download", "processed_data.xlsx");
+      link.setAttribute("download", downloadName);
       document.body.appendChild(link);
       link.click();
       link.remove();
@@ -2,6 +2,14 @@ import axios from 'axios';
 
 const BASE_URL = process.env.REACT_APP_API_BASE_URL;
 
+// Large results are sent as CSV rather than Excel, so downloads are saved
+// under the file name the server gives.
+const downloadName = (response) => {
+    const disposition = response.headers['content-disposition'] || '';
+    const match = disposition.match(/filename="?([^";]+)"?/);
+    return match ? match[1] : 'processed_data.xlsx';
+};
+
 
 export const uploadFile = async (file, config) => {
     const formData = new FormData();
@@ -13,7 +21,7 @@ export const uploadFile = async (file, config) => {
             responseType: 'blob', 
             headers: { 'Content-Type': 'multipart/form-data' }
         });
-        return response.data;
+        return { data: response.data, filename: downloadName(response) };
     } catch (error) {
         console.error("Error uploading file:", error);
         throw error;
@@ -27,7 +35,7 @@ export const uploadFilePrompt = async (formData) => {
             responseType: 'blob', 
             headers: { 'Content-Type': 'multipart/form-data' }
         });
-        return response.data;
+        return { data: response.data, filename: downloadName(response) };
     } catch (error) {
         console.error("Error uploading file:", error);
         throw error;
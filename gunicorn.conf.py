@@ -0,0 +1,26 @@
+import os
+
+# gunicorn reads ./gunicorn.conf.py, so these settings apply to the Procfile
+# command, which runs from the repository root.
+#
+# The app is loaded once in the master before workers are forked, and the
+# warm-up hook then imports the heavy modules the routes load lazily
+# (sklearn, scipy, matplotlib, seaborn, ...) and loads the examples
+# retrieval index. Workers start with nothing left to import and share
+# those pages copy-on-write.
+#
+# GUNICORN_PRELOAD=0 loads the app in each worker instead (e.g. for
+# --reload); GUNICORN_WARMUP=0 keeps preloading but skips the warm-up.
+
+# The app imports `routes` and `utils` as top-level packages.
+pythonpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Backend")
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+warmup = os.getenv("GUNICORN_WARMUP", "1") == "1"
+
+
+def when_ready(server):
+    # Runs in the master once the app is loaded, before any worker forks.
+    if preload_app and warmup:
+        from utils.warmup import preload
+        preload()